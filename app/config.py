@@ -1,10 +1,17 @@
 import os
+from functools import lru_cache
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field
 
 class Settings(BaseSettings):
 	fal_key: str = Field(..., alias="FAL_KEY")
 	fal_endpoint: str = Field("fal-ai/flux-pro", alias="FAL_ENDPOINT")
+	# Пул эндпоинтов fal для постановки задач: "endpoint[@вес][:предел],..." (см. app/services/fal_router.py)
+	fal_endpoints: str | None = Field(None, alias="FAL_ENDPOINTS")
+	# База HTTP Queue API fal.ai (переопределяется для локальных заглушек в бенчмарках)
+	fal_queue_base: str = Field("https://queue.fal.run", alias="FAL_QUEUE_BASE")
+	# Интервал опроса статусов очереди fal фоновым потоком
+	poll_interval_seconds: float = Field(20.0, alias="POLL_INTERVAL_SECONDS")
 	port: int = Field(8000, alias="PORT")
 
 	# Yandex Pay
@@ -21,6 +28,8 @@ class Settings(BaseSettings):
 	# поддержка альтернативного имени переменной SMTP_SERVER
 	smtp_server: str | None = Field(None, alias="SMTP_SERVER")
 	smtp_port: int = Field(465, alias="SMTP_PORT")
+	# False — обычный SMTP без TLS (локальный sink в бенчмарках)
+	smtp_use_ssl: bool = Field(True, alias="SMTP_USE_SSL")
 	# поддержка альтернативного имени пользователя SMTP_USERNAME
 	smtp_email: str | None = Field(None, alias="SMTP_EMAIL")
 	smtp_username: str | None = Field(None, alias="SMTP_USERNAME")
@@ -33,6 +42,10 @@ class Settings(BaseSettings):
 	s3_bucket_name: str | None = Field(None, alias="S3_BUCKET_NAME")
 	s3_region_name: str | None = Field(None, alias="S3_REGION_NAME")
 	s3_presign_ttl_seconds: int = Field(259200, alias="S3_PRESIGN_TTL_SECONDS")
+	# Таймауты и число попыток (включая первую) вызовов S3; бюджет запроса проверяется перед каждым вызовом
+	s3_connect_timeout_seconds: float = Field(5.0, alias="S3_CONNECT_TIMEOUT_SECONDS")
+	s3_read_timeout_seconds: float = Field(30.0, alias="S3_READ_TIMEOUT_SECONDS")
+	s3_max_attempts: int = Field(3, alias="S3_MAX_ATTEMPTS")
 	uploads_prefix: str = Field("uploads/", alias="UPLOADS_PREFIX")
 	videos_prefix: str = Field("video/", alias="VIDEOS_PREFIX")
 
@@ -50,6 +63,98 @@ class Settings(BaseSettings):
 	yookassa_api_key: str | None = Field(None, alias="YOOKASSA_API_KEY")
 	yookassa_api_base: str = Field("https://api.yookassa.ru", alias="YOOKASSA_API_BASE")
 	yookassa_webhook_secret: str | None = Field(None, alias="YOOKASSA_WEBHOOK_SECRET")
+	# Клиент YooKassa: размер пула соединений и число повторов при временных сбоях (с тем же Idempotence-Key)
+	yookassa_pool_size: int = Field(10, alias="YOOKASSA_POOL_SIZE")
+	yookassa_max_retries: int = Field(2, alias="YOOKASSA_MAX_RETRIES")
+
+	# Админские эндпоинты (/admin/*): токен в заголовке X-Admin-Token; без токена — отключены
+	admin_token: str | None = Field(None, alias="ADMIN_TOKEN")
+
+	# Трассировка этапов заявки: OTLP/JSON-файлы
+	traces_dir: str = Field("traces", alias="TRACES_DIR")
+
+	# Логи: директория дневных файлов, сэмплирование DEBUG/INFO по логгерам ("livephoto.polling=0.2,livephoto.fal=0.5")
+	log_dir: str = Field("all_logs", alias="LOG_DIR")
+	log_sampling: str | None = Field(None, alias="LOG_SAMPLING")
+	log_queue_size: int = Field(10000, alias="LOG_QUEUE_SIZE")
+
+	# Профилирование (/admin/profile, заголовок X-Profile): куда сохранять collapsed stacks
+	profiles_dir: str = Field("profiles", alias="PROFILES_DIR")
+
+	# Архив старых дневных файлов заявок (logs/archive): возраст в днях (0 — не архивировать), gzip|zstd
+	archive_after_days: int = Field(30, alias="ARCHIVE_AFTER_DAYS")
+	archive_compression: str = Field("gzip", alias="ARCHIVE_COMPRESSION")
+
+	# Хранение (app/services/retention_service.py): сроки в днях, 0 — политика выключена;
+	# RETENTION_ENABLED — ежедневный автоматический прогон с удалением
+	retention_enabled: bool = Field(False, alias="RETENTION_ENABLED")
+	retention_inputs_days: int = Field(14, alias="RETENTION_INPUTS_DAYS")
+	retention_videos_days: int = Field(7, alias="RETENTION_VIDEOS_DAYS")
+	retention_unpaid_days: int = Field(3, alias="RETENTION_UNPAID_DAYS")
+	retention_state_path: str = Field("retention_state.json", alias="RETENTION_STATE_PATH")
+
+	# Прокси видео GET /video/{order_id}/{index}: стабильные ссылки вместо presigned + кэш горячих видео на диске
+	video_proxy_links: bool = Field(True, alias="VIDEO_PROXY_LINKS")
+	video_cache_dir: str = Field("video_cache", alias="VIDEO_CACHE_DIR")
+	video_cache_max_bytes: int = Field(2 * 1024 ** 3, alias="VIDEO_CACHE_MAX_BYTES")
+
+	# Кэш скачанных у fal видео (общий для поллера, /fal/webhook и /results)
+	fal_video_cache_dir: str = Field("fal_video_cache", alias="FAL_VIDEO_CACHE_DIR")
+	fal_video_cache_max_bytes: int = Field(1024 ** 3, alias="FAL_VIDEO_CACHE_MAX_BYTES")
+
+	# Схлопывание работы над одним элементом заявки между воркерами uvicorn: директория файловых блокировок
+	# (не задана — только внутри процесса)
+	item_lock_dir: str | None = Field(None, alias="ITEM_LOCK_DIR")
+
+	# Отказоустойчивость: бюджет времени входящего запроса на исходящие вызовы и повторы элементов
+	# в состоянии retry_later (экспоненциальная пауза от RETRY_BASE_SECONDS до RETRY_MAX_SECONDS)
+	request_deadline_seconds: float = Field(25.0, alias="REQUEST_DEADLINE_SECONDS")
+	retry_max_attempts: int = Field(6, alias="RETRY_MAX_ATTEMPTS")
+	retry_base_seconds: float = Field(30.0, alias="RETRY_BASE_SECONDS")
+	retry_max_seconds: float = Field(1800.0, alias="RETRY_MAX_SECONDS")
+
+	# Пулы потоков для блокирующих вызовов из async-обработчиков, отдельные на каждую зависимость,
+	# чтобы медленная зависимость не занимала потоки остальных
+	executor_store_workers: int = Field(8, alias="EXECUTOR_STORE_WORKERS")
+	executor_s3_workers: int = Field(16, alias="EXECUTOR_S3_WORKERS")
+	executor_fal_workers: int = Field(16, alias="EXECUTOR_FAL_WORKERS")
+	executor_smtp_workers: int = Field(4, alias="EXECUTOR_SMTP_WORKERS")
+	executor_yookassa_workers: int = Field(8, alias="EXECUTOR_YOOKASSA_WORKERS")
+
+	# Допуск к дорогим маршрутам (/create_order, /generate_video): token bucket на anonUserId и IP
+	# (0 — без лимита), предел одновременных запросов на процесс и очередь к нему.
+	# ADMISSION_DB_PATH — sqlite с корзинами, общий для воркеров; пусто — только в памяти процесса
+	admission_enabled: bool = Field(True, alias="ADMISSION_ENABLED")
+	admission_db_path: str | None = Field("logs/admission.sqlite3", alias="ADMISSION_DB_PATH")
+	admission_user_rate_per_minute: float = Field(6.0, alias="ADMISSION_USER_RATE_PER_MINUTE")
+	admission_user_burst: float = Field(5.0, alias="ADMISSION_USER_BURST")
+	admission_ip_rate_per_minute: float = Field(20.0, alias="ADMISSION_IP_RATE_PER_MINUTE")
+	admission_ip_burst: float = Field(10.0, alias="ADMISSION_IP_BURST")
+	admission_max_concurrency: int = Field(16, alias="ADMISSION_MAX_CONCURRENCY")
+	admission_max_queue: int = Field(32, alias="ADMISSION_MAX_QUEUE")
+	admission_queue_timeout_seconds: float = Field(10.0, alias="ADMISSION_QUEUE_TIMEOUT_SECONDS")
+	# Брать IP клиента из X-Forwarded-For (только за доверенным прокси)
+	trust_forwarded_for: bool = Field(False, alias="TRUST_FORWARDED_FOR")
+
+	# Приоритетный планировщик работы по генерации (постановка в fal, опрос, перекладка видео):
+	# полосы `имя@вес` (first — первая заявка пользователя, standard, retry — повторы, bulk — заявки
+	# от SCHEDULER_BULK_ITEMS элементов), число потоков и предельное ожидание задачи в полосе
+	scheduler_lanes: str = Field("first@4,standard@3,retry@1,bulk@1", alias="SCHEDULER_LANES")
+	scheduler_workers: int = Field(16, alias="SCHEDULER_WORKERS")
+	scheduler_max_wait_seconds: float = Field(60.0, alias="SCHEDULER_MAX_WAIT_SECONDS")
+	scheduler_bulk_items: int = Field(6, alias="SCHEDULER_BULK_ITEMS")
+
+	# Остановка и восстановление: сколько секунд при остановке процесса даётся на завершение опроса,
+	# перекладок и писем; через сколько секунд без изменений прерванная работа заявки (постановка
+	# в fal, письмо о готовности) считается брошенной и подхватывается поллером любого процесса
+	shutdown_grace_seconds: float = Field(25.0, alias="SHUTDOWN_GRACE_SECONDS")
+	recovery_stale_seconds: float = Field(120.0, alias="RECOVERY_STALE_SECONDS")
+
+	# Сверка застрявших заявок (app/services/reconcile_service.py): файл состояния прогона,
+	# параллельные запросы к fal/S3 и через сколько секунд без результата элемент в fal считается застрявшим
+	reconcile_state_path: str = Field("reconcile_state.json", alias="RECONCILE_STATE_PATH")
+	reconcile_concurrency: int = Field(16, alias="RECONCILE_CONCURRENCY")
+	reconcile_stale_seconds: float = Field(3600.0, alias="RECONCILE_STALE_SECONDS")
 
 	model_config = SettingsConfigDict(
 		env_file=".env",
@@ -58,6 +163,21 @@ class Settings(BaseSettings):
 		extra="ignore",
 	)
 
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+	"""Settings строятся при первом обращении (чтение .env и окружения), а не при импорте."""
+	return Settings()
+
+
+class _LazySettings:
+	"""Прокси к get_settings(): `from app.config import settings` не создаёт Settings при импорте."""
+
+	__slots__ = ()
+
+	def __getattr__(self, name: str):
+		return getattr(get_settings(), name)
+
+
+settings = _LazySettings()
 
 
@@ -1,25 +1,35 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi import Depends, FastAPI, File, UploadFile, Form, HTTPException
 from fastapi.responses import JSONResponse
 from app.utils.file_utils import save_upload_to_temp, save_multiple_uploads_to_temp, JsonOrderStore
-from app.services.fal_service import upload_file_and_generate, generate_multiple
-from app.services.yookassa_service import create_payment as yk_create_payment
 from typing import List, Optional
 import uuid
 import hmac, hashlib, base64
 from fastapi import Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from app.config import settings
+from app.config import settings, get_settings
 from app.services.email_service import send_email_with_links
-from app.services.email_service import send_payment_receipt
 from app.services.email_service import send_email_with_attachments
 from app.services.fal_service import generate_from_url, submit_generation
 
 # new imports
-from app.utils.s3_utils import upload_bytes, s3_key_for_upload, get_file_url_with_expiry
+from app.utils.s3_utils import s3_key_for_upload
+from app.utils import metrics, tracing, profiler
+from app.utils.singleflight import SingleFlight
+from app.utils.resilience import CircuitOpenError, breaker_states, deadline, is_transient
+from app.models.schemas import ItemStatus, GenerationItem, GenerationStatus, Order, public_video_fields
+from app.services.retention_service import RetentionJob, retention_job
+from app.services.reconcile_service import ReconcileJob, reconcile_job
+from app.services import aio, fal_router
+from app.utils import executors
+from app.utils.scheduler import scheduler
+from app.utils.admission import AdmissionController, AdmissionRejected, admission_controller
+import asyncio
+import math
+from collections import OrderedDict
 import os
 import json
 import logging
-from logging.handlers import TimedRotatingFileHandler
+from app.utils.logging_setup import configure_logging, shutdown_logging
 from datetime import datetime, timedelta, timezone
 from urllib.parse import urlparse, parse_qs
 
@@ -34,72 +44,107 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+
+# Метрики: латентность по шаблону маршрута (а не по сырому пути, чтобы не раздувать кардинальность)
+@app.middleware("http")
+async def _http_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", None) or "unmatched"
+        metrics.HTTP_REQUEST_SECONDS.labels(request.method, route_path, str(status)).observe(time.perf_counter() - start)
+
+
+@app.middleware("http")
+async def _request_deadline(request: Request, call_next):
+    # бюджет времени запроса ограничивает таймауты всех исходящих вызовов (fal, S3, YooKassa, SMTP)
+    with deadline(settings.request_deadline_seconds):
+        return await call_next(request)
+
+
+# Профилирование отдельного запроса: заголовок X-Profile + X-Admin-Token.
+# Стеки всех потоков снимаются на время запроса, файл сохраняется в PROFILES_DIR,
+# имя возвращается в заголовке X-Profile-File (скачать: /admin/profiles/{name}).
+@app.middleware("http")
+async def _request_profiling(request: Request, call_next):
+    if not request.headers.get("X-Profile") or not _is_admin(request):
+        return await call_next(request)
+    interval_ms = request.headers.get("X-Profile-Interval-Ms")
+    try:
+        interval = float(interval_ms) if interval_ms else 2.0
+    except ValueError:
+        interval = math.nan
+    if not math.isfinite(interval):
+        return JSONResponse(status_code=400, content={"detail": "X-Profile-Interval-Ms: expected a number of milliseconds"})
+    sampler = profiler.SamplingProfiler(interval=max(1.0, interval) / 1000).start()
+    try:
+        response = await call_next(request)
+    finally:
+        sampler.stop()
+    name = profiler.save_profile(sampler.collapsed(), settings.profiles_dir, label=f"{request.method}-{request.url.path}")
+    response.headers["X-Profile-File"] = name
+    return response
+
+
+# Лёгкая проверка живости: не трогает хранилище и внешние клиенты
+@app.get("/healthz")
+async def healthz():
+    return {"ok": True}
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    body, content_type = metrics.render_latest()
+    return Response(content=body, media_type=content_type)
+
+
 orders = JsonOrderStore()
-import threading, time
+# async-обработчики работают с хранилищем только через пул "store"
+aorders = aio.AsyncOrderStore(orders)
+_retention_instance: RetentionJob | None = None
 
-# Логгер для поллинга
-logger = logging.getLogger("livephoto.polling")
-if not logger.handlers:
-    h = logging.StreamHandler()
-    formatter = logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s")
-    h.setFormatter(formatter)
-    logger.addHandler(h)
-    logger.setLevel(logging.INFO)
-
-# Файловое логирование: дневные файлы в all_logs/{YYYY-MM-DD}.json
-try:
-    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-    all_logs_dir = os.path.join(base_dir, "all_logs")
-    os.makedirs(all_logs_dir, exist_ok=True)
-
-    file_handler = TimedRotatingFileHandler(
-        os.path.join(all_logs_dir, "app.log"),
-        when="midnight",
-        interval=1,
-        backupCount=30,
-        encoding="utf-8",
-        utc=True,
-    )
-    # Имена файлов вида {YYYY-MM-DD}.json
-    file_handler.suffix = "%Y-%m-%d"
 
-    def _daily_json_namer(default_name: str) -> str:
-        # default_name заканчивается на ".YYYY-MM-DD"
-        dir_name = os.path.dirname(default_name)
-        date_suffix = default_name.rsplit(".", 1)[-1]
-        return os.path.join(dir_name, f"{date_suffix}.json")
+def _retention() -> RetentionJob:
+    """Задача хранения; создаётся при первом обращении (читает настройки не при импорте)."""
+    global _retention_instance
+    if _retention_instance is None:
+        _retention_instance = retention_job(orders)
+    return _retention_instance
 
-    file_handler.namer = _daily_json_namer
-    file_formatter = logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s")
-    file_handler.setFormatter(file_formatter)
 
-    root_logger = logging.getLogger()
-    root_logger.setLevel(logging.INFO)
-    root_logger.addHandler(file_handler)
+import threading, time
 
-    # Добавим handler к основным логгерам сервера (uvicorn/fastapi), чтобы писать все логи
-    for _name in ("uvicorn", "uvicorn.error", "uvicorn.access", "fastapi", "livephoto.polling"):
-        logging.getLogger(_name).addHandler(file_handler)
-except Exception:
-    # Не мешаем запуску приложения, если конфигурация логов не удалась
-    pass
+# Логгер для поллинга; вывод (файл + консоль) настраивает неблокирующий конвейер logging_setup
+logger = logging.getLogger("livephoto.polling")
 
 
-def _is_presigned_expired(url: str | None, expires_in: int | None, created_at_iso: str | None) -> bool:
-    """Возвращает True, если presigned URL, вероятно, истёк.
+def _setup_file_logging() -> None:
+    # Файловое логирование: дневные файлы в all_logs/{YYYY-MM-DD}.json (JSON-строки)
+    log_dir = settings.log_dir
+    if not os.path.isabs(log_dir):
+        log_dir = os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")), log_dir)
+    configure_logging(log_dir, sampling=settings.log_sampling, queue_size=settings.log_queue_size)
+
+
+def _presigned_expires_at(url: str | None, expires_in: int | None, created_at_iso: str | None) -> datetime | None:
+    """Возвращает момент истечения presigned URL (UTC) или None, если его не определить.
 
     Пытаемся сначала использовать сохранённые expires_in + created_at, иначе парсим X-Amz-Date/X-Amz-Expires.
     """
     try:
-        now = datetime.utcnow().replace(tzinfo=timezone.utc)
         # Вариант 1: используем сохранённые значения
         if created_at_iso and expires_in:
             try:
                 created = datetime.fromisoformat(created_at_iso)
                 if created.tzinfo is None:
                     created = created.replace(tzinfo=timezone.utc)
-                expires_at = created + timedelta(seconds=int(expires_in))
-                return now >= expires_at
+                return created + timedelta(seconds=int(expires_in))
             except Exception:
                 pass
 
@@ -114,13 +159,90 @@ def _is_presigned_expired(url: str | None, expires_in: int | None, created_at_is
                 amz_exp = int(amz_exp_vals[0])
                 # Формат: YYYYMMDDTHHMMSSZ
                 created = datetime.strptime(amz_date, "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
-                expires_at = created + timedelta(seconds=amz_exp)
-                return now >= expires_at
+                return created + timedelta(seconds=amz_exp)
     except Exception:
+        return None
+    return None
+
+
+def _is_presigned_expired(url: str | None, expires_in: int | None, created_at_iso: str | None) -> bool:
+    """Возвращает True, если presigned URL, вероятно, истёк."""
+    expires_at = _presigned_expires_at(url, expires_in, created_at_iso)
+    if expires_at is None:
         return False
+    return datetime.utcnow().replace(tzinfo=timezone.utc) >= expires_at
+
+
+# Условные GET: ETag строится из order_id и версии заявки в хранилище
+def _order_etag(order_id: str, version: int) -> str:
+    return f'"{order_id}.{version}"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == etag:
+            return True
     return False
 
-@app.post("/generate_video")
+
+# --- Допуск к дорогим маршрутам: лимиты на клиента и общий предел параллельности ---
+
+_admission_instance: AdmissionController | None = None
+
+
+def _admission() -> AdmissionController:
+    global _admission_instance
+    if _admission_instance is None:
+        _admission_instance = admission_controller()
+    return _admission_instance
+
+
+def _client_ip(request: Request) -> str | None:
+    if settings.trust_forwarded_for:
+        forwarded = request.headers.get("X-Forwarded-For")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else None
+
+
+@app.exception_handler(AdmissionRejected)
+async def _admission_rejected(request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=exc.status,
+        content={"error": exc.reason, "retry_after": exc.retry_after},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+async def _admit_generate(request: Request):
+    if not settings.admission_enabled:
+        yield
+        return
+    async with _admission().admit("generate_video", client_ip=_client_ip(request)):
+        yield
+
+
+async def _admit_order(request: Request, anonUserId: str = Form(...)):
+    if not settings.admission_enabled:
+        yield
+        return
+    async with _admission().admit("create_order", anon_user_id=anonUserId, client_ip=_client_ip(request)):
+        yield
+
+
+# order_id -> (version, момент истечения ближайшей ссылки) для последнего ответа /results;
+# LRU не больше _RESULTS_FRESH_MAX заявок, истёкшие записи удаляются при чтении
+_RESULTS_FRESH_MAX = 10000
+_results_fresh: "OrderedDict[str, tuple[int, datetime | None]]" = OrderedDict()
+
+
+@app.post("/generate_video", dependencies=[Depends(_admit_generate)])
 async def generate_video(
     image: UploadFile = File(...),
     prompt: str = Form("Animate this image"),
@@ -128,7 +250,7 @@ async def generate_video(
 ):
     tmp_path = await save_upload_to_temp(image)
     try:
-        result = upload_file_and_generate(tmp_path, prompt=prompt, sync_mode=sync_mode)
+        result = await aio.fal_upload_and_generate(tmp_path, prompt=prompt, sync_mode=sync_mode)
         return JSONResponse(content=result)
     except HTTPException:
         raise
@@ -140,7 +262,7 @@ async def generate_video(
             os.remove(tmp_path)
 
 
-@app.post("/create_order")
+@app.post("/create_order", dependencies=[Depends(_admit_order)])
 async def create_order(
     email: str = Form(...),
     price_rub: float = Form(...),
@@ -149,6 +271,7 @@ async def create_order(
     anonUserId: str = Form(...),
 ):
     # 1) сохраняем входные файлы в S3
+    started_at = tracing.now()
     request_id = f"order-{uuid.uuid4().hex[:8]}"
     images_meta = []
     files = files or []
@@ -163,9 +286,9 @@ async def create_order(
         content = await upload.read()
         filename = upload.filename or f"file_{idx}"
         key = s3_key_for_upload(anonUserId, request_id, filename)
-        upload_bytes(settings.s3_bucket_name or "", key, content, content_type=upload.content_type)
+        await aio.s3_upload_bytes(settings.s3_bucket_name or "", key, content, content_type=upload.content_type)
         s3_url = f"s3://{settings.s3_bucket_name}/{key}"
-        public_url, exp = get_file_url_with_expiry(settings.s3_bucket_name or "", key)
+        public_url, exp = await aio.s3_presign(settings.s3_bucket_name or "", key)
         prompt_val = (prompts_list[idx] if prompts_list and idx < len(prompts_list) else "Animate this image")
         images_meta.append({
             "s3_url": s3_url,
@@ -182,6 +305,7 @@ async def create_order(
         "anonUserId": anonUserId,
         "email": email,
         "price_rub": price_rub,
+        "created_at": started_at.isoformat(),
         "payment": {
             "provider": "yookassa",
             "status": "gateway_pending",
@@ -204,7 +328,7 @@ async def create_order(
     }
     # создаем платёж в YooKassa и сохраняем payment_id + paymentUrl
     try:
-        payment = yk_create_payment(
+        payment = await aio.yk_create_payment(
             order_id=request_id,
             amount_rub=price_rub,
             description=f"Video generation {len(images_meta)} item(s)",
@@ -220,7 +344,8 @@ async def create_order(
         # если не удалось создать платёж, остаемся в gateway_pending без URL
         order_record["payment"].update({"error": str(e)})
 
-    orders.save(order_record)
+    tracing.record_span(order_record, "create_order", started_at, items=len(images_meta))
+    await aorders.save(order_record)
     return {
         "orderId": request_id,
         "paymentStatus": order_record["payment"]["status"],
@@ -243,15 +368,16 @@ async def yandex_pay_webhook(request: Request):
     raw = await request.body()
     sign = request.headers.get("X-Signature") or request.headers.get("Signature")
     if not _verify_webhook_signature(raw, sign):
+        metrics.webhook_event("yandex_pay", "bad_signature")
         return Response(status_code=400)
     payload = await request.json()
     order_id = payload.get("orderId") or payload.get("merchantOrderId")
     status = payload.get("status")
     if order_id:
         if status in ("PAID", "CAPTURED", "COMPLETED"):
-            orders.update_status(order_id, "PAID")
+            await aorders.update_status(order_id, "PAID")
             # простая синхронная обработка (для MVP); в продакшн вынести в очередь
-            order = orders.load(order_id)
+            order = await aorders.load(order_id)
             if order:
                 prompts = None
                 try:
@@ -259,20 +385,248 @@ async def yandex_pay_webhook(request: Request):
                     prompts = _json.loads(order.get("prompts") or "null")
                 except Exception:
                     prompts = None
-                results = generate_multiple(order.get("files") or [], prompts=prompts or None, sync_mode=True)
+                results = await aio.fal_generate_multiple(order.get("files") or [], prompts=prompts or None, sync_mode=True)
                 links: List[str] = []
                 for r in results:
                     url = r.get("response_url") or r.get("url") or r.get("video_url")
                     if url:
                         links.append(url)
                 if order.get("email") and links:
-                    send_email_with_links(order["email"], links, request_id=order_id)
-                orders.update_status(order_id, "COMPLETED")
+                    await aio.send_email_with_links(order["email"], links, request_id=order_id)
+                await aorders.update_status(order_id, "COMPLETED")
+            metrics.webhook_event("yandex_pay", "paid")
         else:
-            orders.update_status(order_id, f"STATUS_{status}")
+            await aorders.update_status(order_id, f"STATUS_{status}")
+            metrics.webhook_event("yandex_pay", "status_update")
+    else:
+        metrics.webhook_event("yandex_pay", "ignored")
     return {"ok": True}
 
 
+# --- Применение результатов к заявке ---
+# Сетевые вызовы (fal, S3, SMTP) делаем вне блокировки хранилища, а в заявку под блокировкой
+# вносим только готовые изменения элементов: так параллельные обработчики (поллер, вебхуки,
+# /results, другие воркеры) не затирают результаты друг друга.
+
+_TERMINAL_ITEM_STATUSES = (ItemStatus.SUCCEEDED.value, ItemStatus.FAILED.value)
+
+
+def _failure_patch(item: dict, exc: BaseException) -> dict:
+    """Изменения элемента после ошибки: временный сбой зависимости — retry_later с паузой, иначе failed."""
+    attempts = int(item.get("attempts") or 0) + 1
+    if is_transient(exc) and attempts < settings.retry_max_attempts:
+        pause = min(settings.retry_max_seconds, settings.retry_base_seconds * 2 ** (attempts - 1))
+        if isinstance(exc, CircuitOpenError):
+            pause = max(pause, exc.retry_after)
+        return {
+            "status": ItemStatus.RETRY_LATER.value,
+            "attempts": attempts,
+            "retry_at": (datetime.utcnow() + timedelta(seconds=pause)).isoformat(),
+            "error": str(exc),
+        }
+    return {"status": ItemStatus.FAILED.value, "attempts": attempts, "error": str(exc)}
+
+
+def _submit_item(order_id: str, anon_user_id: Optional[str], idx: int, it: dict, spans: list[dict | None]) -> dict:
+    """Ставит элемент в очередь fal и возвращает его изменения (running или retry_later/failed)."""
+    from app.utils.s3_utils import parse_s3_url, get_file_url_with_expiry
+
+    patch: dict = {}
+    try:
+        # Предпочитаем заранее сохранённую публичную ссылку
+        img_url = it.get("public_image_url")
+        if not img_url:
+            bucket, key = parse_s3_url(it.get("input_s3_url", ""))
+            img_url, exp = get_file_url_with_expiry(bucket, key)
+            patch["public_image_url"] = img_url
+            patch["expires_in"] = exp
+        submit_started = tracing.now()
+        sub = submit_generation(img_url, it.get("prompt") or "Animate this image", order_id, idx, anon_user_id)
+        spans.append(tracing.make_span("fal_submit", submit_started, item_index=idx))
+        patch.update({
+            "status": ItemStatus.RUNNING.value,
+            "request_id": sub.get("request_id"),
+            "submitted_at": tracing.now().isoformat(),
+            "retry_at": None,
+            "error": None,
+        })
+        if sub.get("model_id"):
+            patch["model_id"] = sub["model_id"]
+        if sub.get("endpoint"):
+            patch["fal_endpoint"] = sub["endpoint"]
+    except fal_router.EndpointsSaturated as _e:
+        # пул fal на пределе параллельности — придерживаем элемент, попытка не расходуется
+        patch.update({
+            "status": ItemStatus.RETRY_LATER.value,
+            "retry_at": (datetime.utcnow() + timedelta(seconds=_e.retry_after)).isoformat(),
+            "error": str(_e),
+        })
+    except Exception as _e:
+        patch.update(_failure_patch(it, _e))
+    return patch
+
+
+def _interrupted_patch() -> dict:
+    """Элемент, работа над которым прервана остановкой процесса: повтор поллером без паузы."""
+    return {"status": ItemStatus.RETRY_LATER.value, "retry_at": datetime.utcnow().isoformat(), "error": "interrupted"}
+
+
+def _work_lane(anon_user_id: Optional[str], item_count: int, attempts: int = 0) -> str:
+    """Полоса планировщика для работы по элементу: повтор, крупная заявка, первая заявка пользователя."""
+    if attempts:
+        return "retry"
+    if item_count >= settings.scheduler_bulk_items:
+        return "bulk"
+    if anon_user_id and len(orders.user_index.page(anon_user_id, 2)) <= 1:
+        return "first"
+    return "standard"
+
+
+def _apply_item_results(order_id: str, patches: dict[int, dict], spans: list[dict | None] | None = None, generation: dict | None = None) -> tuple[dict | None, bool]:
+    """Вносит изменения элементов, полей generation и отрезки трассы одной атомарной записью.
+
+    Успешный элемент не затирается ошибкой из параллельного обработчика.
+    Возвращает (актуальная заявка, заявка завершилась именно этим изменением).
+    """
+    completed_now = False
+
+    def _mutate(order: dict) -> None:
+        nonlocal completed_now
+        gen = order.setdefault("generation", {})
+        items = gen.get("items") or []
+        for idx, patch in patches.items():
+            if idx < 0 or idx >= len(items):
+                continue
+            if items[idx].get("status") == ItemStatus.SUCCEEDED.value and patch.get("status") in (ItemStatus.FAILED.value, ItemStatus.RETRY_LATER.value):
+                continue
+            for k, v in patch.items():
+                # None в изменении — снять поле (retry_at/error после успешного повтора)
+                if v is None:
+                    items[idx].pop(k, None)
+                else:
+                    items[idx][k] = v
+        for span in spans or []:
+            tracing.add_span(order, span)
+        for k, v in (generation or {}).items():
+            if v is None:
+                gen.pop(k, None)
+            else:
+                gen[k] = v
+        gen["items"] = items
+        if items and gen.get("status") != GenerationStatus.COMPLETED.value and all(x.get("status") in _TERMINAL_ITEM_STATUSES for x in items):
+            gen["status"] = GenerationStatus.COMPLETED.value
+            gen["completed_at"] = datetime.utcnow().isoformat()
+            # отметка снимается после письма: если процесс упадёт раньше, письмо отправит восстановление
+            gen["notify_pending"] = True
+            completed_now = True
+
+    order = orders.update(order_id, _mutate)
+    return order, completed_now
+
+
+def _rehost_video(order_id: str, anon_user_id: Optional[str], idx: int, media_url: str, spans: list[dict | None], fal_request_id: Optional[str] = None) -> dict:
+    """Скачивает видео у fal, кладёт в наш S3 и возвращает изменения элемента со ссылками."""
+    from app.services.fal_service import fetch_video_bytes
+    from app.utils.s3_utils import s3_key_for_video, upload_bytes as _upload_bytes, get_file_url_with_expiry as _gfue
+
+    rehost_started = tracing.now()
+    video_bytes = fetch_video_bytes(media_url, request_id=fal_request_id, timeout=180)
+    video_key = s3_key_for_video(anon_user_id or "user", order_id, idx, ".mp4")
+    _upload_bytes(settings.s3_bucket_name or "", video_key, video_bytes, content_type="video/mp4")
+    spans.append(tracing.make_span("s3_rehost", rehost_started, item_index=idx, bytes=len(video_bytes)))
+    result_s3_url = f"s3://{settings.s3_bucket_name}/{video_key}"
+    # Сохраняем публичную ссылку и TTL
+    pub_url, exp = _gfue(settings.s3_bucket_name or "", video_key)
+    return {
+        "status": ItemStatus.SUCCEEDED.value,
+        "result_s3_url": result_s3_url,
+        **public_video_fields(pub_url, exp),
+        # Дублируем поле s3 для симметрии с изображениями
+        "video_url": result_s3_url,
+        "fal_response_url": media_url,
+    }
+
+
+_item_flight_instance: SingleFlight | None = None
+
+
+def _item_flight() -> SingleFlight:
+    global _item_flight_instance
+    if _item_flight_instance is None:
+        _item_flight_instance = SingleFlight(lock_dir=settings.item_lock_dir)
+    return _item_flight_instance
+
+
+def _complete_item(order_id: str, idx: int, media_url: str, spans: list[dict | None], fal_request_id: Optional[str] = None) -> tuple[dict | None, bool]:
+    """Перекладка готового видео элемента в S3 и запись в заявку, схлопнутая по (order_id, idx).
+
+    Поллер, /fal/webhook и /results могут одновременно увидеть готовый элемент: скачивание,
+    загрузка в S3 и запись заявки выполняются один раз, остальные получают тот же результат.
+    Возвращает (заявка, заявка завершилась) — True получает только выполнивший работу вызов,
+    чтобы письмо ушло один раз.
+    """
+
+    def _work() -> tuple[dict | None, bool]:
+        # перечитываем: работу мог уже сделать другой обработчик (или другой процесс под файловой блокировкой)
+        current = orders.load(order_id)
+        items = ((current or {}).get("generation") or {}).get("items") or []
+        if idx < 0 or idx >= len(items):
+            return current, False
+        item = items[idx]
+        if item.get("status") == ItemStatus.SUCCEEDED.value and item.get("result_s3_url"):
+            return current, False
+        try:
+            patch = _rehost_video(order_id, current.get("anonUserId"), idx, media_url, spans, fal_request_id or item.get("request_id"))
+        except Exception as _e:
+            logger.exception(f"rehost: failed order={order_id} item={idx}")
+            patch = _failure_patch(item, _e)
+        return _apply_item_results(order_id, {idx: patch}, spans)
+
+    (order, completed_now), shared = _item_flight().do((order_id, idx), _work)
+    return order, completed_now and not shared
+
+
+def _proxy_video_link(order_id: str, idx: int, item: dict) -> str | None:
+    """Стабильная ссылка на прокси /video/... для видео, лежащего в нашем S3."""
+    s3u = item.get("result_s3_url") or item.get("video_url")
+    if not settings.video_proxy_links or item.get("video_deleted_at") or not (isinstance(s3u, str) and s3u.startswith("s3://")):
+        return None
+    return f"{settings.public_api_base_url}/video/{order_id}/{idx}"
+
+
+def _notify_completed(order: dict) -> None:
+    """Письмо со ссылками на результаты для только что завершившейся заявки + экспорт трассы."""
+    order_id = order.get("order_id") or order.get("request_id")
+    items = (order.get("generation") or {}).get("items") or []
+    spans: list[dict | None] = []
+    patches: dict[int, dict] = {}
+    try:
+        from app.utils.s3_utils import parse_s3_url as _parse, get_file_url_with_expiry as _gfue
+        links: List[str] = []
+        for idx, it in enumerate(items):
+            proxy_link = _proxy_video_link(order_id, idx, it)
+            if proxy_link:
+                links.append(proxy_link)
+            elif it.get("public_video_url"):
+                links.append(it["public_video_url"])
+            elif it.get("result_s3_url"):
+                b, k = _parse(it["result_s3_url"])
+                url, exp = _gfue(b, k)
+                patches[idx] = public_video_fields(url, exp)
+                links.append(url)
+            elif it.get("fal_response_url"):
+                links.append(it["fal_response_url"])
+        if order.get("email") and links:
+            email_started = tracing.now()
+            send_email_with_links(order["email"], links, request_id=order_id)
+            spans.append(tracing.make_span("email", email_started, kind="results"))
+            logger.info(f"poll: sent email with {len(links)} link(s) to {order['email']}")
+    except Exception:
+        logger.exception(f"notify: failed to send results email order={order_id}")
+    order = _apply_item_results(order_id, patches, spans, {"notify_pending": None})[0] or order
+    tracing.export_order(order, settings.traces_dir)
+
+
 # YooKassa webhook: подтверждение оплаты -> генерация -> письма
 
 @app.post("/yookassa/webhook")
@@ -285,9 +639,11 @@ async def yookassa_webhook(payload: dict, request: Request):
             import hmac, hashlib
             signature = request.headers.get("Webhook-Signature") or request.headers.get("X-Webhook-Signature")
             if not signature:
+                metrics.webhook_event("yookassa", "bad_signature")
                 return {"ok": False}
             expected = hmac.new(secret.encode(), raw, hashlib.sha256).hexdigest()
             if not hmac.compare_digest(expected, signature):
+                metrics.webhook_event("yookassa", "bad_signature")
                 return {"ok": False}
     except Exception:
         pass
@@ -299,49 +655,69 @@ async def yookassa_webhook(payload: dict, request: Request):
     metadata = obj.get("metadata") or {}
     order_id = metadata.get("order_id")
     if not order_id:
+        metrics.webhook_event("yookassa", "ignored")
+        return {"ok": True}
+
+    if status != "succeeded":
+        metrics.webhook_event("yookassa", f"status_{status or 'unknown'}")
+        return {"ok": True}
+
+    # фиксация оплаты; генерацию запускает только первый обработчик (идемпотентность при повторах вебхука)
+    claim = {"first_payment": False, "submit": False}
+
+    def _mark_paid(o: dict) -> bool:
+        pay = o.setdefault("payment", {})
+        if pay.get("status") != "paid":
+            claim["first_payment"] = True
+            tracing.record_span(o, "payment", o.get("created_at"), payment_id=payment_id)
+        pay.update({"status": "paid", "payment_id": payment_id})
+        gen = o.setdefault("generation", {})
+        if gen.get("status") not in ("in_progress", "completed"):
+            gen["status"] = "in_progress"
+            claim["submit"] = True
+        # повторный вебхук ничего не меняет — не переписываем файл
+        return claim["first_payment"] or claim["submit"]
+
+    order = await aorders.update(order_id, _mark_paid)
+    if not order:
+        metrics.webhook_event("yookassa", "unknown_order")
         return {"ok": True}
 
-    order = orders.load(order_id) or {}
-    if status == "succeeded":
-        # фиксация оплаты
-        order.setdefault("payment", {})
-        order["payment"].update({"status": "paid", "payment_id": payment_id})
-        orders.save(order)
-        # отправка квитанции
+    spans: list[dict | None] = []
+    # отправка квитанции
+    if claim["first_payment"]:
         try:
             if order.get("email"):
-                send_payment_receipt(order["email"], float(amount or 0), order_id, payment_id)
+                email_started = tracing.now()
+                await aio.send_payment_receipt(order["email"], float(amount or 0), order_id, payment_id)
+                spans.append(tracing.make_span("email", email_started, kind="receipt"))
         except Exception:
             pass
-        # Идемпотентность: если генерация уже шла/завершилась — ничего не делаем
-        gen = order.get("generation") or {}
-        if gen.get("status") in ("in_progress", "completed"):
-            return {"ok": True}
-        # генерация по каждому инпуту: ставим задачи с вебхуком fal.ai
-        items = gen.get("items") or []
-        from app.utils.s3_utils import parse_s3_url, get_file_url_with_expiry
-        for idx, it in enumerate(items):
-            if it.get("request_id") or it.get("status") in ("running", "succeeded"):
-                continue
-            try:
-                # Предпочитаем заранее сохранённую публичную ссылку
-                img_url = it.get("public_image_url")
-                if not img_url:
-                    bucket, key = parse_s3_url(it.get("input_s3_url", ""))
-                    img_url, exp = get_file_url_with_expiry(bucket, key)
-                    it["public_image_url"] = img_url
-                    it["expires_in"] = exp
-                sub = submit_generation(img_url, it.get("prompt") or "Animate this image", order_id, idx, order.get("anonUserId"))
-                it["status"] = "running"
-                it["request_id"] = sub.get("request_id")
-                if sub.get("model_id"):
-                    it["model_id"] = sub["model_id"]
-            except Exception as _e:
-                it["status"] = "failed"
-                it["error"] = str(_e)
-        order.setdefault("generation", {})["status"] = "in_progress"
-        order["generation"]["items"] = items
-        orders.save(order)
+    if not claim["submit"]:
+        metrics.webhook_event("yookassa", "duplicate")
+        return {"ok": True}
+
+    # генерация по каждому инпуту: ставим задачи с вебхуком fal.ai
+    items = (order.get("generation") or {}).get("items") or []
+    to_submit = [
+        idx for idx, it in enumerate(items)
+        if not (it.get("request_id") or it.get("status") in ("running", "succeeded"))
+    ]
+    # элементы ставим в очередь fal параллельно, через приоритетный планировщик (полоса заявки)
+    lane = await executors.run("store", _work_lane, order.get("anonUserId"), len(items))
+    submitted = await asyncio.gather(*(
+        scheduler().run("retry" if items[idx].get("attempts") else lane, _submit_item, order_id, order.get("anonUserId"), idx, items[idx], spans)
+        for idx in to_submit
+    ), return_exceptions=True)
+    # постановка не началась (процесс останавливается) — элемент сразу подхватит поллер
+    patches = {
+        idx: _interrupted_patch() if isinstance(result, BaseException) else result
+        for idx, result in zip(to_submit, submitted)
+    }
+    order, completed_now = await executors.run("store", _apply_item_results, order_id, patches, spans)
+    if order and completed_now:
+        await executors.run("smtp", _notify_completed, order)
+    metrics.webhook_event("yookassa", "paid")
     return {"ok": True}
 
 
@@ -353,8 +729,10 @@ async def fal_webhook(request: Request):
     item_index_str = params.get("item_index")
     token = params.get("token")
     if settings.fal_webhook_token and token != settings.fal_webhook_token:
+        metrics.webhook_event("fal", "unauthorized")
         return Response(status_code=401)
     if not order_id or item_index_str is None:
+        metrics.webhook_event("fal", "bad_request")
         return Response(status_code=400)
     item_index = int(item_index_str)
     payload = await request.json()
@@ -362,287 +740,378 @@ async def fal_webhook(request: Request):
     # В payload должна быть ссылка на видео, структура зависит от модели
     video_url = payload.get("response_url") or payload.get("url") or payload.get("video_url")
 
-    order = orders.load(order_id) or {}
-    items = (order.get("generation") or {}).get("items") or []
+    order = await aorders.load(order_id)
+    items = ((order or {}).get("generation") or {}).get("items") or []
     if item_index < 0 or item_index >= len(items):
+        metrics.webhook_event("fal", "unknown_item")
         return {"ok": True}
     item = items[item_index]
-    links: List[str] = []
+    if item.get("status") == "succeeded" and item.get("result_s3_url"):
+        # Видео уже переложил поллер
+        metrics.webhook_event("fal", "duplicate")
+        return {"ok": True}
+    spans: list[dict | None] = []
     if status in ("succeeded", "COMPLETED", "completed") and video_url:
-        # Скачиваем и перекладываем в S3/videos, сохраняем ссылку
-        try:
-            import requests as _rq
-            video_resp = _rq.get(video_url, timeout=180)
-            video_resp.raise_for_status()
-            video_bytes = video_resp.content
-            from app.utils.s3_utils import s3_key_for_video, upload_bytes, get_file_url_with_expiry as _gfue, parse_s3_url as _parse
-            video_key = s3_key_for_video(order.get("anonUserId") or "user", order_id, item_index, ".mp4")
-            upload_bytes(settings.s3_bucket_name or "", video_key, video_bytes, content_type="video/mp4")
-            item["status"] = "succeeded"
-            item["result_s3_url"] = f"s3://{settings.s3_bucket_name}/{video_key}"
-            # Сохраняем публичную ссылку и TTL
-            pub_url, exp = _gfue(settings.s3_bucket_name or "", video_key)
-            item["public_video_url"] = pub_url
-            item["expires_in"] = exp
-            item["public_url_created_at"] = datetime.utcnow().isoformat()
-            # Дублируем поле s3 для симметрии с изображениями
-            item["video_url"] = item["result_s3_url"]
-        except Exception as _e:
-            item["status"] = "failed"
-            item["error"] = str(_e)
+        spans.append(tracing.make_span("fal_generation", item.get("submitted_at"), item_index=item_index, source="webhook"))
+        # Скачиваем и перекладываем в S3/videos, сохраняем ссылку (одновременно с поллером — одна работа на двоих)
+        lane = await executors.run("store", _work_lane, order.get("anonUserId"), len(items), item.get("attempts") or 0)
+        order, completed_now = await scheduler().run(lane, _complete_item, order_id, item_index, video_url, spans, item.get("request_id"))
+        items = ((order or {}).get("generation") or {}).get("items") or []
+        patch = items[item_index] if item_index < len(items) else {}
     else:
-        item["status"] = "failed"
-        item["error"] = payload.get("error") or "unknown"
-    # Сохраняем прогресс
-    order.setdefault("generation", {})["items"] = items
-    # Если все items завершены успешно/неуспешно — отправим письма и финальный статус
-    all_done = all(it.get("status") in ("succeeded", "failed") for it in items)
-    if all_done:
-        order["generation"]["status"] = "completed"
-        # Собираем публичные ссылки и шлём письмо
-        try:
-            from app.utils.s3_utils import parse_s3_url as _parse, get_file_url_with_expiry as _gfue
-            for it in items:
-                if it.get("public_video_url"):
-                    links.append(it["public_video_url"])
-                elif it.get("result_s3_url"):
-                    b, k = _parse(it["result_s3_url"])
-                    url, exp = _gfue(b, k)
-                    it["public_video_url"] = url
-                    it["expires_in"] = exp
-                    links.append(url)
-            if order.get("email") and links:
-                send_email_with_links(order["email"], links, request_id=order_id)
-        except Exception:
-            pass
-    orders.save(order)
+        patch = {"status": ItemStatus.FAILED.value, "error": payload.get("error") or "unknown"}
+        order, completed_now = await executors.run("store", _apply_item_results, order_id, {item_index: patch}, spans)
+    # Если все items завершены — письмо и финальный статус
+    if order and completed_now:
+        await executors.run("smtp", _notify_completed, order)
+    metrics.webhook_event("fal", patch.get("status") or "unknown")
     return {"ok": True}
 
 
-# Периодическая задача: опрос статусов очереди и сохранение response_url
-# Периодическая задача: опрос статусов очереди и сохранение response_url
-def _poll_worker():
-    while True:
+# Периодическая задача: опрос статусов очереди и перекладка готовых видео в S3
+def _poll_item(order: Order, idx: int, it: GenerationItem) -> tuple[dict | None, list[dict | None]]:
+    """Опрос одного элемента; возвращает (изменения элемента или None, незаписанные отрезки трассы)."""
+    from app.services.fal_service import get_request_status, get_request_response, extract_media_url, fetch_queue_json
+
+    order_id = order.order_id
+    spans: list[dict | None] = []
+    req_id = it.request_id
+    if not req_id:
+        # retry_later до постановки в очередь fal — повторяем постановку
+        patch = _submit_item(order_id, order.anonUserId, idx, it.to_dict(), spans)
+        logger.info("poll: resubmit order=%s item=%s -> %s", order_id, idx, patch.get("status"))
+        return patch, spans
+    try:
+        st = get_request_status(req_id, logs=False, model_id=it.model_id, endpoint=it.fal_endpoint)
+        st_status = (st.get("status") or "").upper()
+        logger.info("poll: order=%s item=%s req=%s status=%s", order_id, idx, req_id, st_status)
+        if st_status != "COMPLETED":
+            return None, spans
+
+        spans.append(tracing.make_span("fal_generation", it.submitted_at, item_index=idx, source="poll"))
+        resp = get_request_response(req_id, model_id=it.model_id, endpoint=it.fal_endpoint)
+        media_url = extract_media_url(resp)
+        if (not media_url) and isinstance(st.get("response_url"), str) and st.get("response_url").startswith(f"{settings.fal_queue_base}/"):
+            qjson = fetch_queue_json(st.get("response_url"))
+            media_url = extract_media_url(qjson or {})
+
+        if media_url:
+            # Скачиваем видео и перекладываем в наш S3 (схлопывается с вебхуком и /results)
+            updated, completed_now = _complete_item(order_id, idx, media_url, spans, req_id)
+            logger.info(f"poll: COMPLETED downloaded and saved to S3 for order={order_id} item={idx}")
+            if updated and completed_now:
+                _notify_completed(updated)
+            return None, []
+        logger.warning(f"poll: COMPLETED but no media_url order={order_id} item={idx}")
+        return {"status": ItemStatus.FAILED.value, "error": "no media_url"}, spans
+
+    except CircuitOpenError as _e:
+        # fal недоступен: элемент в очереди fal не пропал, просто опросим его позже
+        logger.info("poll: skip order=%s item=%s: %s", order_id, idx, _e)
+    except Exception as _e:
+        logger.exception(f"poll: error processing order={order_id} item={idx} req={req_id}")
+        return _failure_patch(it.to_dict(), _e), spans
+    return None, spans
+
+
+def _poll_orders(active: List[Order]) -> None:
+    """Раздаёт элементы заявок по полосам планировщика и записывает изменения каждой заявки одной записью.
+
+    Мелкие и первые заявки опрашиваются и перекладываются раньше крупных пакетов, повторы — в своей полосе.
+    """
+    now = datetime.utcnow()
+    pending = []
+    for order in active:
+        due = order.due_items(now)
+        if not due:
+            continue
         try:
-            logger.info("poll: tick start")
-            all_orders = orders.list_recent_orders(max_files=7)
-            logger.info(f"poll: loaded recent orders: {len(all_orders)}")
-
-            for order in all_orders:
-                gen = order.get("generation") or {}
-                items = gen.get("items") or []
-                order_id = order.get("order_id") or order.get("request_id")
-                changed = False
-
-                for idx, it in enumerate(items):
-                    if it.get("status") in ("succeeded", "failed"):
-                        continue
-                    req_id = it.get("request_id")
-                    if not req_id:
-                        continue
-
-                    from app.services.fal_service import get_request_status, get_request_response
-                    try:
-                        st = get_request_status(req_id, logs=False, model_id=it.get("model_id"))
-                        st_status = (st.get("status") or "").upper()
-                        logger.info(f"poll: order={order_id} item={idx} req={req_id} status={st_status}")
-
-                        if st_status == "COMPLETED":
-                            from app.services.fal_service import extract_media_url
-                            resp = get_request_response(req_id, model_id=it.get("model_id"))
-                            media_url = extract_media_url(resp)
-                            if (not media_url) and isinstance(st.get("response_url"), str) and st.get("response_url").startswith("https://queue.fal.run/"):
-                                from app.services.fal_service import fetch_queue_json
-                                qjson = fetch_queue_json(st.get("response_url"))
-                                media_url = extract_media_url(qjson or {})
-
-                            if media_url:
-                                # Скачиваем видео и перекладываем в наш S3
-                                try:
-                                    from app.utils.s3_utils import (
-                                        s3_key_for_video as _s3_key_for_video,
-                                        upload_bytes as _upload_bytes,
-                                        get_file_url_with_expiry as _gfue,
-                                    )
-                                    from app.services.fal_service import fetch_bytes
-                                    video_bytes = fetch_bytes(media_url, timeout=180)
-                                    video_key = _s3_key_for_video(order.get("anonUserId") or "user", order_id, idx, ".mp4")
-                                    _upload_bytes(settings.s3_bucket_name or "", video_key, video_bytes, content_type="video/mp4")
-                                    # Обновляем item ссылками S3
-                                    it["status"] = "succeeded"
-                                    it["result_s3_url"] = f"s3://{settings.s3_bucket_name}/{video_key}"
-                                    pub_url, exp = _gfue(settings.s3_bucket_name or "", video_key)
-                                    it["public_video_url"] = pub_url
-                                    it["expires_in"] = exp
-                                    it["public_url_created_at"] = datetime.utcnow().isoformat()
-                                    it["video_url"] = it.get("result_s3_url")
-                                    it["fal_response_url"] = media_url
-                                    logger.info(f"poll: COMPLETED downloaded and saved to S3 for order={order_id} item={idx}")
-                                    changed = True
-                                except Exception as _e:
-                                    it["status"] = "failed"
-                                    it["error"] = str(_e)
-                                    logger.exception(f"poll: error saving video to S3 order={order_id} item={idx}")
-                                    changed = True
-                            else:
-                                it["status"] = "failed"
-                                it["error"] = "no media_url"
-                                logger.warning(f"poll: COMPLETED but no media_url order={order_id} item={idx}")
-                                changed = True
-
-                    except Exception as _e:
-                        it["status"] = "failed"
-                        it["error"] = str(_e)
-                        logger.exception(f"poll: error processing order={order_id} item={idx} req={req_id}")
-                        changed = True
-
-                if changed:
-                    order.setdefault("generation", {})["items"] = items
-                    all_done = all(x.get("status") in ("succeeded", "failed") for x in items)
-
-                    if all_done:
-                        order["generation"]["status"] = "completed"
-
-                        try:
-                            lnks: list[str] = []
-                            for x in items:
-                                if x.get("fal_response_url"):
-                                    lnks.append(x["fal_response_url"])
-
-                            if order.get("email") and lnks:
-                                send_email_with_links(order["email"], lnks, request_id=order_id)
-                                logger.info(f"poll: sent email with {len(lnks)} link(s) to {order['email']}")
-                        except Exception:
-                            pass
-
-                    orders.save(order)
+            lane = _work_lane(order.anonUserId, len(order.generation.items))
+        except Exception:
+            logger.exception(f"poll: lane lookup failed order={order.order_id}")
+            lane = "standard"
+        futures = {
+            idx: scheduler().submit("retry" if (it.attempts or not it.request_id) else lane, _poll_item, order, idx, it)
+            for idx, it in due
+        }
+        pending.append((order, futures))
 
-            logger.info("poll: tick end")
+    for order, futures in pending:
+        patches: dict[int, dict] = {}
+        spans: list[dict | None] = []
+        for idx, future in futures.items():
+            try:
+                patch, item_spans = future.result()
+            except Exception:
+                logger.exception(f"poll: error processing order={order.order_id} item={idx}")
+                continue
+            spans.extend(item_spans)
+            if patch:
+                patches[idx] = patch
+        if patches:
+            try:
+                updated, completed_now = _apply_item_results(order.order_id, patches, spans)
+                if updated and completed_now:
+                    _notify_completed(updated)
+            except Exception:
+                logger.exception(f"poll: error processing order={order.order_id}")
 
+
+_MAINTENANCE_EVERY_SECONDS = 24 * 3600
+
+
+def _daily_maintenance(last_run: float | None) -> float | None:
+    """Раз в сутки: архив старых дней хранилища и (если включено) прогон политик хранения."""
+    if last_run is not None and time.monotonic() - last_run < _MAINTENANCE_EVERY_SECONDS:
+        return last_run
+    if settings.archive_after_days > 0:
+        try:
+            report = orders.archive_days(older_than_days=settings.archive_after_days, compression=settings.archive_compression)
+            if report["archived"]:
+                logger.info("archive: moved %d day(s) to archive, %s -> %s bytes", len(report["archived"]), report["hot_bytes"], report["archive_bytes"])
         except Exception:
-            pass
+            logger.exception("archive: failed")
+    if settings.retention_enabled:
+        # удаление в S3 идёт в своём потоке и не задерживает опрос fal
+        _retention().start()
+    return time.monotonic()
 
-        time.sleep(20)
 
-    while True:
+def _is_stale(stamp: Optional[str], now: datetime) -> bool:
+    """Заявка не менялась дольше RECOVERY_STALE_SECONDS: обработчик, который её вёл, остановлен или упал."""
+    return bool(stamp) and stamp <= (now - timedelta(seconds=settings.recovery_stale_seconds)).isoformat()
+
+
+def _recover_order(order: Order, now: datetime) -> None:
+    """Подхватывает работу заявки, брошенную остановленным или упавшим процессом (этим или другим воркером).
+
+    Прерванная постановка в fal — элементы в retry_later без паузы (их поставит поллер);
+    неотправленное письмо о готовности — отправляем. Решение перепроверяется под блокировкой записи:
+    если заявку за это время кто-то изменил, она не брошена. Запись заодно продлевает updated_at,
+    поэтому другие процессы эту же заявку сейчас не возьмут.
+    """
+    stranded = [idx for idx, _ in order.stranded_items]
+    claim = {"submit": [], "notify": False}
+
+    def _mutate(o: dict) -> bool:
+        if not _is_stale(o.get("updated_at") or o.get("created_at"), now):
+            return False
+        gen = o.get("generation") or {}
+        items = gen.get("items") or []
+        for idx in stranded:
+            it = items[idx] if idx < len(items) else {}
+            if it and not it.get("request_id") and it.get("status") not in (*_TERMINAL_ITEM_STATUSES, ItemStatus.RETRY_LATER.value):
+                it.update(_interrupted_patch())
+                claim["submit"].append(idx)
+        claim["notify"] = bool(gen.get("notify_pending"))
+        return bool(claim["submit"] or claim["notify"])
+
+    updated = orders.update(order.order_id, _mutate)
+    if claim["submit"]:
+        metrics.RECOVERED_WORK.labels("submit").inc(len(claim["submit"]))
+        logger.warning("recovery: order=%s items=%s: interrupted submission, requeued", order.order_id, claim["submit"])
+    if claim["notify"] and updated:
+        metrics.RECOVERED_WORK.labels("notify").inc()
+        logger.warning("recovery: order=%s: results email was not sent, sending", order.order_id)
+        _notify_completed(updated)
+
+
+# Поллер останавливается этим событием при остановке процесса (см. _drain_background_work)
+_poll_stop = threading.Event()
+_poll_thread: threading.Thread | None = None
+
+
+def _poll_worker():
+    last_maintenance: float | None = None
+    while not _poll_stop.is_set():
+        tick_started = time.perf_counter()
         try:
             logger.info("poll: tick start")
-            all_orders = orders.list_recent_orders(max_files=7)
-            logger.info(f"poll: loaded recent orders: {len(all_orders)}")
-            for order in all_orders:
-                gen = order.get("generation") or {}
-                items = gen.get("items") or []
-                order_id = order.get("order_id") or order.get("request_id")
-                changed = False
-                for idx, it in enumerate(items):
-                    if it.get("status") in ("succeeded", "failed"):
-                        continue
-                    req_id = it.get("request_id")
-                    if not req_id:
-                        continue
-                    from app.services.fal_service import get_request_status, get_request_response
-                    try:
-                        st = get_request_status(req_id, logs=False, model_id=it.get("model_id"))
-                        st_status = (st.get("status") or "").upper()
-                        logger.info(f"poll: order={order_id} item={idx} req={req_id} status={st_status}")
-                        if st_status == "COMPLETED":
-                            resp = get_request_response(req_id, model_id=it.get("model_id"))
-                            response_url = (
-                                resp.get("response_url")
-                                or st.get("response_url")
-                                or resp.get("response", {}).get("response_url")
-                            )
-                            if response_url:
-                                it["status"] = "succeeded"
-                                it["fal_response_url"] = response_url
-                            # Если уже лежит в S3, обновим/сформируем публичную ссылку
-                            try:
-                                from app.utils.s3_utils import parse_s3_url as _parse, get_file_url_with_expiry as _gfue
-                                s3u = it.get("result_s3_url") or it.get("video_url")
-                                if isinstance(s3u, str) and s3u.startswith("s3://"):
-                                    b, k = _parse(s3u)
-                                    url, exp = _gfue(b, k)
-                                    it["public_video_url"] = url
-                                    it["expires_in"] = exp
-                                    it["public_url_created_at"] = datetime.utcnow().isoformat()
-                            except Exception:
-                                pass
-                                logger.info(f"poll: COMPLETED saved response_url for order={order_id} item={idx}")
-                                changed = True
-                            else:
-                                it["status"] = "failed"
-                                it["error"] = "no response_url"
-                                logger.warning(f"poll: COMPLETED but no response_url order={order_id} item={idx}")
-                                changed = True
-                    except Exception as _e:
-                        it["status"] = "failed"
-                        it["error"] = str(_e)
-                        logger.exception(f"poll: error processing order={order_id} item={idx} req={req_id}")
-                        changed = True
-                if changed:
-                    order.setdefault("generation", {})["items"] = items
-                    all_done = all(x.get("status") in ("succeeded", "failed") for x in items)
-                    if all_done:
-                        order["generation"]["status"] = "completed"
-                        
-                        try:
-                            lnks: List[str] = []
-                            for x in items:
-                                if x.get("fal_response_url"):
-                                    lnks.append(x["fal_response_url"])
-                                    
-                            if order.get("email") and lnks:
-                                send_email_with_links(order["email"], lnks, request_id=order_id)
-                                logger.info(f"poll: sent email with {len(lnks)} link(s) to {order['email']}")
-                        except Exception:
-                            pass
-                    orders.save(order)
+            # Держим в памяти только заявки с элементами в очереди fal, и те — в компактном виде
+            loaded = 0
+            active: List[Order] = []
+            abandoned: List[Order] = []
+            now = datetime.utcnow()
+            for order in orders.iter_recent_orders(max_files=7):
+                loaded += 1
+                if order.pending_items:
+                    active.append(order)
+                if (order.stranded_items or order.generation.notify_pending) and _is_stale(order.updated_at or order.created_at, now):
+                    abandoned.append(order)
+            # первый тик после старта — проход восстановления после прошлого запуска
+            for order in abandoned:
+                try:
+                    _recover_order(order, now)
+                except Exception:
+                    logger.exception(f"recovery: failed order={order.order_id}")
+            logger.info(f"poll: loaded recent orders: {loaded}, active: {len(active)}")
+            metrics.GENERATION_ITEMS_INFLIGHT.set(sum(len(o.pending_items) for o in active))
+            # загрузка эндпоинтов пула fal для пределов параллельности маршрутизатора
+            queued: dict[str, int] = {}
+            for order in active:
+                for _, it in order.pending_items:
+                    if it.request_id:
+                        endpoint = fal_router.endpoint_for(it.fal_endpoint, it.model_id)
+                        queued[endpoint] = queued.get(endpoint, 0) + 1
+            fal_router.router().observe_inflight(queued)
+
+            _poll_orders(active)
+
             logger.info("poll: tick end")
+
         except Exception:
             pass
-        time.sleep(20)
+        metrics.POLL_TICK_SECONDS.set(time.perf_counter() - tick_started)
+        if _poll_stop.is_set():
+            break
+        last_maintenance = _daily_maintenance(last_maintenance)
+
+        _poll_stop.wait(settings.poll_interval_seconds)
+    logger.info("poll: background thread stopped")
+
 
 @app.on_event("startup")
 def start_poll_thread() -> None:
-    t = threading.Thread(target=_poll_worker, name="fal-poll", daemon=True)
-    t.start()
+    # Конфигурация и логи — при старте процесса, а не при импорте модуля
+    get_settings()
+    _setup_file_logging()
+    global _poll_thread
+    _poll_stop.clear()
+    _poll_thread = threading.Thread(target=_poll_worker, name="fal-poll", daemon=True)
+    _poll_thread.start()
     logger.info("poll: background thread started")
 
 
+@app.on_event("shutdown")
+def _drain_background_work() -> None:
+    """Остановка без потери работы: к этому моменту uvicorn уже дождался текущих запросов (вебхуков).
+
+    В пределах SHUTDOWN_GRACE_SECONDS поллер доделывает текущий тик, а планировщик — поставленные
+    постановки, опросы и перекладки. Не начатые к сроку задачи отменяются: их элементы остаются
+    в хранилище в работе (в очереди fal или retry_later) и продолжаются поллером следующего процесса.
+    """
+    started = time.monotonic()
+    _poll_stop.set()
+    if _poll_thread is not None:
+        _poll_thread.join(settings.shutdown_grace_seconds)
+    left = settings.shutdown_grace_seconds - (time.monotonic() - started)
+    cancelled = scheduler().drain(left)
+    logger.info("shutdown: background work drained in %.1fs, cancelled %d task(s)", time.monotonic() - started, cancelled)
+
+
+@app.on_event("shutdown")
+def _release_process_metrics() -> None:
+    executors.shutdown(wait=False)
+    metrics.mark_process_dead()
+    shutdown_logging()
+
+
 # статус запроса
 @app.get("/request/{request_id}")
-async def get_request_status(request_id: str, anonUserId: str):
-    rec = orders.load(request_id)
+async def get_request_status(request_id: str, anonUserId: str, request: Request):
+    # Быстрый путь: 304 по карте версий без чтения заявки
+    known = aorders.peek_version(request_id)
+    if known and known[1] == anonUserId and _etag_matches(request, _order_etag(request_id, known[0])):
+        return Response(status_code=304, headers={"ETag": _order_etag(request_id, known[0])})
+    rec = await aorders.load(request_id)
     if not rec:
         raise HTTPException(status_code=404, detail="request not found")
     if rec.get("anonUserId") != anonUserId:
         raise HTTPException(status_code=403, detail="forbidden")
+    etag = _order_etag(request_id, int(rec.get("version") or 0))
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(
+        content={
+            "orderId": rec.get("request_id") or rec.get("order_id"),
+            "payment": rec.get("payment"),
+            "generation": rec.get("generation"),
+            "email": rec.get("email"),
+        },
+        headers={"ETag": etag},
+    )
+
+
+# История заявок пользователя: страницы по индексу anonUserId, курсор — непрозрачная строка
+
+def _encode_cursor(position: tuple[str, str]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(position)).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[str, str]:
+    try:
+        created_at, order_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(created_at), str(order_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+
+
+def _order_summary(order: dict) -> dict:
+    order_id = order.get("order_id") or order.get("request_id")
+    items = []
+    for idx, it in enumerate((order.get("generation") or {}).get("items") or []):
+        video = None
+        if not it.get("video_deleted_at"):
+            video = _proxy_video_link(order_id, idx, it)
+            if not video and it.get("public_video_url") and not _is_presigned_expired(
+                it.get("public_video_url"), it.get("expires_in"), it.get("public_url_created_at")
+            ):
+                video = it["public_video_url"]
+        items.append({"status": it.get("status"), "prompt": it.get("prompt"), "videoUrl": video})
+    return {
+        "orderId": order_id,
+        "createdAt": order.get("created_at"),
+        "paymentStatus": (order.get("payment") or {}).get("status"),
+        "generationStatus": (order.get("generation") or {}).get("status"),
+        "items": items,
+    }
+
+
+@app.get("/users/{anonUserId}/orders")
+async def get_user_orders(anonUserId: str, cursor: Optional[str] = None, limit: int = 20):
+    limit = max(1, min(limit, 100))
+    after = _decode_cursor(cursor) if cursor else None
+    page, next_position = await aorders.orders_for_user(anonUserId, limit, after)
     return {
-        "orderId": rec.get("request_id") or rec.get("order_id"),
-        "payment": rec.get("payment"),
-        "generation": rec.get("generation"),
-        "email": rec.get("email"),
+        "orders": [_order_summary(o) for o in page],
+        "nextCursor": _encode_cursor(next_position) if next_position else None,
     }
 
 
 # Публичные ссылки на результаты по request_id
 @app.get("/results")
-async def get_results(request_id: str):
-    order = orders.load(request_id)
+async def get_results(request_id: str, request: Request):
+    # Быстрый путь: версия не менялась и ни одна из выданных ссылок ещё не истекла
+    known = aorders.peek_version(request_id)
+    fresh = _results_fresh.get(request_id)
+    if fresh and fresh[1] is not None and datetime.utcnow().replace(tzinfo=timezone.utc) >= fresh[1]:
+        del _results_fresh[request_id]
+        fresh = None
+    if known and fresh and fresh[0] == known[0]:
+        _results_fresh.move_to_end(request_id)
+        etag = _order_etag(request_id, known[0])
+        if _etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+    order = await aorders.load(request_id)
     if not order:
         raise HTTPException(status_code=404, detail="request not found")
     items = (order.get("generation") or {}).get("items") or []
     links: List[str] = []
-    changed = False
+    # изменения элементов (перевыпущенные ссылки, переложенные видео) сохраняем одной записью
+    patches: dict[int, dict] = {}
+    spans: list[dict | None] = []
     try:
-        from app.utils.s3_utils import (
-            parse_s3_url as _parse,
-            get_file_url_with_expiry as _gfue,
-            s3_key_for_video as _s3_key_for_video,
-            upload_bytes as _upload_bytes,
-        )
-        from app.services.fal_service import extract_media_url, fetch_queue_json, fetch_bytes
+        from app.utils.s3_utils import parse_s3_url as _parse
+        from app.services.fal_service import extract_media_url
         for idx, it in enumerate(items):
+            if it.get("video_deleted_at"):
+                # видео удалено по сроку хранения — ссылку не перевыпускаем
+                continue
+            proxy_link = _proxy_video_link(request_id, idx, it)
+            if proxy_link:
+                # стабильная ссылка на прокси: без presign и без проверки срока
+                links.append(proxy_link)
+                continue
             # приоритетно уже сохранённые публичные ссылки
             if it.get("public_video_url"):
                 # Проверяем, не истёк ли presigned
@@ -654,10 +1123,9 @@ async def get_results(request_id: str):
                         s3u = it.get("result_s3_url") or it.get("video_url")
                         if isinstance(s3u, str) and s3u.startswith("s3://"):
                             b, k = _parse(s3u)
-                            url, exp = _gfue(b, k)
-                            it["public_video_url"] = url
-                            it["expires_in"] = exp
-                            it["public_url_created_at"] = datetime.utcnow().isoformat()
+                            url, exp = await aio.s3_presign(b, k)
+                            patches[idx] = public_video_fields(url, exp)
+                            it.update(patches[idx])
                     except Exception:
                         pass
                 links.append(it["public_video_url"])
@@ -667,12 +1135,10 @@ async def get_results(request_id: str):
             if s3u and isinstance(s3u, str) and s3u.startswith("s3://"):
                 try:
                     b, k = _parse(s3u)
-                    url, exp = _gfue(b, k)
-                    it["public_video_url"] = url
-                    it["expires_in"] = exp
-                    it["public_url_created_at"] = datetime.utcnow().isoformat()
+                    url, exp = await aio.s3_presign(b, k)
+                    patches[idx] = public_video_fields(url, exp)
+                    it.update(patches[idx])
                     links.append(url)
-                    changed = True
                     continue
                 except Exception:
                     pass
@@ -681,25 +1147,411 @@ async def get_results(request_id: str):
             if fal_url:
                 try:
                     media_url = fal_url
-                    if isinstance(fal_url, str) and fal_url.startswith("https://queue.fal.run/"):
-                        qjson = fetch_queue_json(fal_url)
+                    if isinstance(fal_url, str) and fal_url.startswith(f"{settings.fal_queue_base}/"):
+                        qjson = await aio.fal_fetch_queue_json(fal_url)
                         media_url = extract_media_url(qjson or {}) or fal_url
-                    video_bytes = fetch_bytes(media_url, timeout=180)
-                    video_key = _s3_key_for_video(order.get("anonUserId") or "user", request_id, idx, ".mp4")
-                    _upload_bytes(settings.s3_bucket_name or "", video_key, video_bytes, content_type="video/mp4")
-                    it["result_s3_url"] = f"s3://{settings.s3_bucket_name}/{video_key}"
-                    url, exp = _gfue(settings.s3_bucket_name or "", video_key)
-                    it["public_video_url"] = url
-                    it["expires_in"] = exp
-                    it["public_url_created_at"] = datetime.utcnow().isoformat()
-                    it["video_url"] = it["result_s3_url"]
-                    links.append(url)
-                    changed = True
+                    lane = await executors.run("store", _work_lane, order.get("anonUserId"), len(items), it.get("attempts") or 0)
+                    updated, completed_now = await scheduler().run(lane, _complete_item, request_id, idx, media_url, spans, it.get("request_id"))
+                    spans = []
+                    if updated and completed_now:
+                        await executors.run("smtp", _notify_completed, updated)
+                    fresh_items = ((updated or {}).get("generation") or {}).get("items") or []
+                    if idx < len(fresh_items) and fresh_items[idx].get("public_video_url"):
+                        it.update(fresh_items[idx])
+                        links.append(_proxy_video_link(request_id, idx, it) or it["public_video_url"])
                 except Exception:
                     pass
     except Exception:
         pass
-    if changed:
-        order.setdefault("generation", {})["items"] = items
-        orders.save(order)
-    return {"orderId": request_id, "links": links}
+    if patches:
+        order = (await executors.run("store", _apply_item_results, request_id, patches, spans))[0] or order
+        items = (order.get("generation") or {}).get("items") or []
+    # Ответ валиден, пока не истекла ближайшая из выданных ссылок
+    fresh_until: datetime | None = None
+    for it in items:
+        if it.get("public_video_url"):
+            exp_at = _presigned_expires_at(it.get("public_video_url"), it.get("expires_in"), it.get("public_url_created_at"))
+            if exp_at and (fresh_until is None or exp_at < fresh_until):
+                fresh_until = exp_at
+    version = int(order.get("version") or 0)
+    _results_fresh[request_id] = (version, fresh_until)
+    _results_fresh.move_to_end(request_id)
+    while len(_results_fresh) > _RESULTS_FRESH_MAX:
+        _results_fresh.popitem(last=False)
+    etag = _order_etag(request_id, version)
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(content={"orderId": request_id, "links": links}, headers={"ETag": etag})
+
+
+# --- Прокси видео: стабильная ссылка, Range/206, условные запросы, кэш горячих видео на диске ---
+
+_VIDEO_CHUNK = 64 * 1024
+_video_cache_instance = None
+_video_fills: set[str] = set()
+_video_fills_lock = threading.Lock()
+
+
+def _video_cache():
+    global _video_cache_instance
+    if _video_cache_instance is None:
+        from app.utils.disk_cache import DiskLRUCache
+        _video_cache_instance = DiskLRUCache(settings.video_cache_dir, settings.video_cache_max_bytes)
+    return _video_cache_instance
+
+
+def _video_max_entry() -> int:
+    # одно видео не должно вытеснять весь кэш
+    return max(1, settings.video_cache_max_bytes // 4)
+
+
+def _parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """Один диапазон "bytes=a-b" / "bytes=a-" / "bytes=-n" -> (start, end) включительно.
+
+    None — заголовка нет или он не разбирается (отдаём весь файл); ValueError — диапазон вне файла.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_s, sep, end_s = header[6:].strip().partition("-")
+    if not sep or not (start_s or end_s) or not (start_s + end_s).isdigit():
+        return None
+    if not start_s:
+        suffix = int(end_s)
+        if suffix == 0 or size == 0:
+            raise ValueError("range not satisfiable")
+        return max(0, size - suffix), size - 1
+    start = int(start_s)
+    end = min(int(end_s), size - 1) if end_s else size - 1
+    if start >= size or end < start:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+def _iter_file(path: str, start: int, length: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(_VIDEO_CHUNK, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _iter_s3_and_fill(s3u: str, bucket: str, key: str, meta: dict):
+    """Отдаёт объект целиком из S3 и попутно кладёт его в кэш (если клиент дочитал до конца)."""
+    from app.utils.s3_utils import iter_object
+
+    fill = _video_cache().open_fill(s3u, meta, _video_max_entry())
+    completed = False
+    try:
+        for chunk in iter_object(bucket, key, chunk_size=_VIDEO_CHUNK):
+            fill.write(chunk)
+            yield chunk
+        completed = True
+    finally:
+        if completed:
+            fill.commit()
+        else:
+            fill.abort()
+
+
+def _fill_video_cache_later(s3u: str, bucket: str, key: str, meta: dict) -> None:
+    """Докачивает видео в кэш в фоне (после запроса диапазона с промахом); не больше одной закачки на ключ."""
+    with _video_fills_lock:
+        if s3u in _video_fills:
+            return
+        _video_fills.add(s3u)
+
+    def _run() -> None:
+        from app.utils.s3_utils import iter_object
+
+        try:
+            _video_cache().put_chunks(s3u, iter_object(bucket, key, chunk_size=_VIDEO_CHUNK), meta, _video_max_entry())
+        except Exception:
+            logger.exception(f"video: cache fill failed key={key}")
+        finally:
+            with _video_fills_lock:
+                _video_fills.discard(s3u)
+
+    threading.Thread(target=_run, name="video-cache-fill", daemon=True).start()
+
+
+@app.get("/video/{order_id}/{index}")
+def get_video(order_id: str, index: int, request: Request):
+    """Видео результата через наш сервер: ссылка не истекает, поддерживается перемотка (Range)."""
+    from email.utils import format_datetime, parsedate_to_datetime
+    from fastapi.responses import StreamingResponse
+    from app.utils.s3_utils import parse_s3_url, head_object, is_not_found, iter_object
+
+    order = orders.load(order_id)
+    items = ((order or {}).get("generation") or {}).get("items") or []
+    if index < 0 or index >= len(items):
+        raise HTTPException(status_code=404, detail="video not found")
+    item = items[index]
+    if item.get("video_deleted_at"):
+        raise HTTPException(status_code=410, detail="video expired")
+    s3u = item.get("result_s3_url") or item.get("video_url")
+    if not (isinstance(s3u, str) and s3u.startswith("s3://")):
+        raise HTTPException(status_code=404, detail="video not ready")
+    bucket, key = parse_s3_url(s3u)
+
+    cached = _video_cache().get(s3u)
+    if cached:
+        path, meta = cached
+    else:
+        path = None
+        try:
+            head = head_object(bucket, key)
+        except Exception as e:
+            if is_not_found(e):
+                raise HTTPException(status_code=404, detail="video not found")
+            if is_transient(e):
+                # S3 недоступен (цепь разомкнута, таймаут, 5xx): не 404, чтобы клиенты и CDN его не закэшировали
+                retry_after = math.ceil(e.retry_after) if isinstance(e, CircuitOpenError) else 5
+                raise HTTPException(status_code=503, detail="video storage unavailable", headers={"Retry-After": str(max(1, retry_after))})
+            raise
+        last_modified = head.get("last_modified")
+        meta = {
+            "size": head["size"],
+            "etag": head.get("etag") or f'"{hashlib.sha256(s3u.encode()).hexdigest()[:32]}"',
+            "last_modified": format_datetime(last_modified, usegmt=True) if last_modified else None,
+            "content_type": head.get("content_type") or "video/mp4",
+        }
+    size = int(meta["size"])
+    headers = {
+        "ETag": meta["etag"],
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=86400",
+    }
+    if meta.get("last_modified"):
+        headers["Last-Modified"] = meta["last_modified"]
+
+    # Условные запросы: If-None-Match приоритетнее If-Modified-Since
+    if request.headers.get("If-None-Match"):
+        if _etag_matches(request, meta["etag"]):
+            return Response(status_code=304, headers=headers)
+    elif request.headers.get("If-Modified-Since") and meta.get("last_modified"):
+        try:
+            if parsedate_to_datetime(meta["last_modified"]) <= parsedate_to_datetime(request.headers["If-Modified-Since"]):
+                return Response(status_code=304, headers=headers)
+        except (TypeError, ValueError):
+            pass
+
+    range_header = request.headers.get("Range")
+    if_range = request.headers.get("If-Range")
+    if range_header and if_range and if_range.strip() not in (meta["etag"], meta.get("last_modified")):
+        range_header = None  # файл изменился — отдаём целиком
+    try:
+        byte_range = _parse_range(range_header, size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    status_code = 200
+    start, end = 0, size - 1
+    if byte_range:
+        status_code = 206
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    length = max(0, end - start + 1)
+    headers["Content-Length"] = str(length)
+
+    if path:
+        body = _iter_file(path, start, length)
+    elif byte_range:
+        body = iter_object(bucket, key, start, end, chunk_size=_VIDEO_CHUNK)
+        if size <= _video_max_entry():
+            _fill_video_cache_later(s3u, bucket, key, meta)
+    else:
+        body = _iter_s3_and_fill(s3u, bucket, key, meta)
+    return StreamingResponse(body, status_code=status_code, media_type=meta.get("content_type") or "video/mp4", headers=headers)
+
+
+# --- Админские эндпоинты ---
+
+def _is_admin(request: Request) -> bool:
+    token = request.headers.get("X-Admin-Token") or ""
+    return bool(settings.admin_token) and hmac.compare_digest(token, settings.admin_token)
+
+
+def _require_admin(request: Request) -> None:
+    if not _is_admin(request):
+        raise HTTPException(status_code=403, detail="forbidden")
+
+
+@app.get("/admin/orders/{order_id}/timeline")
+async def admin_order_timeline(order_id: str, request: Request, format: str = "json"):
+    _require_admin(request)
+    order = await aorders.load(order_id)
+    if not order:
+        raise HTTPException(status_code=404, detail="request not found")
+    if format == "otlp":
+        return tracing.to_otlp(order)
+    return tracing.timeline(order)
+
+
+@app.get("/admin/traces/report")
+async def admin_traces_report(request: Request, days: int = 7):
+    """p50/p95 по этапам заявок за последние days дневных файлов."""
+    _require_admin(request)
+    recent = await aorders.list_recent_orders(max_files=max(1, days))
+    return {"orders": len(recent), "stages": tracing.stage_report(recent)}
+
+
+def _check_day(value: Optional[str], name: str) -> Optional[str]:
+    if value is None:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name}: expected YYYY-MM-DD")
+
+
+@app.get("/admin/orders/export")
+def admin_orders_export(request: Request, date_from: Optional[str] = None, date_to: Optional[str] = None, archive: bool = True):
+    """NDJSON со всеми заявками за [date_from, date_to] (YYYY-MM-DD, включительно), потоком по дням."""
+    from app.models.schemas import dumps
+    from fastapi.responses import StreamingResponse
+
+    _require_admin(request)
+    date_from, date_to = _check_day(date_from, "date_from"), _check_day(date_to, "date_to")
+
+    def _lines():
+        for order in orders.iter_orders(date_from, date_to, include_archive=archive):
+            yield dumps(order) + b"\n"
+
+    name = f"orders_{date_from or 'start'}_{date_to or 'end'}.ndjson"
+    return StreamingResponse(
+        _lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{name}"'},
+    )
+
+
+@app.get("/admin/stats/daily")
+async def admin_stats_daily(request: Request, date_from: Optional[str] = None, date_to: Optional[str] = None):
+    """Дневные агрегаты (заявки, оплаты, выручка, элементы, среднее время генерации) и итог диапазона."""
+    _require_admin(request)
+    date_from, date_to = _check_day(date_from, "date_from"), _check_day(date_to, "date_to")
+    return await executors.run("store", lambda: orders.daily_stats.range(date_from, date_to))
+
+
+@app.post("/admin/store/archive")
+def admin_store_archive(request: Request, dry_run: bool = True, older_than_days: Optional[int] = None):
+    """Переносит старые дневные файлы заявок в сжатый архив; по умолчанию только отчёт (dry_run)."""
+    _require_admin(request)
+    if older_than_days is None:
+        # ARCHIVE_AFTER_DAYS=0 — архивирование выключено
+        if settings.archive_after_days <= 0:
+            raise HTTPException(status_code=400, detail="archiving is disabled (ARCHIVE_AFTER_DAYS=0)")
+        older_than_days = settings.archive_after_days
+    elif older_than_days < 1:
+        raise HTTPException(status_code=400, detail="older_than_days must be >= 1")
+    return orders.archive_days(
+        older_than_days=older_than_days,
+        compression=settings.archive_compression,
+        dry_run=dry_run,
+    )
+
+
+@app.post("/admin/retention/run")
+def admin_retention_run(request: Request, dry_run: bool = True):
+    """dry_run=true — отчёт о том, что будет удалено; dry_run=false — фоновый прогон с удалением."""
+    _require_admin(request)
+    if dry_run:
+        return _retention().run(dry_run=True)
+    started = _retention().start()
+    return JSONResponse(status_code=202 if started else 409, content={"started": started, **_retention().status()})
+
+
+@app.get("/admin/retention")
+async def admin_retention_status(request: Request):
+    _require_admin(request)
+    return await executors.run("store", _retention().status)
+
+
+_reconcile_instance: ReconcileJob | None = None
+
+
+def _reconcile() -> ReconcileJob:
+    """Сверка застрявших заявок: результаты применяет теми же функциями, что поллер и вебхуки."""
+    global _reconcile_instance
+    if _reconcile_instance is None:
+        _reconcile_instance = reconcile_job(orders, complete_item=_complete_item, apply_results=_apply_item_results, notify=_notify_completed)
+    return _reconcile_instance
+
+
+@app.post("/admin/reconcile/run")
+async def admin_reconcile_run(
+    request: Request,
+    dry_run: bool = True,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    archive: bool = False,
+):
+    """Фоновый прогон сверки (dry_run=true — только отчёт); результат — GET /admin/reconcile."""
+    _require_admin(request)
+    date_from = _check_day(date_from, "date_from")
+    date_to = _check_day(date_to, "date_to")
+    started = _reconcile().start(dry_run=dry_run, date_from=date_from, date_to=date_to, include_archive=archive)
+    return JSONResponse(status_code=202 if started else 409, content={"started": started, **(await executors.run("store", _reconcile().status))})
+
+
+@app.get("/admin/reconcile")
+async def admin_reconcile_status(request: Request):
+    _require_admin(request)
+    return await executors.run("store", _reconcile().status)
+
+
+@app.get("/admin/breakers")
+async def admin_breakers(request: Request):
+    _require_admin(request)
+    return breaker_states()
+
+
+@app.get("/admin/fal/endpoints")
+async def admin_fal_endpoints(request: Request):
+    _require_admin(request)
+    return fal_router.router().snapshot()
+
+
+@app.get("/admin/scheduler")
+async def admin_scheduler(request: Request):
+    _require_admin(request)
+    return scheduler().stats()
+
+
+@app.get("/admin/admission")
+async def admin_admission(request: Request):
+    _require_admin(request)
+    return _admission().stats()
+
+
+@app.get("/admin/profile")
+def admin_profile(request: Request, seconds: float = 10.0, interval_ms: float = 5.0):
+    """Сэмплирует стеки всех потоков процесса (включая fal-poll) seconds секунд.
+
+    Возвращает collapsed stacks для flamegraph.pl / speedscope. Синхронный эндпоинт:
+    ожидание идёт в threadpool и не блокирует event loop.
+    """
+    _require_admin(request)
+    seconds = max(0.1, min(seconds, 120.0))
+    collapsed = profiler.profile_for(seconds, interval=max(1.0, interval_ms) / 1000)
+    if collapsed is None:
+        raise HTTPException(status_code=409, detail="profiling already in progress")
+    name = profiler.save_profile(collapsed, settings.profiles_dir, label="process")
+    return Response(
+        content=collapsed,
+        media_type="text/plain; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{name}"'},
+    )
+
+
+@app.get("/admin/profiles/{name}")
+async def admin_profile_file(name: str, request: Request):
+    _require_admin(request)
+    path = os.path.join(settings.profiles_dir, os.path.basename(name))
+    if not name.endswith(".collapsed") or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="profile not found")
+    with open(path, "r", encoding="utf-8") as f:
+        return Response(content=f.read(), media_type="text/plain; charset=utf-8")
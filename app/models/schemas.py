@@ -1,5 +1,14 @@
 from pydantic import BaseModel
-from typing import Optional
+from dataclasses import dataclass, field, fields
+from datetime import datetime
+from enum import Enum
+from typing import Any, Dict, List, Optional, Tuple
+import json
+
+try:
+	import orjson
+except ImportError:  # без orjson — stdlib json в компактном виде
+	orjson = None
 
 class ErrorResponse(BaseModel):
 	error: str
@@ -14,4 +23,235 @@ class FalResult(BaseModel):
 		extra = "allow"
 
 
+# --- Заявка: типизированное представление записи JsonOrderStore ---
+# На диске заявка остаётся JSON-объектом прежней формы; неизвестные ключи сохраняются в extra
+# и возвращаются при записи, поэтому старые файлы читаются и переписываются без потерь.
+
+class ItemStatus(str, Enum):
+	PENDING = "pending"
+	RUNNING = "running"
+	SUCCEEDED = "succeeded"
+	FAILED = "failed"
+	# сбой зависимости (таймаут, 5xx, открытый circuit breaker): поллер повторит после retry_at
+	RETRY_LATER = "retry_later"
+
+	@property
+	def terminal(self) -> bool:
+		return self in (ItemStatus.SUCCEEDED, ItemStatus.FAILED)
+
+
+class GenerationStatus(str, Enum):
+	WAITING_PAYMENT = "waiting_payment"
+	IN_PROGRESS = "in_progress"
+	COMPLETED = "completed"
+
+
+class PaymentStatus(str, Enum):
+	GATEWAY_PENDING = "gateway_pending"
+	PAID = "paid"
+
+
+def _enum(cls: type, value: Any) -> Any:
+	"""Значение enum; незнакомые статусы оставляем строкой, чтобы не терять их при записи."""
+	if value is None or isinstance(value, cls):
+		return value
+	try:
+		return cls(value)
+	except ValueError:
+		return value
+
+
+def _plain(value: Any) -> Any:
+	return value.value if isinstance(value, Enum) else value
+
+
+def public_video_fields(url: str, expires_in: Optional[int]) -> Dict[str, Any]:
+	"""Поля элемента для выданной presigned-ссылки на видео (единственное место, где они задаются)."""
+	return {
+		"public_video_url": url,
+		"expires_in": expires_in,
+		"public_url_created_at": datetime.utcnow().isoformat(),
+	}
+
+
+@dataclass(slots=True)
+class GenerationItem:
+	status: ItemStatus | str = ItemStatus.PENDING
+	prompt: Optional[str] = None
+	image_url: Optional[str] = None
+	public_image_url: Optional[str] = None
+	input_s3_url: Optional[str] = None
+	expires_in: Optional[int] = None
+	request_id: Optional[str] = None
+	model_id: Optional[str] = None
+	fal_endpoint: Optional[str] = None
+	submitted_at: Optional[str] = None
+	result_s3_url: Optional[str] = None
+	video_url: Optional[str] = None
+	public_video_url: Optional[str] = None
+	public_url_created_at: Optional[str] = None
+	fal_response_url: Optional[str] = None
+	error: Optional[str] = None
+	attempts: int = 0
+	retry_at: Optional[str] = None
+	extra: Dict[str, Any] = field(default_factory=dict)
+
+	@property
+	def terminal(self) -> bool:
+		return isinstance(self.status, ItemStatus) and self.status.terminal
+
+	def set_public_video(self, url: str, expires_in: Optional[int]) -> Dict[str, Any]:
+		patch = public_video_fields(url, expires_in)
+		for k, v in patch.items():
+			setattr(self, k, v)
+		return patch
+
+	@classmethod
+	def from_dict(cls, data: Dict[str, Any]) -> "GenerationItem":
+		known, extra = _split(cls, data)
+		known["status"] = _enum(ItemStatus, known.get("status")) or ItemStatus.PENDING
+		known["attempts"] = int(known.get("attempts") or 0)
+		return cls(**known, extra=extra)
+
+	def to_dict(self) -> Dict[str, Any]:
+		return _to_dict(self)
+
+
+@dataclass(slots=True)
+class Payment:
+	provider: Optional[str] = None
+	status: PaymentStatus | str | None = None
+	payment_id: Optional[str] = None
+	payment_url: Optional[str] = None
+	error: Optional[str] = None
+	extra: Dict[str, Any] = field(default_factory=dict)
+
+	@classmethod
+	def from_dict(cls, data: Dict[str, Any]) -> "Payment":
+		known, extra = _split(cls, data)
+		known["status"] = _enum(PaymentStatus, known.get("status"))
+		return cls(**known, extra=extra)
+
+	def to_dict(self) -> Dict[str, Any]:
+		return _to_dict(self)
+
+
+@dataclass(slots=True)
+class Generation:
+	status: GenerationStatus | str | None = None
+	items: List[GenerationItem] = field(default_factory=list)
+	completed_at: Optional[str] = None
+	# заявка завершилась, письмо с результатами ещё не отправлено (снимается после отправки)
+	notify_pending: Optional[bool] = None
+	extra: Dict[str, Any] = field(default_factory=dict)
+
+	@classmethod
+	def from_dict(cls, data: Dict[str, Any]) -> "Generation":
+		known, extra = _split(cls, data)
+		known["status"] = _enum(GenerationStatus, known.get("status"))
+		known["items"] = [GenerationItem.from_dict(x) for x in (known.get("items") or [])]
+		return cls(**known, extra=extra)
+
+	def to_dict(self) -> Dict[str, Any]:
+		data = _to_dict(self)
+		data["items"] = [x.to_dict() for x in self.items]
+		return data
+
+
+@dataclass(slots=True)
+class Order:
+	order_id: str
+	anonUserId: Optional[str] = None
+	email: Optional[str] = None
+	price_rub: Optional[float] = None
+	created_at: Optional[str] = None
+	updated_at: Optional[str] = None
+	version: int = 0
+	payment: Payment = field(default_factory=Payment)
+	generation: Generation = field(default_factory=Generation)
+	extra: Dict[str, Any] = field(default_factory=dict)
+
+	@property
+	def pending_items(self) -> List[Tuple[int, GenerationItem]]:
+		"""Незавершённые элементы под присмотром поллера: в очереди fal или ждущие повтора (retry_later)."""
+		return [
+			(i, x) for i, x in enumerate(self.generation.items)
+			if not x.terminal and (x.request_id or x.status == ItemStatus.RETRY_LATER)
+		]
+
+	def due_items(self, now: datetime) -> List[Tuple[int, GenerationItem]]:
+		"""pending_items, которые пора обработать: retry_at не задан или уже наступил."""
+		stamp = now.isoformat()
+		return [(i, x) for i, x in self.pending_items if not x.retry_at or x.retry_at <= stamp]
+
+	@property
+	def stranded_items(self) -> List[Tuple[int, GenerationItem]]:
+		"""Элементы оплаченной заявки, которые никто не ведёт: постановка в fal прервана (не в очереди и не ждут повтора)."""
+		if self.generation.status != GenerationStatus.IN_PROGRESS:
+			return []
+		return [
+			(i, x) for i, x in enumerate(self.generation.items)
+			if not x.terminal and not x.request_id and x.status != ItemStatus.RETRY_LATER
+		]
+
+	@classmethod
+	def from_dict(cls, data: Dict[str, Any]) -> "Order":
+		known, extra = _split(cls, data)
+		# request_id исторически дублирует order_id
+		known["order_id"] = known.get("order_id") or extra.get("request_id") or ""
+		known["version"] = int(known.get("version") or 0)
+		known["payment"] = Payment.from_dict(known.get("payment") or {})
+		known["generation"] = Generation.from_dict(known.get("generation") or {})
+		return cls(**known, extra=extra)
+
+	def to_dict(self) -> Dict[str, Any]:
+		data = _to_dict(self)
+		data["payment"] = self.payment.to_dict()
+		data["generation"] = self.generation.to_dict()
+		return data
+
+
+_FIELD_NAMES: Dict[type, Tuple[str, ...]] = {}
+
+
+def _field_names(cls: type) -> Tuple[str, ...]:
+	names = _FIELD_NAMES.get(cls)
+	if names is None:
+		names = _FIELD_NAMES[cls] = tuple(f.name for f in fields(cls) if f.name != "extra")
+	return names
+
+
+def _split(cls: type, data: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+	names = _field_names(cls)
+	known: Dict[str, Any] = {}
+	extra: Dict[str, Any] = {}
+	for k, v in data.items():
+		(known if k in names else extra)[k] = v
+	return known, extra
+
+
+def _to_dict(obj: Any) -> Dict[str, Any]:
+	# Пустые поля не пишем: читатели используют .get(), а файл заметно короче
+	data: Dict[str, Any] = {}
+	for name in _field_names(type(obj)):
+		value = getattr(obj, name)
+		if value is not None:
+			data[name] = _plain(value)
+	data.update(obj.extra)
+	return data
+
+
+# --- Компактная сериализация дневных файлов ---
+
+def dumps(obj: Any) -> bytes:
+	"""JSON без отступов в UTF-8; orjson, если установлен."""
+	if orjson is not None:
+		return orjson.dumps(obj)
+	return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
 
+def loads(data: bytes | str) -> Any:
+	"""Читает и компактный, и старый (indent=2) формат."""
+	if orjson is not None:
+		return orjson.loads(data)
+	return json.loads(data)
@@ -0,0 +1,94 @@
+"""Async-фасад над блокирующими клиентами: хранилище заявок, S3, fal, SMTP и YooKassa.
+
+Каждая зависимость выполняется в своём пуле потоков (app.utils.executors), поэтому зависший
+SMTP или медленный fal не занимают потоки, нужные для чтения заявок и S3. Обработчики FastAPI
+вызывают блокирующий код только через этот модуль (или executors.run для составных шагов).
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.services import email_service, fal_service, yookassa_service
+from app.utils import s3_utils
+from app.utils.executors import run
+from app.utils.file_utils import JsonOrderStore
+
+
+class AsyncOrderStore:
+	"""Те же операции, что у JsonOrderStore, в пуле "store"; peek_version — без пула (только stat)."""
+
+	def __init__(self, store: JsonOrderStore) -> None:
+		self.store = store
+
+	def peek_version(self, order_id: str) -> Tuple[int, Optional[str]] | None:
+		return self.store.peek_version(order_id)
+
+	async def load(self, order_id: str) -> dict | None:
+		return await run("store", self.store.load, order_id)
+
+	async def save(self, order: dict, check_version: bool = True) -> None:
+		await run("store", self.store.save, order, check_version)
+
+	async def update(self, order_id: str, mutator: Callable[[dict], Optional[bool]]) -> dict | None:
+		return await run("store", self.store.update, order_id, mutator)
+
+	async def update_status(self, order_id: str, status: str) -> None:
+		await run("store", self.store.update_status, order_id, status)
+
+	async def delete(self, order_id: str) -> bool:
+		return await run("store", self.store.delete, order_id)
+
+	async def list_recent_orders(self, max_files: int = 7) -> List[dict]:
+		return await run("store", self.store.list_recent_orders, max_files)
+
+	async def orders_for_user(self, anon_user_id: str, limit: int = 20, after: Optional[Tuple[str, str]] = None) -> Tuple[List[dict], Optional[Tuple[str, str]]]:
+		return await run("store", self.store.orders_for_user, anon_user_id, limit, after)
+
+
+# --- S3 ---
+
+async def s3_upload_bytes(bucket: str, key: str, data: bytes, content_type: Optional[str] = None) -> None:
+	await run("s3", s3_utils.upload_bytes, bucket, key, data, content_type=content_type)
+
+
+async def s3_presign(bucket: str, key: str, expires: Optional[int] = None) -> tuple[str, int]:
+	return await run("s3", s3_utils.get_file_url_with_expiry, bucket, key, expires)
+
+
+async def s3_head(bucket: str, key: str) -> dict:
+	return await run("s3", s3_utils.head_object, bucket, key)
+
+
+# --- fal ---
+
+async def fal_upload_and_generate(image_path: str, prompt: str, sync_mode: bool = True) -> Dict[str, Any]:
+	return await run("fal", fal_service.upload_file_and_generate, image_path, prompt=prompt, sync_mode=sync_mode)
+
+
+async def fal_generate_multiple(image_paths: List[str], prompts: List[str] | None = None, sync_mode: bool = True) -> List[Dict[str, Any]]:
+	return await run("fal", fal_service.generate_multiple, image_paths, prompts=prompts, sync_mode=sync_mode)
+
+
+async def fal_fetch_queue_json(url: str) -> Dict[str, Any]:
+	return await run("fal", fal_service.fetch_queue_json, url)
+
+
+# --- SMTP ---
+
+async def send_email_with_links(recipient_email: str, links: List[Any], request_id: Optional[str] = None) -> None:
+	await run("smtp", email_service.send_email_with_links, recipient_email, links, request_id=request_id)
+
+
+async def send_payment_receipt(recipient_email: str, amount_rub: float, order_id: str, payment_id: str) -> None:
+	await run("smtp", email_service.send_payment_receipt, recipient_email, amount_rub, order_id, payment_id)
+
+
+# --- YooKassa ---
+
+async def yk_create_payment(order_id: str, amount_rub: float, description: str, return_url: str, email: str | None = None, anon_user_id: str | None = None) -> Dict[str, Any]:
+	return await run(
+		"yookassa", yookassa_service.create_payment,
+		order_id, amount_rub, description, return_url, email=email, anon_user_id=anon_user_id,
+	)
+
+
+async def yk_get_payment(payment_id: str) -> Dict[str, Any]:
+	return await run("yookassa", yookassa_service.get_payment, payment_id)
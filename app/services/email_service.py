@@ -1,15 +1,30 @@
 from email.message import EmailMessage
-import ssl
-import smtplib
 from typing import List, Tuple, Optional, Any
 
 from app.config import settings
+from app.utils.resilience import guarded, timeout_for
 
 
 def _smtp_conn():
+	# smtplib/ssl подгружаем только при отправке письма
+	import smtplib
+	import ssl
+
 	host = settings.smtp_server or settings.smtp_host
 	port = settings.smtp_port
-	return smtplib.SMTP_SSL(host, port, context=ssl.create_default_context())
+	timeout = timeout_for(30)
+	if not settings.smtp_use_ssl:
+		return smtplib.SMTP(host, port, timeout=timeout)
+	return smtplib.SMTP_SSL(host, port, context=ssl.create_default_context(), timeout=timeout)
+
+
+def _send(msg: EmailMessage) -> None:
+	with guarded("smtp", "send"):
+		with _smtp_conn() as smtp:
+			user = settings.smtp_email or settings.smtp_username
+			if user and settings.smtp_password:
+				smtp.login(user, settings.smtp_password)
+			smtp.send_message(msg)
 
 
 def send_email_with_links(recipient_email: str, links: List[Any], request_id: Optional[str] = None) -> None:
@@ -125,11 +140,7 @@ def send_email_with_links(recipient_email: str, links: List[Any], request_id: Op
 	msg["To"] = recipient_email
 	msg.set_content(text_body)
 	msg.add_alternative(html_body, subtype="html")
-	with _smtp_conn() as smtp:
-		user = settings.smtp_email or settings.smtp_username
-		if user and settings.smtp_password:
-			smtp.login(user, settings.smtp_password)
-		smtp.send_message(msg)
+	_send(msg)
 
 
 def send_payment_receipt(recipient_email: str, amount_rub: float, order_id: str, payment_id: str) -> None:
@@ -144,11 +155,7 @@ def send_payment_receipt(recipient_email: str, amount_rub: float, order_id: str,
 		f"Платеж: {payment_id}\n"
 	)
 	msg.set_content(body)
-	with _smtp_conn() as smtp:
-		user = settings.smtp_email or settings.smtp_username
-		if user and settings.smtp_password:
-			smtp.login(user, settings.smtp_password)
-		smtp.send_message(msg)
+	_send(msg)
 
 
 def send_email_with_attachments(
@@ -165,8 +172,4 @@ def send_email_with_attachments(
 	for filename, content, content_type in attachments:
 		maintype, subtype = (content_type or "application/octet-stream").split("/", 1)
 		msg.add_attachment(content, maintype=maintype, subtype=subtype, filename=filename)
-	with _smtp_conn() as smtp:
-		user = settings.smtp_email or settings.smtp_username
-		if user and settings.smtp_password:
-			smtp.login(user, settings.smtp_password)
-		smtp.send_message(msg)
+	_send(msg)
@@ -0,0 +1,169 @@
+"""Маршрутизация задач по пулу эндпоинтов fal: веса, отказоустойчивость, пределы параллельности.
+
+Пул задаётся FAL_ENDPOINTS — список через запятую, элемент `endpoint[@вес][:предел]`, например
+`fal-ai/kling-video/v2/master/image-to-video@3:40,fal-ai/minimax/video-01/image-to-video@1:10`.
+Без FAL_ENDPOINTS пул состоит из одного FAL_ENDPOINT без предела.
+
+- вес — доля новых задач среди доступных эндпоинтов (случайный выбор с весами);
+- предел — сколько задач эндпоинта может одновременно быть в очереди fal (0 — без предела).
+  Число задач в очереди берётся из тика поллера (по fal_endpoint незавершённых элементов всех
+  заявок) плюс поставленные этим процессом после тика;
+- у каждого эндпоинта свой circuit breaker `fal:{endpoint}`: открытый исключает эндпоинт из выбора,
+  и задача уходит на следующий (failover).
+
+Пределы и breaker'ы привязаны к полному эндпоинту: эндпоинты одной модели с разными subpath
+считаются отдельно.
+
+Если все эндпоинты пула недоступны (breaker открыт), choose() бросает CircuitOpenError; если
+доступные есть, но все на пределе — EndpointsSaturated: задачу придерживают, это не сбой.
+"""
+import random
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from app.config import settings
+from app.utils.metrics import FAL_ROUTED
+from app.utils.resilience import CircuitOpenError, breaker
+
+
+class EndpointsSaturated(Exception):
+	"""Все доступные эндпоинты пула на пределе параллельности; retry_after — когда пробовать снова."""
+
+	def __init__(self, retry_after: float) -> None:
+		super().__init__("all fal endpoints are at their concurrency limit")
+		self.retry_after = retry_after
+
+
+def base_model(endpoint: str) -> str:
+	"""namespace/model без subpath: так fal адресует статус и результат задачи."""
+	parts = (endpoint or "").split("/")
+	return "/".join(parts[:2]) if len(parts) >= 2 else endpoint
+
+
+def endpoint_for(fal_endpoint: Optional[str], model_id: Optional[str] = None) -> str:
+	"""Полный эндпоинт, принявший задачу элемента.
+
+	Записанный в элементе fal_endpoint; у элементов, поставленных до пула, — эндпоинт пула
+	с тем же model_id (иначе сам model_id), без model_id — FAL_ENDPOINT.
+	"""
+	if fal_endpoint:
+		return fal_endpoint
+	if model_id:
+		model = base_model(model_id)
+		for ep in router().endpoints:
+			if ep.model == model:
+				return ep.endpoint
+		return model_id
+	return settings.fal_endpoint
+
+
+def dependency_for(endpoint: str) -> str:
+	"""Имя circuit breaker эндпоинта."""
+	return f"fal:{endpoint}"
+
+
+@dataclass(slots=True)
+class FalEndpoint:
+	endpoint: str
+	weight: float = 1.0
+	max_inflight: int = 0
+
+	@property
+	def model(self) -> str:
+		return base_model(self.endpoint)
+
+	@property
+	def dependency(self) -> str:
+		return dependency_for(self.endpoint)
+
+
+def parse_endpoints(spec: Optional[str], default: str) -> List[FalEndpoint]:
+	endpoints: List[FalEndpoint] = []
+	for part in (spec or "").split(","):
+		part = part.strip()
+		if not part:
+			continue
+		limit = 0
+		if ":" in part:
+			part, _, raw_limit = part.rpartition(":")
+			limit = int(raw_limit)
+		weight = 1.0
+		if "@" in part:
+			part, _, raw_weight = part.rpartition("@")
+			weight = float(raw_weight)
+		endpoints.append(FalEndpoint(part.strip(), max(0.0, weight), max(0, limit)))
+	return endpoints or [FalEndpoint(default)]
+
+
+class FalRouter:
+	def __init__(self, endpoints: List[FalEndpoint]) -> None:
+		self.endpoints = endpoints
+		self._lock = threading.Lock()
+		# endpoint -> задач в очереди fal по последнему тику поллера
+		self._observed: Dict[str, int] = {}
+		# endpoint -> поставлено этим процессом после тика
+		self._submitted: Dict[str, int] = {}
+
+	def inflight(self, ep: FalEndpoint) -> int:
+		with self._lock:
+			return self._observed.get(ep.endpoint, 0) + self._submitted.get(ep.endpoint, 0)
+
+	def observe_inflight(self, counts: Dict[str, int]) -> None:
+		"""Снимок поллера: полный эндпоинт -> незавершённые элементы в очереди fal."""
+		with self._lock:
+			self._observed = dict(counts)
+			self._submitted = {}
+
+	def choose(self, exclude: frozenset = frozenset()) -> FalEndpoint:
+		"""Эндпоинт для новой задачи; CircuitOpenError — доступных нет, EndpointsSaturated — все на пределе."""
+		candidates = []
+		saturated = False
+		for ep in self.endpoints:
+			if ep.endpoint in exclude or ep.weight <= 0:
+				continue
+			if breaker(ep.dependency).state == "open":
+				continue
+			if ep.max_inflight and self.inflight(ep) >= ep.max_inflight:
+				FAL_ROUTED.labels(ep.endpoint, "saturated").inc()
+				saturated = True
+				continue
+			candidates.append(ep)
+		if not candidates:
+			if saturated:
+				raise EndpointsSaturated(settings.poll_interval_seconds)
+			raise CircuitOpenError("fal", settings.poll_interval_seconds)
+		return random.choices(candidates, weights=[ep.weight for ep in candidates])[0]
+
+	def submitted(self, ep: FalEndpoint) -> None:
+		with self._lock:
+			self._submitted[ep.endpoint] = self._submitted.get(ep.endpoint, 0) + 1
+		FAL_ROUTED.labels(ep.endpoint, "submitted").inc()
+
+	def failed(self, ep: FalEndpoint) -> None:
+		FAL_ROUTED.labels(ep.endpoint, "failover").inc()
+
+	def snapshot(self) -> List[Dict[str, object]]:
+		return [
+			{
+				"endpoint": ep.endpoint,
+				"weight": ep.weight,
+				"max_inflight": ep.max_inflight,
+				"inflight": self.inflight(ep),
+				"circuit": breaker(ep.dependency).state,
+			}
+			for ep in self.endpoints
+		]
+
+
+_router: Optional[FalRouter] = None
+_router_lock = threading.Lock()
+
+
+def router() -> FalRouter:
+	global _router
+	if _router is None:
+		with _router_lock:
+			if _router is None:
+				_router = FalRouter(parse_endpoints(settings.fal_endpoints, settings.fal_endpoint))
+	return _router
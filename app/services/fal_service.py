@@ -1,35 +1,66 @@
 from typing import Any, Dict, List, Optional
 import os
-import fal_client
-import requests
 import logging
-import json as _json
+import threading
 
 from app.config import settings
 from app.utils.s3_utils import parse_s3_url, get_file_url_with_expiry
+from app.utils.metrics import VIDEO_FETCHES
+from app.utils.resilience import CircuitOpenError, DeadlineExceeded, guarded, is_transient, timeout_for
+from app.services import fal_router
+from app.utils.singleflight import SingleFlight
+from app.utils.logging_setup import LazyJson
 
 
 logger = logging.getLogger("livephoto.fal")
 
-# Ensure API key is set for fal_client
-os.environ.setdefault("FAL_KEY", settings.fal_key)
+_client_lock = threading.Lock()
+_fal_module = None
+_http_session = None
+_video_cache = None
+_video_flight = SingleFlight()
+
+
+def _fal_client():
+	"""fal_client импортируется при первом вызове SDK; там же выставляем FAL_KEY для него."""
+	global _fal_module
+	if _fal_module is None:
+		with _client_lock:
+			if _fal_module is None:
+				os.environ.setdefault("FAL_KEY", settings.fal_key)
+				import fal_client
+				_fal_module = fal_client
+	return _fal_module
+
+
+def _http():
+	"""Общая requests.Session (пул соединений к queue.fal.run и CDN), создаётся лениво."""
+	global _http_session
+	if _http_session is None:
+		with _client_lock:
+			if _http_session is None:
+				import requests
+				_http_session = requests.Session()
+	return _http_session
 
 
 def upload_file_and_generate(image_path: str, prompt: str, sync_mode: bool = True) -> Dict[str, Any]:
 	logger.info(f"fal.sdk upload_file path={image_path}")
-	uploaded_url = fal_client.upload_file(image_path)
+	with guarded("fal", "upload"):
+		uploaded_url = _fal_client().upload_file(image_path)
 	logger.info(f"fal.sdk upload_file -> url={uploaded_url}")
 	logger.info(f"fal.sdk subscribe model={settings.fal_endpoint} args={{'prompt': <len={len(prompt)}>, 'image_url': '<uploaded>', 'sync_mode': {sync_mode}}}")
-	result = fal_client.subscribe(
-		settings.fal_endpoint,
-		arguments={
-			"prompt": prompt,
-			"image_url": uploaded_url,
-			"sync_mode": sync_mode,
-		},
-		with_logs=True,
-	)
-	logger.info(f"fal.sdk subscribe -> result={_json.dumps(result)[:2000]}")
+	with guarded("fal", "subscribe"):
+		result = _fal_client().subscribe(
+			settings.fal_endpoint,
+			arguments={
+				"prompt": prompt,
+				"image_url": uploaded_url,
+				"sync_mode": sync_mode,
+			},
+			with_logs=True,
+		)
+	logger.info("fal.sdk subscribe -> result=%s", LazyJson(result))
 	return result
 
 
@@ -51,16 +82,17 @@ def generate_from_url(image_url: str, prompt: str, sync_mode: bool = True) -> Di
 	except Exception:
 		pass
 	logger.info(f"fal.sdk subscribe model={settings.fal_endpoint} args={{'prompt': <len={len(prompt)}>, 'image_url': '<url>', 'sync_mode': {sync_mode}}}")
-	result = fal_client.subscribe(
-		settings.fal_endpoint,
-		arguments={
-			"prompt": prompt,
-			"image_url": image_url,
-			"sync_mode": sync_mode,
-		},
-		with_logs=True,
-	)
-	logger.info(f"fal.sdk subscribe -> result={_json.dumps(result)[:2000]}")
+	with guarded("fal", "subscribe"):
+		result = _fal_client().subscribe(
+			settings.fal_endpoint,
+			arguments={
+				"prompt": prompt,
+				"image_url": image_url,
+				"sync_mode": sync_mode,
+			},
+			with_logs=True,
+		)
+	logger.info("fal.sdk subscribe -> result=%s", LazyJson(result))
 	return result
 
 
@@ -81,8 +113,7 @@ def submit_generation(image_url: str, prompt: str, order_id: str, item_index: in
 	except Exception:
 		pass
 
-	# HTTP Queue API (без использования fal_client.queue)
-	queue_url = f"https://queue.fal.run/{settings.fal_endpoint}"
+	# HTTP Queue API (без использования fal_client.queue); эндпоинт выбирает маршрутизатор пула
 	headers = {
 		"Authorization": f"Key {settings.fal_key}",
 		"Content-Type": "application/json",
@@ -93,47 +124,72 @@ def submit_generation(image_url: str, prompt: str, order_id: str, item_index: in
 		"webhook_url": webhook_url,
 	}
 	log_headers = {**headers, "Authorization": "Key ****"}
-	logger.info(f"fal.http POST {queue_url} headers={log_headers} json={_json.dumps(payload)[:2000]}")
-	resp = requests.post(queue_url, json=payload, headers=headers, timeout=30)
-	resp.raise_for_status()
-	data = resp.json()
-	logger.info(f"fal.http <- {resp.status_code} body={_json.dumps(data)[:2000]}")
+	pool = fal_router.router()
+	tried: set = set()
+	last_error: Exception | None = None
+	while True:
+		try:
+			ep = pool.choose(frozenset(tried))
+		except CircuitOpenError:
+			# все доступные эндпоинты уже отказали — наружу исходная ошибка, а не «нет эндпоинтов»
+			if last_error is not None:
+				raise last_error
+			raise
+		queue_url = f"{settings.fal_queue_base}/{ep.endpoint}"
+		logger.info("fal.http POST %s headers=%s json=%s", queue_url, log_headers, LazyJson(payload))
+		try:
+			with guarded(ep.dependency, "submit"):
+				resp = _http().post(queue_url, json=payload, headers=headers, timeout=timeout_for(30))
+				resp.raise_for_status()
+				data = resp.json()
+		except Exception as e:
+			tried.add(ep.endpoint)
+			if not is_transient(e) or isinstance(e, DeadlineExceeded):
+				raise
+			# эндпоинт перегружен или недоступен — пробуем следующий из пула
+			pool.failed(ep)
+			last_error = e
+			logger.warning("fal.route: %s failed (%s), failover", ep.endpoint, e)
+			continue
+		break
+	logger.info("fal.http <- %s body=%s", resp.status_code, LazyJson(data))
 	request_id = data.get("request_id") or data.get("id") or data.get("requestId")
 	if not request_id:
 		raise ValueError("fal.ai queue: request_id not found in response")
-	# Сохраним base model id (namespace/model) для последующих запросов
-	parts = (settings.fal_endpoint or "").split("/")
-	base_model = "/".join(parts[:2]) if len(parts) >= 2 else settings.fal_endpoint
-	return {"request_id": request_id, "model_id": base_model}
+	pool.submitted(ep)
+	# Сохраним base model id (namespace/model) для последующих запросов и полный эндпоинт для отчётов
+	return {"request_id": request_id, "model_id": ep.model, "endpoint": ep.endpoint}
 
 
-def get_request_status(request_id: str, logs: bool = False, model_id: str | None = None) -> Dict[str, Any]:
+def get_request_status(request_id: str, logs: bool = False, model_id: str | None = None, endpoint: str | None = None) -> Dict[str, Any]:
 	"""Получить статус задачи очереди fal.ai."""
 	# Для статуса и ответа нельзя включать subpath — только базовый model_id (namespace/model)
-	parts = (model_id or settings.fal_endpoint or "").split("/")
-	base_model = "/".join(parts[:2]) if len(parts) >= 2 else (model_id or settings.fal_endpoint)
-	status_url = f"https://queue.fal.run/{base_model}/requests/{request_id}/status"
+	endpoint = fal_router.endpoint_for(endpoint, model_id)
+	base_model = fal_router.base_model(model_id or endpoint)
+	status_url = f"{settings.fal_queue_base}/{base_model}/requests/{request_id}/status"
 	params = {"logs": 1} if logs else None
 	headers = {"Authorization": f"Key {settings.fal_key}"}
-	logger.info(f"fal.http GET {status_url} headers={{'Authorization': 'Key ****'}} params={params}")
-	resp = requests.get(status_url, headers=headers, params=params, timeout=30)
-	resp.raise_for_status()
-	data = resp.json()
-	logger.info(f"fal.http <- {resp.status_code} body={_json.dumps(data)[:2000]}")
+	logger.info("fal.http GET %s headers={'Authorization': 'Key ****'} params=%s", status_url, params)
+	with guarded(fal_router.dependency_for(endpoint), "status"):
+		resp = _http().get(status_url, headers=headers, params=params, timeout=timeout_for(30))
+		resp.raise_for_status()
+		data = resp.json()
+	logger.info("fal.http <- %s body=%s", resp.status_code, LazyJson(data))
 	return data
 
 
-def get_request_response(request_id: str, model_id: str | None = None) -> Dict[str, Any]:
+def get_request_response(request_id: str, model_id: str | None = None, endpoint: str | None = None) -> Dict[str, Any]:
 	"""Получить результат задачи очереди fal.ai."""
-	parts = (model_id or settings.fal_endpoint or "").split("/")
-	base_model = "/".join(parts[:2]) if len(parts) >= 2 else (model_id or settings.fal_endpoint)
-	resp_url = f"https://queue.fal.run/{base_model}/requests/{request_id}"
+	endpoint = fal_router.endpoint_for(endpoint, model_id)
+	base_model = fal_router.base_model(model_id or endpoint)
+	resp_url = f"{settings.fal_queue_base}/{base_model}/requests/{request_id}"
 	headers = {"Authorization": f"Key {settings.fal_key}"}
-	logger.info(f"fal.http GET {resp_url} headers={{'Authorization': 'Key ****'}}")
-	resp = requests.get(resp_url, headers=headers, timeout=60)
-	resp.raise_for_status()
-	data = resp.json()
-	logger.info(f"fal.http <- {resp.status_code} body={_json.dumps(data)[:2000]}")
+	logger.info("fal.http GET %s headers={'Authorization': 'Key ****'}", resp_url)
+	with guarded(fal_router.dependency_for(endpoint), "response"):
+		resp = _http().get(resp_url, headers=headers, timeout=timeout_for(60))
+		resp.raise_for_status()
+		data = resp.json()
+	logger.info("fal.http <- %s body=%s", resp.status_code, LazyJson(data))
 	return data
 
 
@@ -196,11 +252,12 @@ def extract_media_url(payload: Dict[str, Any]) -> Optional[str]:
 def fetch_queue_json(url: str) -> Dict[str, Any]:
 	"""Авторизованный GET к queue.fal.run с логированием тела ответа."""
 	headers = {"Authorization": f"Key {settings.fal_key}"}
-	logger.info(f"fal.http GET {url} headers={{'Authorization': 'Key ****'}}")
-	resp = requests.get(url, headers=headers, timeout=60)
-	resp.raise_for_status()
-	data = resp.json()
-	logger.info(f"fal.http <- {resp.status_code} body={_json.dumps(data)[:2000]}")
+	logger.info("fal.http GET %s headers={'Authorization': 'Key ****'}", url)
+	with guarded("fal", "response"):
+		resp = _http().get(url, headers=headers, timeout=timeout_for(60))
+		resp.raise_for_status()
+		data = resp.json()
+	logger.info("fal.http <- %s body=%s", resp.status_code, LazyJson(data))
 	return data
 
 
@@ -210,8 +267,52 @@ def fetch_bytes(url: str, headers: Optional[Dict[str, str]] = None, timeout: int
 	if "Authorization" in mask_headers:
 		mask_headers["Authorization"] = "****"
 	logger.info(f"fal.http GET {url} headers={mask_headers}")
-	resp = requests.get(url, headers=headers, timeout=timeout)
-	resp.raise_for_status()
-	content_len = resp.headers.get("Content-Length") or len(resp.content)
+	with guarded("fal", "download"):
+		resp = _http().get(url, headers=headers, timeout=timeout_for(timeout))
+		resp.raise_for_status()
+		content = resp.content
+	content_len = resp.headers.get("Content-Length") or len(content)
 	logger.info(f"fal.http <- {resp.status_code} bytes={content_len}")
-	return resp.content
+	return content
+
+
+def _fetched_videos():
+	"""Кэш скачанных видео на диске (создаётся при первом обращении)."""
+	global _video_cache
+	if _video_cache is None:
+		with _client_lock:
+			if _video_cache is None:
+				from app.utils.disk_cache import DiskLRUCache
+				_video_cache = DiskLRUCache(settings.fal_video_cache_dir, settings.fal_video_cache_max_bytes)
+	return _video_cache
+
+
+def fetch_video_bytes(url: str, request_id: Optional[str] = None, timeout: int = 180) -> bytes:
+	"""Видео результата fal через кэш на диске.
+
+	Ключ — request_id задачи fal (или URL). Одновременные запросы одного видео (поллер, вебхук,
+	/results) ждут одну закачку; повторные берут файл из кэша.
+	"""
+	key = f"fal:{request_id}" if request_id else url
+	cached = _fetched_videos().get(key)
+	if cached:
+		VIDEO_FETCHES.labels("hit").inc()
+		with open(cached[0], "rb") as f:
+			return f.read()
+
+	def _download() -> bytes:
+		# повторная проверка: пока ждали очередь, видео мог положить другой процесс
+		hit = _fetched_videos().get(key)
+		if hit:
+			with open(hit[0], "rb") as f:
+				return f.read()
+		content = fetch_bytes(url, timeout=timeout)
+		try:
+			_fetched_videos().put_bytes(key, content, {"url": url})
+		except OSError:
+			logger.exception("fal.cache put failed key=%s", key)
+		return content
+
+	content, shared = _video_flight.do(key, _download)
+	VIDEO_FETCHES.labels("shared" if shared else "miss").inc()
+	return content
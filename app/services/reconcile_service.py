@@ -0,0 +1,448 @@
+"""Сверка заявок: поиск и исправление застрявших элементов по всему хранилищу.
+
+Несогласованные элементы:
+- running/pending с request_id без результата дольше RECONCILE_STALE_SECONDS (вебхук не пришёл,
+  поллер заявку уже не видит) — статус задачи в fal: готова → перекладка видео в S3; задачи в fal
+  нет (404) или нет ссылки на видео → failed; ещё идёт — не трогаем;
+- succeeded с видео в нашем S3 — HEAD объекта: объект есть, но нет public_video_url → новая ссылка;
+  объекта нет (загрузка не удалась) → повторная перекладка из fal_response_url;
+- succeeded без видео в S3, но с fal_response_url → перекладка;
+- все элементы завершены, а генерация нет → завершение заявки (письмо с результатами).
+
+Хранилище читается по дням (в памяти один день). Запросы статусов в fal и HEAD в S3 по дню
+выполняются пачкой с ограниченным параллелизмом RECONCILE_CONCURRENCY, так же — исправления.
+Каждое исправление перепроверяет элемент под блокировкой записи, поэтому повторный прогон
+(или гонка с поллером и вебхуками) ничего не портит. Обработанные дни пишутся в файл состояния:
+прерванный прогон продолжается со следующего дня, а дни с ошибками проверок или исправлений
+в нём проверяются снова. dry_run — проверки выполняются, исправления только попадают в отчёт.
+Прогон с исправлениями держит межпроцессную блокировку {state_path}.lock: пока идёт один (из
+админки любого воркера или из командной строки), другой не запускается.
+
+Запуск из командной строки (по умолчанию dry-run):
+	python -m app.services.reconcile_service --from 2026-09-01 --apply --out reconcile.json
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.models.schemas import ItemStatus, public_video_fields
+from app.utils.file_utils import JsonOrderStore, run_lock, run_lock_held, write_atomic
+
+
+logger = logging.getLogger("livephoto.reconcile")
+
+KINDS = ("fal_completed", "fal_lost", "fal_no_media", "presign", "reupload", "rehost", "s3_missing", "finalize")
+# Находки, которые только попадают в отчёт: исправить нечем
+_REPORT_ONLY = ("s3_missing",)
+
+_TERMINAL = (ItemStatus.SUCCEEDED.value, ItemStatus.FAILED.value)
+_IN_FLIGHT = (ItemStatus.PENDING.value, ItemStatus.RUNNING.value)
+
+
+@dataclass(slots=True)
+class Finding:
+	kind: str
+	day: str
+	order_id: str
+	item_index: Optional[int] = None
+	request_id: Optional[str] = None
+	media_url: Optional[str] = None
+	s3_url: Optional[str] = None
+
+
+@dataclass(slots=True)
+class _Check:
+	kind: str  # fal | s3
+	day: str
+	order_id: str
+	item_index: int
+	item: dict
+
+
+def _order_id(order: dict) -> str:
+	return order.get("order_id") or order.get("request_id") or ""
+
+
+def _s3_url(item: dict) -> Optional[str]:
+	for url in (item.get("result_s3_url"), item.get("video_url")):
+		if isinstance(url, str) and url.startswith("s3://"):
+			return url
+	return None
+
+
+def _not_found(exc: BaseException) -> bool:
+	"""404 от fal (requests) или S3 (botocore ClientError)."""
+	resp = getattr(exc, "response", None)
+	if isinstance(resp, dict):
+		return str((resp.get("Error") or {}).get("Code")) in ("404", "NoSuchKey", "NotFound")
+	return getattr(resp, "status_code", None) == 404
+
+
+class ReconcileJob:
+	"""Прогон сверки по дням хранилища; применение результатов — теми же функциями, что и у поллера.
+
+	complete_item(order_id, idx, media_url, spans, fal_request_id) -> (заявка, завершилась),
+	apply_results(order_id, patches, spans) -> (заявка, завершилась), notify(order) — письмо.
+	"""
+
+	def __init__(
+		self,
+		store: JsonOrderStore,
+		complete_item: Callable[..., Tuple[Optional[dict], bool]],
+		apply_results: Callable[..., Tuple[Optional[dict], bool]],
+		notify: Callable[[dict], None],
+		state_path: str,
+		concurrency: int = 16,
+		stale_seconds: float = 3600.0,
+	) -> None:
+		self.store = store
+		self.complete_item = complete_item
+		self.apply_results = apply_results
+		self.notify = notify
+		self.state_path = state_path
+		self.concurrency = max(1, concurrency)
+		self.stale_seconds = stale_seconds
+		self._lock = threading.Lock()
+		self._thread: Optional[threading.Thread] = None
+		self.last_report: Optional[Dict[str, Any]] = None
+
+	# --- состояние между прогонами ---
+
+	def _load_state(self) -> Dict[str, Any]:
+		try:
+			with open(self.state_path, "r", encoding="utf-8") as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return {}
+
+	def _save_state(self, state: Dict[str, Any]) -> None:
+		os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+		write_atomic(self.state_path, json.dumps(state, ensure_ascii=False).encode("utf-8"))
+
+	@property
+	def lock_path(self) -> str:
+		return self.state_path + ".lock"
+
+	# --- поиск ---
+
+	def scan_order(self, day: str, order: dict, now: datetime) -> Tuple[List[Finding], List[_Check]]:
+		"""Находки, видные по самой заявке, и проверки, для которых нужен fal или S3."""
+		findings: List[Finding] = []
+		checks: List[_Check] = []
+		order_id = _order_id(order)
+		gen = order.get("generation") or {}
+		items = gen.get("items") or []
+		stale_before = (now - timedelta(seconds=self.stale_seconds)).isoformat()
+		for idx, item in enumerate(items):
+			status = item.get("status")
+			if status in _IN_FLIGHT and item.get("request_id"):
+				if (item.get("submitted_at") or order.get("updated_at") or order.get("created_at") or "") <= stale_before:
+					checks.append(_Check("fal", day, order_id, idx, item))
+			elif status == ItemStatus.SUCCEEDED.value and not item.get("video_deleted_at"):
+				if _s3_url(item):
+					checks.append(_Check("s3", day, order_id, idx, item))
+				elif item.get("fal_response_url"):
+					findings.append(Finding("rehost", day, order_id, idx, item.get("request_id"), media_url=item["fal_response_url"]))
+		if items and gen.get("status") != "completed" and all(x.get("status") in _TERMINAL for x in items):
+			findings.append(Finding("finalize", day, order_id))
+		return findings, checks
+
+	def _run_check(self, check: _Check) -> Optional[Finding]:
+		item = check.item
+		base = dict(day=check.day, order_id=check.order_id, item_index=check.item_index, request_id=item.get("request_id"))
+		if check.kind == "fal":
+			from app.services.fal_service import extract_media_url, fetch_queue_json, get_request_response, get_request_status
+
+			try:
+				st = get_request_status(item["request_id"], logs=False, model_id=item.get("model_id"), endpoint=item.get("fal_endpoint"))
+			except Exception as e:
+				if _not_found(e):
+					return Finding("fal_lost", **base)
+				raise
+			if (st.get("status") or "").upper() != "COMPLETED":
+				return None
+			media_url = extract_media_url(get_request_response(item["request_id"], model_id=item.get("model_id"), endpoint=item.get("fal_endpoint")))
+			response_url = st.get("response_url")
+			if not media_url and isinstance(response_url, str) and response_url.startswith(f"{settings.fal_queue_base}/"):
+				media_url = extract_media_url(fetch_queue_json(response_url) or {})
+			return Finding("fal_completed", media_url=media_url, **base) if media_url else Finding("fal_no_media", **base)
+
+		from app.utils.s3_utils import head_object, parse_s3_url
+
+		s3_url = _s3_url(item)
+		try:
+			head_object(*parse_s3_url(s3_url))
+		except Exception as e:
+			if not _not_found(e):
+				raise
+			if item.get("fal_response_url"):
+				return Finding("reupload", media_url=item["fal_response_url"], s3_url=s3_url, **base)
+			return Finding("s3_missing", s3_url=s3_url, **base)
+		if not item.get("public_video_url"):
+			return Finding("presign", s3_url=s3_url, **base)
+		return None
+
+	# --- исправление ---
+
+	def _reset_for_rehost(self, finding: Finding) -> bool:
+		"""Возвращает succeeded-элемент без видео в S3 в running, чтобы перекладка выполнилась заново."""
+		claimed = False
+
+		def _mutate(order: dict) -> bool:
+			nonlocal claimed
+			items = (order.get("generation") or {}).get("items") or []
+			if finding.item_index >= len(items):
+				return False
+			item = items[finding.item_index]
+			# элемент уже переложили заново (или он изменился) — не трогаем
+			if item.get("status") != ItemStatus.SUCCEEDED.value or _s3_url(item) != finding.s3_url:
+				return False
+			item["status"] = ItemStatus.RUNNING.value
+			for key in ("result_s3_url", "video_url", "public_video_url", "expires_in", "public_url_created_at"):
+				item.pop(key, None)
+			claimed = True
+			return True
+
+		self.store.update(finding.order_id, _mutate)
+		return claimed
+
+	def fix(self, finding: Finding) -> bool:
+		"""Применяет исправление; False — исправлять уже нечего (сделал кто-то другой)."""
+		order: Optional[dict] = None
+		completed_now = False
+		idx = finding.item_index
+		if finding.kind in ("fal_completed", "rehost", "reupload"):
+			if finding.kind == "reupload" and not self._reset_for_rehost(finding):
+				return False
+			order, completed_now = self.complete_item(finding.order_id, idx, finding.media_url, [], finding.request_id)
+		elif finding.kind in ("fal_lost", "fal_no_media"):
+			error = "fal request not found" if finding.kind == "fal_lost" else "no media_url"
+			current = self.store.load(finding.order_id) or {}
+			items = (current.get("generation") or {}).get("items") or []
+			if idx >= len(items) or items[idx].get("request_id") != finding.request_id or items[idx].get("status") in _TERMINAL:
+				return False
+			order, completed_now = self.apply_results(finding.order_id, {idx: {"status": ItemStatus.FAILED.value, "error": error}})
+		elif finding.kind == "presign":
+			from app.utils.s3_utils import get_file_url_with_expiry, parse_s3_url
+
+			url, exp = get_file_url_with_expiry(*parse_s3_url(finding.s3_url))
+			order, completed_now = self.apply_results(finding.order_id, {idx: public_video_fields(url, exp)})
+		elif finding.kind == "finalize":
+			order, completed_now = self.apply_results(finding.order_id, {})
+		else:
+			return False
+		if order and completed_now:
+			self.notify(order)
+		return True
+
+	# --- прогон ---
+
+	def run(
+		self,
+		dry_run: bool = True,
+		date_from: Optional[str] = None,
+		date_to: Optional[str] = None,
+		include_archive: bool = False,
+		now: Optional[datetime] = None,
+	) -> Dict[str, Any]:
+		"""Один прогон по дням [date_from, date_to]. dry_run — только отчёт, без исправлений и состояния.
+
+		Прогон с исправлениями, пока другой (в любом процессе) идёт, не выполняется: отчёт со skipped.
+		"""
+		if dry_run:
+			return self._run(True, date_from, date_to, include_archive, now)
+		with run_lock(self.lock_path) as acquired:
+			if not acquired:
+				logger.info("reconcile: another run is in progress, skipped")
+				return {"dry_run": False, "skipped": "another run is in progress"}
+			return self._run(False, date_from, date_to, include_archive, now)
+
+	def _run(
+		self,
+		dry_run: bool,
+		date_from: Optional[str],
+		date_to: Optional[str],
+		include_archive: bool,
+		now: Optional[datetime],
+	) -> Dict[str, Any]:
+		now = now or datetime.utcnow()
+		state = self._load_state()
+		run_state = state.get("run") or {}
+		resumed = bool(run_state) and not dry_run
+		done_days = set(run_state.get("done_days") or []) if resumed else set()
+		if not dry_run and not run_state:
+			run_state = {"started_at": now.isoformat(), "done_days": []}
+			state["run"] = run_state
+			self._save_state(state)
+
+		report: Dict[str, Any] = {
+			"dry_run": dry_run,
+			"resumed": resumed,
+			"started_at": now.isoformat(),
+			"days_scanned": 0,
+			"days_skipped": len(done_days),
+			"days_failed": [],
+			"orders_scanned": 0,
+			"checks": {"fal": 0, "s3": 0},
+			"found": dict.fromkeys(KINDS, 0),
+			"fixed": dict.fromkeys(KINDS, 0),
+			"errors": [],
+			"sample": [],
+		}
+
+		def _guard(fn: Callable[[Any], Any]) -> Callable[[Any], Tuple[Any, Optional[str]]]:
+			def _call(arg: Any) -> Tuple[Any, Optional[str]]:
+				try:
+					return fn(arg), None
+				except Exception as e:
+					return None, str(e)
+			return _call
+
+		with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="reconcile") as pool:
+			for day, archived, day_orders in self.store.iter_days(include_archive=include_archive, skip=done_days, date_from=date_from, date_to=date_to):
+				report["days_scanned"] += 1
+				findings: List[Finding] = []
+				checks: List[_Check] = []
+				day_errors = 0
+				for order in day_orders:
+					report["orders_scanned"] += 1
+					order_findings, order_checks = self.scan_order(day, order, now)
+					findings.extend(order_findings)
+					checks.extend(order_checks)
+				for check, (finding, error) in zip(checks, pool.map(_guard(self._run_check), checks)):
+					report["checks"][check.kind] += 1
+					if error:
+						day_errors += 1
+						report["errors"].append({"order_id": check.order_id, "item_index": check.item_index, "check": check.kind, "error": error})
+					elif finding:
+						findings.append(finding)
+				# заявку с исправляемыми элементами завершит запись исправления (письмо — уже с новыми ссылками)
+				busy = {f.order_id for f in findings if f.kind != "finalize" and f.kind not in _REPORT_ONLY}
+				findings = [f for f in findings if not (f.kind == "finalize" and f.order_id in busy)]
+				for finding in findings:
+					report["found"][finding.kind] += 1
+					if len(report["sample"]) < 20:
+						report["sample"].append({"kind": finding.kind, "day": day, "order_id": finding.order_id, "item_index": finding.item_index})
+				if dry_run:
+					continue
+				fixable = [f for f in findings if f.kind not in _REPORT_ONLY]
+				for finding, (fixed, error) in zip(fixable, pool.map(_guard(self.fix), fixable)):
+					if error:
+						day_errors += 1
+						report["errors"].append({"order_id": finding.order_id, "item_index": finding.item_index, "fix": finding.kind, "error": error})
+					elif fixed:
+						report["fixed"][finding.kind] += 1
+				# день с ошибками (открытый breaker, 5xx S3) не закрываем: продолженный прогон проверит его снова
+				if day_errors:
+					report["days_failed"].append(day)
+				else:
+					run_state["done_days"].append(day)
+				self._save_state(state)
+				del report["errors"][200:]
+
+		report["finished_at"] = datetime.utcnow().isoformat()
+		if not dry_run:
+			state.pop("run", None)
+			state["last_report"] = {k: v for k, v in report.items() if k != "sample"}
+			self._save_state(state)
+		self.last_report = report
+		logger.info(
+			"reconcile: dry_run=%s days=%d orders=%d found=%d fixed=%d errors=%d",
+			dry_run, report["days_scanned"], report["orders_scanned"],
+			sum(report["found"].values()), sum(report["fixed"].values()), len(report["errors"]),
+		)
+		return report
+
+	# --- фоновый запуск ---
+
+	@property
+	def running(self) -> bool:
+		return self._thread is not None and self._thread.is_alive()
+
+	def start(self, **kwargs: Any) -> bool:
+		"""Запускает прогон (аргументы run) в фоновом потоке; False — если он уже идёт (в любом процессе)."""
+		with self._lock:
+			if self.running or (not kwargs.get("dry_run", True) and run_lock_held(self.lock_path)):
+				return False
+			self._thread = threading.Thread(target=self._run_safe, kwargs=kwargs, name="reconcile", daemon=True)
+			self._thread.start()
+			return True
+
+	def _run_safe(self, **kwargs: Any) -> None:
+		try:
+			self.run(**kwargs)
+		except Exception:
+			logger.exception("reconcile: run failed")
+
+	def status(self) -> Dict[str, Any]:
+		state = self._load_state()
+		running = self.running or run_lock_held(self.lock_path)
+		return {
+			"running": running,
+			"interrupted_run": state.get("run") if not running else None,
+			"last_report": self.last_report or state.get("last_report"),
+		}
+
+
+def reconcile_job(
+	store: JsonOrderStore,
+	complete_item: Callable[..., Tuple[Optional[dict], bool]],
+	apply_results: Callable[..., Tuple[Optional[dict], bool]],
+	notify: Callable[[dict], None],
+) -> ReconcileJob:
+	return ReconcileJob(
+		store,
+		complete_item=complete_item,
+		apply_results=apply_results,
+		notify=notify,
+		state_path=settings.reconcile_state_path,
+		concurrency=settings.reconcile_concurrency,
+		stale_seconds=settings.reconcile_stale_seconds,
+	)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--apply", action="store_true", help="исправлять (без флага — только отчёт)")
+	parser.add_argument("--from", dest="date_from", help="первый день, YYYY-MM-DD")
+	parser.add_argument("--to", dest="date_to", help="последний день, YYYY-MM-DD")
+	parser.add_argument("--archive", action="store_true", help="включая архивные дни")
+	parser.add_argument("--concurrency", type=int, help="параллельные запросы к fal/S3 (по умолчанию RECONCILE_CONCURRENCY)")
+	parser.add_argument("--restart", action="store_true", help="начать заново, забыв прерванный прогон")
+	parser.add_argument("--out", help="куда записать JSON с отчётом")
+	args = parser.parse_args(argv)
+	logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
+
+	# те же хранилище и функции применения результатов, что у приложения
+	from app.main import _reconcile
+
+	reconcile = _reconcile()
+
+	if args.concurrency:
+		reconcile.concurrency = max(1, args.concurrency)
+	if args.restart:
+		with run_lock(reconcile.lock_path) as acquired:
+			if not acquired:
+				raise SystemExit("reconcile: another run is in progress")
+			state = reconcile._load_state()
+			state.pop("run", None)
+			reconcile._save_state(state)
+	report = reconcile.run(dry_run=not args.apply, date_from=args.date_from, date_to=args.date_to, include_archive=args.archive)
+	if report.get("skipped"):
+		raise SystemExit(f"reconcile: {report['skipped']}")
+	text = json.dumps(report, ensure_ascii=False, indent=2)
+	if args.out:
+		with open(args.out, "w", encoding="utf-8") as f:
+			f.write(text)
+	print(text)
+
+
+if __name__ == "__main__":
+	main()
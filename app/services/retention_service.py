@@ -0,0 +1,340 @@
+"""Хранение и сборка мусора: входные изображения, видео в S3 и неоплаченные заявки.
+
+Политики (дни; 0 — политика выключена):
+- RETENTION_INPUTS_DAYS — удалить uploads/{anon}/{order}/ через N дней после завершения генерации;
+- RETENTION_VIDEOS_DAYS — удалить видео через N дней после истечения последней выданной ссылки;
+- RETENTION_UNPAID_DAYS — удалить неоплаченную заявку (waiting_payment) и её входные файлы.
+
+Удаление идёт пачками delete_objects. Выполненное помечается в заявке (retention.inputs_deleted_at,
+item.video_deleted_at), поэтому повторный запуск не трогает уже очищенное. Прогресс прогона
+(обработанные дни) пишется в файл состояния: прерванный прогон продолжается с места остановки,
+а дни, где чистить больше нечего, пропускаются и в следующих прогонах.
+
+Прогон с удалением держит межпроцессную блокировку {state_path}.lock: воркеры uvicorn запускают
+ежедневный прогон одновременно, выполняет его только первый, остальные пропускают.
+"""
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.utils.file_utils import JsonOrderStore, run_lock, run_lock_held, write_atomic
+
+
+logger = logging.getLogger("livephoto.retention")
+
+
+@dataclass(slots=True)
+class RetentionAction:
+	kind: str  # inputs | videos | unpaid
+	day: str
+	order_id: str
+	archived: bool
+	keys: List[Tuple[str, str]] = field(default_factory=list)  # (bucket, key)
+	bytes: int = 0
+	item_indexes: List[int] = field(default_factory=list)
+
+
+def _parse_dt(value: Any) -> Optional[datetime]:
+	if not value:
+		return None
+	try:
+		dt = datetime.fromisoformat(str(value))
+	except ValueError:
+		return None
+	if dt.tzinfo is not None:
+		dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+	return dt
+
+
+def _order_id(order: dict) -> str:
+	return order.get("order_id") or order.get("request_id") or ""
+
+
+class RetentionJob:
+	"""Планирование и выполнение политик хранения по всем дням хранилища (включая архив)."""
+
+	def __init__(
+		self,
+		store: JsonOrderStore,
+		state_path: str,
+		inputs_days: int = 14,
+		videos_days: int = 7,
+		unpaid_days: int = 3,
+	) -> None:
+		self.store = store
+		self.state_path = state_path
+		self.inputs_days = inputs_days
+		self.videos_days = videos_days
+		self.unpaid_days = unpaid_days
+		self._lock = threading.Lock()
+		self._thread: Optional[threading.Thread] = None
+		self.last_report: Optional[Dict[str, Any]] = None
+
+	# --- состояние между прогонами ---
+
+	def _load_state(self) -> Dict[str, Any]:
+		try:
+			with open(self.state_path, "r", encoding="utf-8") as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return {}
+
+	def _save_state(self, state: Dict[str, Any]) -> None:
+		os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+		write_atomic(self.state_path, json.dumps(state, ensure_ascii=False).encode("utf-8"))
+
+	@property
+	def lock_path(self) -> str:
+		return self.state_path + ".lock"
+
+	# --- планирование ---
+
+	@staticmethod
+	def _is_unpaid(order: dict) -> bool:
+		gen_status = (order.get("generation") or {}).get("status")
+		return gen_status == "waiting_payment" and (order.get("payment") or {}).get("status") != "paid"
+
+	@staticmethod
+	def _completed_at(order: dict) -> Optional[datetime]:
+		gen = order.get("generation") or {}
+		if gen.get("status") != "completed":
+			return None
+		return _parse_dt(gen.get("completed_at")) or _parse_dt(order.get("updated_at")) or _parse_dt(order.get("created_at"))
+
+	def _video_expires_at(self, order: dict, item: dict) -> Optional[datetime]:
+		created = _parse_dt(item.get("public_url_created_at")) or self._completed_at(order)
+		if created is None:
+			return None
+		ttl = int(item.get("expires_in") or settings.s3_presign_ttl_seconds)
+		return created + timedelta(seconds=ttl)
+
+	@staticmethod
+	def _video_keys(item: dict) -> List[Tuple[str, str]]:
+		from app.utils.s3_utils import parse_s3_url
+
+		for url in (item.get("result_s3_url"), item.get("video_url")):
+			if isinstance(url, str) and url.startswith("s3://"):
+				try:
+					return [parse_s3_url(url)]
+				except ValueError:
+					return []
+		return []
+
+	@staticmethod
+	def _input_keys(order: dict) -> List[Tuple[str, str, int]]:
+		from app.utils.s3_utils import list_keys
+
+		bucket = settings.s3_bucket_name or ""
+		prefix = f"{settings.uploads_prefix}{order.get('anonUserId') or 'user'}/{_order_id(order)}/"
+		return [(bucket, key, size) for key, size in list_keys(bucket, prefix)]
+
+	def plan_order(self, day: str, archived: bool, order: dict, now: datetime) -> Tuple[List[RetentionAction], bool]:
+		"""Действия по заявке на момент now и признак, что в будущем по ней ещё может что-то понадобиться."""
+		actions: List[RetentionAction] = []
+		future = False
+		order_id = _order_id(order)
+		created = _parse_dt(order.get("created_at"))
+
+		if self._is_unpaid(order):
+			if not self.unpaid_days:
+				return actions, False
+			if created and now - created >= timedelta(days=self.unpaid_days):
+				inputs = self._input_keys(order)
+				actions.append(RetentionAction("unpaid", day, order_id, archived, [(b, k) for b, k, _ in inputs], sum(s for _, _, s in inputs)))
+				return actions, False
+			return actions, True
+
+		completed_at = self._completed_at(order)
+		if completed_at is None:
+			# генерация ещё идёт (или заявка оплачена, но не запущена) — вернёмся позже
+			return actions, bool(self.inputs_days or self.videos_days)
+
+		if self.inputs_days and not (order.get("retention") or {}).get("inputs_deleted_at"):
+			if now - completed_at >= timedelta(days=self.inputs_days):
+				inputs = self._input_keys(order)
+				actions.append(RetentionAction("inputs", day, order_id, archived, [(b, k) for b, k, _ in inputs], sum(s for _, _, s in inputs)))
+			else:
+				future = True
+
+		if self.videos_days:
+			videos = RetentionAction("videos", day, order_id, archived)
+			for idx, item in enumerate((order.get("generation") or {}).get("items") or []):
+				keys = self._video_keys(item)
+				if not keys or item.get("video_deleted_at"):
+					continue
+				expires_at = self._video_expires_at(order, item)
+				if expires_at and now - expires_at >= timedelta(days=self.videos_days):
+					videos.keys.extend(keys)
+					videos.item_indexes.append(idx)
+				else:
+					future = True
+			if videos.keys:
+				actions.append(videos)
+		return actions, future
+
+	# --- выполнение ---
+
+	def _apply(self, action: RetentionAction) -> Tuple[int, List[dict]]:
+		from app.utils.s3_utils import delete_keys
+
+		deleted = 0
+		errors: List[dict] = []
+		by_bucket: Dict[str, List[str]] = {}
+		for bucket, key in action.keys:
+			by_bucket.setdefault(bucket, []).append(key)
+		for bucket, keys in by_bucket.items():
+			ok, errs = delete_keys(bucket, keys)
+			deleted += len(ok)
+			errors.extend(errs)
+		if errors:
+			return deleted, errors
+
+		stamp = datetime.utcnow().isoformat()
+		if action.kind == "unpaid":
+			self.store.delete(action.order_id)
+		elif not action.archived:
+			# Архивные дни не помечаем (это вернуло бы их в горячий уровень) — их закрывает файл состояния
+			def _mark(order: dict) -> None:
+				if action.kind == "inputs":
+					order.setdefault("retention", {})["inputs_deleted_at"] = stamp
+				else:
+					items = (order.get("generation") or {}).get("items") or []
+					for idx in action.item_indexes:
+						if idx < len(items):
+							items[idx]["video_deleted_at"] = stamp
+
+			self.store.update(action.order_id, _mark)
+		return deleted, errors
+
+	def run(self, dry_run: bool = True, now: Optional[datetime] = None) -> Dict[str, Any]:
+		"""Один прогон по всем дням. dry_run — только отчёт, без удаления и без изменения состояния.
+
+		Прогон с удалением, пока другой (в любом процессе) идёт, не выполняется: отчёт со skipped.
+		"""
+		if dry_run:
+			return self._run(True, now)
+		with run_lock(self.lock_path) as acquired:
+			if not acquired:
+				logger.info("retention: another run is in progress, skipped")
+				return {"dry_run": False, "skipped": "another run is in progress"}
+			return self._run(False, now)
+
+	def _run(self, dry_run: bool, now: Optional[datetime]) -> Dict[str, Any]:
+		now = now or datetime.utcnow()
+		state = self._load_state()
+		closed_days = set(state.get("closed_days") or [])
+		run_state = state.get("run") or {}
+		resumed = bool(run_state) and not dry_run
+		done_days = set(run_state.get("done_days") or []) if resumed else set()
+		if not dry_run and not run_state:
+			run_state = {"started_at": now.isoformat(), "done_days": []}
+			state["run"] = run_state
+			self._save_state(state)
+
+		report: Dict[str, Any] = {
+			"dry_run": dry_run,
+			"resumed": resumed,
+			"started_at": now.isoformat(),
+			"days_scanned": 0,
+			"days_skipped": 0,
+			"actions": {kind: {"orders": 0, "objects": 0, "bytes": 0} for kind in ("inputs", "videos", "unpaid")},
+			"deleted_objects": 0,
+			"errors": [],
+			"sample": [],
+		}
+		skip = closed_days | done_days
+		report["days_skipped"] = len(skip)
+		for day, archived, day_orders in self.store.iter_days(skip=skip):
+			report["days_scanned"] += 1
+			day_future = False
+			day_failed = False
+			for order in day_orders:
+				try:
+					actions, future = self.plan_order(day, archived, order, now)
+				except Exception as e:
+					report["errors"].append({"order_id": _order_id(order), "error": str(e)})
+					day_failed = True
+					continue
+				day_future = day_future or future
+				for action in actions:
+					stats = report["actions"][action.kind]
+					stats["orders"] += 1
+					stats["objects"] += len(action.keys)
+					stats["bytes"] += action.bytes
+					if len(report["sample"]) < 20:
+						report["sample"].append({"kind": action.kind, "order_id": action.order_id, "day": day, "keys": [k for _, k in action.keys[:5]]})
+					if dry_run:
+						continue
+					try:
+						deleted, errors = self._apply(action)
+					except Exception as e:
+						deleted, errors = 0, [{"order_id": action.order_id, "error": str(e)}]
+					report["deleted_objects"] += deleted
+					if errors:
+						day_failed = True
+						report["errors"].extend(errors[:20])
+			if dry_run:
+				continue
+			run_state["done_days"].append(day)
+			if not day_future and not day_failed:
+				closed_days.add(day)
+			state["closed_days"] = sorted(closed_days)
+			self._save_state(state)
+
+		report["finished_at"] = datetime.utcnow().isoformat()
+		if not dry_run:
+			state.pop("run", None)
+			state["last_report"] = {k: v for k, v in report.items() if k != "sample"}
+			self._save_state(state)
+		self.last_report = report
+		logger.info(
+			"retention: dry_run=%s days=%d deleted=%d errors=%d",
+			dry_run, report["days_scanned"], report["deleted_objects"], len(report["errors"]),
+		)
+		return report
+
+	# --- фоновый запуск ---
+
+	@property
+	def running(self) -> bool:
+		return self._thread is not None and self._thread.is_alive()
+
+	def start(self) -> bool:
+		"""Запускает прогон с удалением в фоновом потоке; False — если он уже идёт (в любом процессе)."""
+		with self._lock:
+			if self.running or run_lock_held(self.lock_path):
+				return False
+			self._thread = threading.Thread(target=self._run_safe, name="retention", daemon=True)
+			self._thread.start()
+			return True
+
+	def _run_safe(self) -> None:
+		try:
+			self.run(dry_run=False)
+		except Exception:
+			logger.exception("retention: run failed")
+
+	def status(self) -> Dict[str, Any]:
+		state = self._load_state()
+		running = self.running or run_lock_held(self.lock_path)
+		return {
+			"running": running,
+			"interrupted_run": state.get("run") if not running else None,
+			"closed_days": len(state.get("closed_days") or []),
+			"last_report": self.last_report or state.get("last_report"),
+		}
+
+
+def retention_job(store: JsonOrderStore) -> RetentionJob:
+	return RetentionJob(
+		store,
+		state_path=settings.retention_state_path,
+		inputs_days=settings.retention_inputs_days,
+		videos_days=settings.retention_videos_days,
+		unpaid_days=settings.retention_unpaid_days,
+	)
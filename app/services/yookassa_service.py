@@ -1,23 +1,101 @@
 import base64
-import requests
-from typing import Any, Dict
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
 import uuid
 
 from app.config import settings
+from app.utils.resilience import CircuitOpenError, guarded, is_transient, remaining, timeout_for
+
+
+logger = logging.getLogger("livephoto.yookassa")
+
+_client_lock = threading.Lock()
+_http_session = None
+_auth_value: Optional[str] = None
+
+# Пространство имён для ключей идемпотентности: один и тот же заказ -> один и тот же ключ
+_IDEMPOTENCE_NS = uuid.UUID("5d0f4f0e-3b8a-4a55-9a8e-7c1c2f6b9a31")
 
 
 def _auth_header() -> str:
-	if not settings.yookassa_shop_id or not settings.yookassa_api_key:
-		raise RuntimeError("YooKassa credentials not configured")
-	basic = f"{settings.yookassa_shop_id}:{settings.yookassa_api_key}".encode()
-	return "Basic " + base64.b64encode(basic).decode()
+	global _auth_value
+	if _auth_value is None:
+		if not settings.yookassa_shop_id or not settings.yookassa_api_key:
+			raise RuntimeError("YooKassa credentials not configured")
+		basic = f"{settings.yookassa_shop_id}:{settings.yookassa_api_key}".encode()
+		_auth_value = "Basic " + base64.b64encode(basic).decode()
+	return _auth_value
+
+
+def _http():
+	"""Общая requests.Session с пулом keep-alive соединений к api.yookassa.ru, создаётся лениво."""
+	global _http_session
+	if _http_session is None:
+		with _client_lock:
+			if _http_session is None:
+				import requests
+				from requests.adapters import HTTPAdapter
+
+				session = requests.Session()
+				adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, settings.yookassa_pool_size))
+				session.mount("https://", adapter)
+				session.mount("http://", adapter)
+				_http_session = session
+	return _http_session
+
+
+def idempotence_key(order_id: str, operation: str = "create_payment") -> str:
+	"""Детерминированный Idempotence-Key: повтор запроса по тому же заказу не создаст второй платёж."""
+	return str(uuid.uuid5(_IDEMPOTENCE_NS, f"{operation}:{order_id}"))
+
+
+def _retry_delay(attempt: int, resp: Any = None) -> float:
+	retry_after = getattr(resp, "headers", {}).get("Retry-After") if resp is not None else None
+	try:
+		delay = float(retry_after) if retry_after else 0.5 * 2 ** attempt
+	except ValueError:
+		delay = 0.5 * 2 ** attempt
+	return min(delay, 5.0)
+
+
+def _request(method: str, path: str, operation: str, idempotence: Optional[str] = None, **kwargs: Any):
+	"""Запрос к API YooKassa с ограниченными повторами при сетевых сбоях, 5xx и 429.
+
+	Повтор безопасен: POST уходит с тем же Idempotence-Key, GET идемпотентен сам по себе.
+	Ответы 4xx возвращаются вызывающей стороне без повторов.
+	"""
+	url = f"{settings.yookassa_api_base}{path}"
+	headers = {"Authorization": _auth_header(), "Content-Type": "application/json"}
+	if idempotence:
+		headers["Idempotence-Key"] = idempotence
+	attempts = 1 + max(0, settings.yookassa_max_retries)
+	for attempt in range(attempts):
+		resp = None
+		try:
+			with guarded("yookassa", operation):
+				resp = _http().request(method, url, headers=headers, timeout=timeout_for(20), **kwargs)
+				if resp.status_code >= 500 or resp.status_code == 429:
+					# ошибка на стороне YooKassa — считаем сбоем зависимости для circuit breaker
+					resp.raise_for_status()
+			return resp
+		except CircuitOpenError:
+			raise
+		except Exception as e:
+			delay = _retry_delay(attempt, resp)
+			left = remaining()
+			if attempt + 1 >= attempts or not is_transient(e) or (left is not None and left <= delay):
+				raise
+			logger.warning("yookassa: %s attempt %d failed (%s), retry in %.1fs", operation, attempt + 1, e, delay)
+			time.sleep(delay)
+	raise AssertionError("unreachable")
 
 
 def create_payment(order_id: str, amount_rub: float, description: str, return_url: str, email: str | None = None, anon_user_id: str | None = None) -> Dict[str, Any]:
 	"""Создать платеж и получить confirmation_url.
 	Документация YooKassa: POST /v3/payments
 	"""
-	url = f"{settings.yookassa_api_base}/v3/payments"
 	payload = {
 		"amount": {"value": f"{amount_rub:.2f}", "currency": "RUB"},
 		"capture": True,
@@ -41,13 +119,7 @@ def create_payment(order_id: str, amount_rub: float, description: str, return_ur
 				}
 			]
 		}
-	headers = {
-		"Authorization": _auth_header(),
-		# уникальный ключ на каждый запрос (а не order_id)
-		"Idempotence-Key": str(uuid.uuid4()),
-		"Content-Type": "application/json",
-	}
-	resp = requests.post(url, json=payload, headers=headers, timeout=20)
+	resp = _request("POST", "/v3/payments", "create_payment", idempotence=idempotence_key(order_id), json=payload)
 	if not resp.ok:
 		# вернём подробности ошибки вызывающей стороне
 		try:
@@ -62,3 +134,15 @@ def create_payment(order_id: str, amount_rub: float, description: str, return_ur
 	return {"payment_id": payment_id, "payment_url": confirmation_url, "raw": data}
 
 
+def get_payment(payment_id: str) -> Dict[str, Any]:
+	"""Текущее состояние платежа: GET /v3/payments/{id} -> {payment_id, status, paid, metadata, raw}."""
+	resp = _request("GET", f"/v3/payments/{payment_id}", "get_payment")
+	resp.raise_for_status()
+	data = resp.json()
+	return {
+		"payment_id": data.get("id"),
+		"status": data.get("status"),
+		"paid": bool(data.get("paid")),
+		"metadata": data.get("metadata") or {},
+		"raw": data,
+	}
@@ -0,0 +1,215 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from app.utils.executors import run
+from app.utils.metrics import ADMISSION_DECISIONS, ADMISSION_QUEUE
+from app.utils.sqlite_utils import ThreadLocalSqlite
+
+
+class AdmissionRejected(Exception):
+	"""Запрос не принят: status 429 (лимит клиента) или 503 (перегрузка), retry_after в секундах."""
+
+	def __init__(self, status: int, reason: str, retry_after: float) -> None:
+		super().__init__(reason)
+		self.status = status
+		self.reason = reason
+		self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class TokenBuckets:
+	"""Token bucket по ключу; состояние в sqlite, общее для воркеров uvicorn на одной машине.
+
+	path=None — состояние только в памяти процесса. Время — time.time(), одно для всех процессов.
+	Ёмкость burst, пополнение rate токенов в секунду; take() атомарен (BEGIN IMMEDIATE).
+	"""
+
+	# Ключи, не пополнявшиеся дольше этого, удаляются при периодической чистке (корзина давно полна)
+	_STALE_SECONDS = 3600.0
+	_VACUUM_EVERY = 1000
+
+	def __init__(self, path: Optional[str] = None) -> None:
+		self.path = path
+		self._db = ThreadLocalSqlite(path, (
+			"CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)",
+		), timeout=5.0) if path else None
+		self._mem: Dict[str, Tuple[float, float]] = {}
+		self._mem_lock = threading.Lock()
+		self._calls = 0
+
+	@staticmethod
+	def _refill(state: Optional[Tuple[float, float]], rate: float, burst: float, now: float) -> float:
+		if state is None:
+			return burst
+		tokens, updated = state
+		return min(burst, tokens + max(0.0, now - updated) * rate)
+
+	def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> Tuple[bool, float]:
+		"""(разрешено, через сколько секунд накопится cost токенов, если нет)."""
+		now = time.time()
+		if not self.path:
+			with self._mem_lock:
+				tokens = self._refill(self._mem.get(key), rate, burst, now)
+				allowed = tokens >= cost
+				self._mem[key] = (tokens - cost if allowed else tokens, now)
+		else:
+			conn = self._db.conn()
+			conn.execute("BEGIN IMMEDIATE")
+			try:
+				row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+				tokens = self._refill(row, rate, burst, now)
+				allowed = tokens >= cost
+				conn.execute(
+					"INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+					(key, tokens - cost if allowed else tokens, now),
+				)
+				conn.execute("COMMIT")
+			except BaseException:
+				conn.execute("ROLLBACK")
+				raise
+			self._calls += 1
+			if self._calls % self._VACUUM_EVERY == 0:
+				conn.execute("DELETE FROM buckets WHERE updated < ?", (now - self._STALE_SECONDS,))
+		if allowed:
+			return True, 0.0
+		return False, (cost - tokens) / rate if rate > 0 else self._STALE_SECONDS
+
+	def refund(self, key: str, burst: float, cost: float = 1.0) -> None:
+		"""Возвращает cost токенов, взятых take() (не больше burst): запрос так и не был выполнен."""
+		if not self.path:
+			with self._mem_lock:
+				state = self._mem.get(key)
+				if state is not None:
+					self._mem[key] = (min(burst, state[0] + cost), state[1])
+			return
+		conn = self._db.conn()
+		conn.execute("BEGIN IMMEDIATE")
+		try:
+			conn.execute("UPDATE buckets SET tokens = MIN(?, tokens + ?) WHERE key = ?", (burst, cost, key))
+			conn.execute("COMMIT")
+		except BaseException:
+			conn.execute("ROLLBACK")
+			raise
+
+
+class AdmissionController:
+	"""Допуск к дорогим маршрутам: лимиты на клиента, общий предел параллельности и очереди.
+
+	1) token bucket на anonUserId и на IP (429 + Retry-After при исчерпании);
+	2) не больше max_concurrency дорогих запросов одновременно в процессе — остальные ждут в
+	   очереди до queue_timeout секунд; если очередь уже max_queue — сразу 503 + Retry-After.
+
+	Токены, взятые запросом, который затем отклонён (429 по другому ключу или 503 по перегрузке),
+	возвращаются в корзины: повтор клиента после 503 не упирается ещё и в 429.
+	"""
+
+	def __init__(
+		self,
+		buckets: TokenBuckets,
+		user_rate_per_minute: float,
+		user_burst: float,
+		ip_rate_per_minute: float,
+		ip_burst: float,
+		max_concurrency: int,
+		max_queue: int,
+		queue_timeout: float,
+	) -> None:
+		self.buckets = buckets
+		self.user_limit = (user_rate_per_minute / 60.0, user_burst)
+		self.ip_limit = (ip_rate_per_minute / 60.0, ip_burst)
+		self.max_concurrency = max(1, max_concurrency)
+		self.max_queue = max(0, max_queue)
+		self.queue_timeout = queue_timeout
+		self._active = 0
+		self._waiting = 0
+		self._cond: Optional[asyncio.Condition] = None
+
+	def _check_rate(self, route: str, anon_user_id: Optional[str], client_ip: Optional[str]) -> List[Tuple[str, float]]:
+		"""Берёт по токену из корзин клиента; возвращает [(ключ, burst)] взятого для refund."""
+		checks = []
+		if anon_user_id and self.user_limit[0] > 0:
+			checks.append(("user", f"user:{anon_user_id}", self.user_limit))
+		if client_ip and self.ip_limit[0] > 0:
+			checks.append(("ip", f"ip:{client_ip}", self.ip_limit))
+		taken: List[Tuple[str, float]] = []
+		for kind, key, (rate, burst) in checks:
+			allowed, retry_after = self.buckets.take(key, rate, burst)
+			if not allowed:
+				self._refund(taken)
+				ADMISSION_DECISIONS.labels(route, f"rate_limited_{kind}").inc()
+				raise AdmissionRejected(429, f"rate limit exceeded ({kind})", retry_after)
+			taken.append((key, burst))
+		return taken
+
+	def _refund(self, taken: List[Tuple[str, float]]) -> None:
+		for key, burst in taken:
+			self.buckets.refund(key, burst)
+
+	async def _acquire(self, route: str) -> None:
+		if self._cond is None:
+			self._cond = asyncio.Condition()
+		async with self._cond:
+			if self._active < self.max_concurrency:
+				self._active += 1
+				return
+			if self._waiting >= self.max_queue:
+				ADMISSION_DECISIONS.labels(route, "shed_queue_full").inc()
+				raise AdmissionRejected(503, "server busy", self.queue_timeout)
+			self._waiting += 1
+			ADMISSION_QUEUE.inc()
+			try:
+				await asyncio.wait_for(self._cond.wait_for(lambda: self._active < self.max_concurrency), self.queue_timeout)
+			except asyncio.TimeoutError:
+				ADMISSION_DECISIONS.labels(route, "shed_queue_timeout").inc()
+				raise AdmissionRejected(503, "server busy", self.queue_timeout)
+			finally:
+				self._waiting -= 1
+				ADMISSION_QUEUE.dec()
+			self._active += 1
+
+	async def _release(self) -> None:
+		async with self._cond:
+			self._active -= 1
+			self._cond.notify()
+
+	@asynccontextmanager
+	async def admit(self, route: str, anon_user_id: Optional[str] = None, client_ip: Optional[str] = None) -> AsyncIterator[None]:
+		"""Держит слот дорогого маршрута на время блока; бросает AdmissionRejected."""
+		if self.buckets.path:
+			# sqlite — файловый ввод-вывод, не в event loop
+			taken = await run("store", self._check_rate, route, anon_user_id, client_ip)
+		else:
+			taken = self._check_rate(route, anon_user_id, client_ip)
+		try:
+			await self._acquire(route)
+		except AdmissionRejected:
+			if self.buckets.path:
+				await run("store", self._refund, taken)
+			else:
+				self._refund(taken)
+			raise
+		ADMISSION_DECISIONS.labels(route, "admitted").inc()
+		try:
+			yield
+		finally:
+			await self._release()
+
+	def stats(self) -> Dict[str, int]:
+		return {"active": self._active, "waiting": self._waiting, "max_concurrency": self.max_concurrency, "max_queue": self.max_queue}
+
+
+def admission_controller() -> AdmissionController:
+	from app.config import settings
+
+	return AdmissionController(
+		TokenBuckets(settings.admission_db_path or None),
+		user_rate_per_minute=settings.admission_user_rate_per_minute,
+		user_burst=settings.admission_user_burst,
+		ip_rate_per_minute=settings.admission_ip_rate_per_minute,
+		ip_burst=settings.admission_ip_burst,
+		max_concurrency=settings.admission_max_concurrency,
+		max_queue=settings.admission_max_queue,
+		queue_timeout=settings.admission_queue_timeout_seconds,
+	)
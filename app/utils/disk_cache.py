@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+
+class DiskLRUCache:
+	"""Кэш файлов на диске с ограничением по суммарному размеру и вытеснением LRU.
+
+	Запись по ключу — пара файлов {sha256(key)}.bin + {sha256(key)}.json (метаданные).
+	Заполнение атомарное: данные пишутся во временный файл и переименовываются, поэтому
+	читатель видит либо полный файл, либо промах. Порядок использования держим в памяти
+	(при старте — по mtime файлов) и дублируем в mtime, чтобы его видели соседние процессы.
+	Уже открытый читателем файл вытеснение не ломает: на POSIX данные живут до закрытия.
+	"""
+
+	def __init__(self, directory: str, max_bytes: int) -> None:
+		self.directory = directory
+		self.max_bytes = max(0, int(max_bytes))
+		self._lock = threading.Lock()
+		# имя файла данных -> размер; от давно использованных к недавним
+		self._entries: "OrderedDict[str, int]" = OrderedDict()
+		self._total = 0
+		self._loaded = False
+
+	@staticmethod
+	def _name(key: str) -> str:
+		return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+	def _paths(self, key: str) -> Tuple[str, str]:
+		name = self._name(key)
+		return os.path.join(self.directory, name + ".bin"), os.path.join(self.directory, name + ".json")
+
+	def _load(self) -> None:
+		"""Индекс по содержимому директории (один раз на процесс)."""
+		if self._loaded:
+			return
+		os.makedirs(self.directory, exist_ok=True)
+		found = []
+		for entry in os.scandir(self.directory):
+			if entry.name.endswith(".bin") and entry.is_file():
+				st = entry.stat()
+				found.append((st.st_mtime, entry.name, st.st_size))
+		for _, name, size in sorted(found):
+			self._entries[name] = size
+			self._total += size
+		self._loaded = True
+
+	def get(self, key: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+		"""(путь к данным, метаданные) или None; попадание отмечает запись как недавнюю."""
+		data_path, meta_path = self._paths(key)
+		try:
+			with open(meta_path, "r", encoding="utf-8") as f:
+				meta = json.load(f)
+			size = os.path.getsize(data_path)
+		except (OSError, ValueError):
+			return None
+		if meta.get("size") is not None and int(meta["size"]) != size:
+			return None
+		with self._lock:
+			self._load()
+			name = os.path.basename(data_path)
+			if name not in self._entries:
+				self._total += size
+				self._entries[name] = size
+			self._entries.move_to_end(name)
+		try:
+			os.utime(data_path)
+		except OSError:
+			pass
+		return data_path, meta
+
+	def open_fill(self, key: str, meta: Optional[Dict[str, Any]] = None, max_size: Optional[int] = None) -> "CacheFill":
+		"""Начинает заполнение записи: write() кусками, затем commit() (или abort())."""
+		with self._lock:
+			self._load()
+		limit = self.max_bytes if max_size is None else min(max_size, self.max_bytes)
+		return CacheFill(self, key, meta or {}, limit)
+
+	def put_chunks(self, key: str, chunks: Iterable[bytes], meta: Optional[Dict[str, Any]] = None, max_size: Optional[int] = None) -> Optional[str]:
+		"""Заполняет запись из потока кусков. None — если данные больше max_size (запись не создаётся)."""
+		fill = self.open_fill(key, meta, max_size)
+		try:
+			for chunk in chunks:
+				if not fill.write(chunk):
+					return None
+		except BaseException:
+			fill.abort()
+			raise
+		return fill.commit()
+
+	def _commit(self, key: str, tmp_path: str, size: int, meta: Dict[str, Any]) -> str:
+		data_path, meta_path = self._paths(key)
+		meta = dict(meta, key=key, size=size)
+		meta_fd, meta_tmp = tempfile.mkstemp(dir=self.directory, prefix=".fill-")
+		with os.fdopen(meta_fd, "w", encoding="utf-8") as f:
+			json.dump(meta, f)
+		# сначала данные, потом метаданные: get() без метаданных считает запись отсутствующей
+		os.replace(tmp_path, data_path)
+		os.replace(meta_tmp, meta_path)
+		with self._lock:
+			name = os.path.basename(data_path)
+			self._total -= self._entries.pop(name, 0)
+			self._entries[name] = size
+			self._total += size
+			self._evict()
+		return data_path
+
+	def put_bytes(self, key: str, data: bytes, meta: Optional[Dict[str, Any]] = None) -> Optional[str]:
+		return self.put_chunks(key, (data,), meta)
+
+	def _evict(self) -> None:
+		while self._total > self.max_bytes and self._entries:
+			name, size = self._entries.popitem(last=False)
+			self._total -= size
+			base = os.path.join(self.directory, name[:-4])
+			for path in (base + ".json", base + ".bin"):
+				try:
+					os.remove(path)
+				except OSError:
+					pass
+
+	def stats(self) -> Dict[str, int]:
+		with self._lock:
+			self._load()
+			return {"entries": len(self._entries), "bytes": self._total, "max_bytes": self.max_bytes}
+
+
+class CacheFill:
+	"""Незавершённая запись кэша во временном файле; при превышении лимита молча отказывается."""
+
+	def __init__(self, cache: DiskLRUCache, key: str, meta: Dict[str, Any], limit: int) -> None:
+		self.cache = cache
+		self.key = key
+		self.meta = meta
+		self.limit = limit
+		self.size = 0
+		fd, self._tmp_path = tempfile.mkstemp(dir=cache.directory, prefix=".fill-")
+		self._file: Optional[Any] = os.fdopen(fd, "wb")
+
+	def write(self, chunk: bytes) -> bool:
+		"""False — запись отменена (слишком большая или уже прервана)."""
+		if self._file is None:
+			return False
+		self.size += len(chunk)
+		if self.size > self.limit:
+			self.abort()
+			return False
+		self._file.write(chunk)
+		return True
+
+	def commit(self) -> Optional[str]:
+		if self._file is None:
+			return None
+		self._file.close()
+		self._file = None
+		try:
+			return self.cache._commit(self.key, self._tmp_path, self.size, self.meta)
+		except BaseException:
+			self._remove_tmp()
+			raise
+
+	def abort(self) -> None:
+		if self._file is not None:
+			self._file.close()
+			self._file = None
+			self._remove_tmp()
+
+	def _remove_tmp(self) -> None:
+		try:
+			os.remove(self._tmp_path)
+		except OSError:
+			pass
@@ -0,0 +1,65 @@
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, TypeVar
+
+from app.config import settings
+from app.utils.metrics import EXECUTOR_INFLIGHT, EXECUTOR_WAIT_SECONDS
+
+
+T = TypeVar("T")
+
+# Пул -> поле настроек с его размером
+POOLS = {
+	"store": "executor_store_workers",
+	"s3": "executor_s3_workers",
+	"fal": "executor_fal_workers",
+	"smtp": "executor_smtp_workers",
+	"yookassa": "executor_yookassa_workers",
+}
+
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_lock = threading.Lock()
+
+
+def executor(pool: str) -> ThreadPoolExecutor:
+	"""Пул потоков зависимости; создаётся при первом вызове."""
+	ex = _executors.get(pool)
+	if ex is None:
+		with _lock:
+			ex = _executors.get(pool)
+			if ex is None:
+				workers = max(1, int(getattr(settings, POOLS[pool])))
+				ex = _executors[pool] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"io-{pool}")
+	return ex
+
+
+async def run(pool: str, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+	"""Выполняет блокирующий fn в пуле зависимости, не занимая event loop.
+
+	Контекст (дедлайн запроса из resilience) копируется в поток вызова.
+	"""
+	ctx = contextvars.copy_context()
+	queued = time.perf_counter()
+
+	def _call() -> T:
+		EXECUTOR_WAIT_SECONDS.labels(pool).observe(time.perf_counter() - queued)
+		return ctx.run(functools.partial(fn, *args, **kwargs))
+
+	gauge = EXECUTOR_INFLIGHT.labels(pool)
+	gauge.inc()
+	try:
+		return await asyncio.get_running_loop().run_in_executor(executor(pool), _call)
+	finally:
+		gauge.dec()
+
+
+def shutdown(wait: bool = True) -> None:
+	with _lock:
+		pools = list(_executors.values())
+		_executors.clear()
+	for ex in pools:
+		ex.shutdown(wait=wait, cancel_futures=not wait)
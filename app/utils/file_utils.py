@@ -1,13 +1,34 @@
 import os
 import tempfile
 from fastapi import UploadFile, HTTPException
-from typing import List
-import json
+from typing import Callable, Collection, Dict, Iterator, List, Optional, Tuple
 from datetime import datetime
 import glob
+import gzip
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from app.models.schemas import Order, dumps, loads
+from app.utils.order_stats import DailyStats, day_aggregate
+from app.utils.singleflight import lock_shard
+from app.utils.user_index import UserOrderIndex
+
+try:
+	import fcntl
+except ImportError:  # не-POSIX: остаётся только блокировка внутри процесса
+	fcntl = None
+
+try:
+	import zstandard
+except ImportError:  # архивы пишутся gzip
+	zstandard = None
 
 MAX_FILE_SIZE_BYTES = 50 * 1024 * 1024
 
+logger = logging.getLogger("livephoto.store")
+
 async def save_upload_to_temp(upload: UploadFile) -> str:
 	# Stream to disk and enforce size limit
 	suffix = os.path.splitext(upload.filename or "")[1]
@@ -56,16 +77,117 @@ def save_multiple_uploads_to_temp(uploads: List[UploadFile]) -> List[str]:
 	return paths
 
 
+def write_atomic(path: str, data: bytes) -> Tuple[int, int, int]:
+	"""Атомарно подменяет path (свой временный файл рядом + fsync + os.replace).
+
+	Возвращает отметку записанного файла (st_mtime_ns, st_size, st_ino) — rename её не меняет.
+	"""
+	fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-")
+	try:
+		with os.fdopen(fd, "wb") as f:
+			f.write(data)
+			f.flush()
+			os.fsync(f.fileno())
+			st = os.fstat(f.fileno())
+		os.replace(tmp_path, path)
+	except BaseException:
+		try:
+			os.remove(tmp_path)
+		except OSError:
+			pass
+		raise
+	return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+@contextmanager
+def run_lock(path: str) -> Iterator[bool]:
+	"""Неблокирующая межпроцессная блокировка (fcntl.flock на path) на время блока.
+
+	True — блокировка взята; False — её держит другой процесс или поток (прогон уже идёт).
+	"""
+	if fcntl is None:
+		yield True
+		return
+	os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+	with open(path, "a") as lf:
+		try:
+			fcntl.flock(lf.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+		except BlockingIOError:
+			yield False
+			return
+		try:
+			yield True
+		finally:
+			fcntl.flock(lf.fileno(), fcntl.LOCK_UN)
+
+
+def run_lock_held(path: str) -> bool:
+	"""Держит ли кто-то (в любом процессе) блокировку run_lock(path)."""
+	with run_lock(path) as acquired:
+		return not acquired
+
+
+class OrderVersionConflict(Exception):
+	"""Заявку успели изменить после чтения: сохранение отклонено, нужно перечитать и повторить."""
+
+	def __init__(self, order_id: str, expected: int, actual: int) -> None:
+		super().__init__(f"order {order_id}: version conflict (expected {expected}, stored {actual})")
+		self.order_id = order_id
+		self.expected = expected
+		self.actual = actual
+
+
 class JsonOrderStore:
 	"""Файловое хранилище: одна дата = один JSON-файл в текущей директории.
 
 	Структура файла: массив объектов-заявок за день.
-	Имена файлов: YYYY-MM-DD.json
+	Имена файлов: YYYY-MM-DD.json (компактный JSON без отступов; файлы старого формата с indent=2
+	читаются так же и переписываются компактно при следующей записи).
+
+	Каждая запись несёт монотонно растущее поле version (увеличивается при каждом
+	сохранении). Версии последних прочитанных/записанных заявок держим в памяти,
+	чтобы отвечать на условные GET без чтения дневного файла.
+
+	Запись безопасна для нескольких потоков и процессов (воркеры uvicorn): чтение-изменение-запись
+	дневного файла идёт под эксклюзивной блокировкой fcntl на locks/{shard}.lock (дни распределены
+	хешем по LOCK_SHARDS файлам, их число не растёт со временем), файл заменяется
+	атомарно (временный файл + fsync + rename), а save() проверяет версию заявки (optimistic locking).
+	Читатели блокировку не берут: после rename они видят либо старый, либо новый файл целиком.
+
+	Холодный уровень: archive_days() переносит старые дни в archive/{день}.json.gz (или .json.zst)
+	и пишет рядом archive/{день}.idx — список order_id построчно. load() сначала ищет в горячих
+	файлах и распаковывает архив, только если order_id есть в его индексе. Запись в архивный день
+	(update, save с его датой) сначала возвращает день в горячий уровень.
+
+	Индекс пользователя (users.sqlite3, UserOrderIndex): anonUserId -> order_id по created_at;
+	orders_for_user() отдаёт страницу заявок пользователя, читая только дни этих заявок.
+	Дневные агрегаты (stats.sqlite3, DailyStats) пересчитываются из уже загруженного дня при каждой
+	его записи; iter_orders() потоково отдаёт заявки диапазона дат по одному дню в памяти.
 	"""
 
+	LOCK_SHARDS = 256
+	# карта версий — LRU: вытесненная заявка просто ищется по дневным файлам
+	_VERSIONS_MAX = 100000
+
 	def __init__(self, base_dir: str = "logs") -> None:
 		self.base_dir = base_dir  # относительный путь (текущая директория по умолчанию)
 		os.makedirs(self.base_dir, exist_ok=True)
+		# order_id -> (version, anonUserId, путь дневного файла)
+		self._versions: "OrderedDict[str, Tuple[int, Optional[str], str]]" = OrderedDict()
+		# путь дневного файла -> (st_mtime_ns, st_size, st_ino) на момент последнего чтения/записи
+		self._day_stamps: Dict[str, Tuple[int, int, int]] = {}
+		self._versions_lock = threading.Lock()
+		# потоки одного процесса сериализуем до fcntl, чтобы не держать лишние дескрипторы (по шарду)
+		self._thread_locks: List[threading.Lock] = [threading.Lock() for _ in range(self.LOCK_SHARDS)]
+		# путь индекса архива -> (отметка файла, множество order_id)
+		self._archive_index: Dict[str, Tuple[Tuple[int, int, int], frozenset]] = {}
+		self._user_index: Optional[UserOrderIndex] = None
+		self._indexes_lock = threading.Lock()
+		self._daily_stats: Optional[DailyStats] = None
+
+	@property
+	def archive_dir(self) -> str:
+		return os.path.join(self.base_dir, "archive")
 
 	def _date_file(self, date_str: str) -> str:
 		return os.path.join(self.base_dir, f"{date_str}.json")
@@ -74,56 +196,472 @@ class JsonOrderStore:
 		pattern = os.path.join(self.base_dir, "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9].json")
 		return sorted(glob.glob(pattern))
 
+	@staticmethod
+	def _order_id_of(item: dict) -> Optional[str]:
+		return item.get("order_id") or item.get("request_id")
+
+	@staticmethod
+	def _day_stamp(path: str) -> Tuple[int, int, int] | None:
+		try:
+			st = os.stat(path)
+		except OSError:
+			return None
+		return st.st_mtime_ns, st.st_size, st.st_ino
+
+	def _remember_day(self, path: str, items: List[dict], stamp: Optional[Tuple[int, int, int]] = None) -> None:
+		"""Обновляет карту версий по содержимому дневного файла.
+
+		stamp — отметка того файла, из которого прочитаны items (fstat открытого дескриптора):
+		stat по пути после чтения мог бы увидеть уже подменённый другим процессом файл.
+		"""
+		if stamp is None:
+			stamp = self._day_stamp(path)
+		if stamp is None:
+			return
+		with self._versions_lock:
+			self._day_stamps[path] = stamp
+			for it in items:
+				oid = self._order_id_of(it)
+				if oid:
+					self._versions[oid] = (int(it.get("version") or 0), it.get("anonUserId"), path)
+					self._versions.move_to_end(oid)
+			while len(self._versions) > self._VERSIONS_MAX:
+				self._versions.popitem(last=False)
+
 	def _read_day(self, path: str) -> List[dict]:
 		if not os.path.exists(path):
 			return []
-		with open(path, "r", encoding="utf-8") as f:
+		with open(path, "rb") as f:
+			st = os.fstat(f.fileno())
 			try:
-				data = json.load(f)
-				return data if isinstance(data, list) else []
+				data = loads(f.read())
 			except Exception:
 				return []
+		items = data if isinstance(data, list) else []
+		self._remember_day(path, items, (st.st_mtime_ns, st.st_size, st.st_ino))
+		return items
+
+	@contextmanager
+	def _day_lock(self, path: str) -> Iterator[None]:
+		"""Эксклюзивная блокировка дневного файла (между потоками и между процессами).
+
+		Дни одного шарда блокируются вместе; вложенных блокировок дней в хранилище нет.
+		"""
+		shard = lock_shard(os.path.basename(path), self.LOCK_SHARDS)
+		with self._thread_locks[shard]:
+			if fcntl is None:
+				yield
+				return
+			lock_dir = os.path.join(self.base_dir, "locks")
+			os.makedirs(lock_dir, exist_ok=True)
+			with open(os.path.join(lock_dir, f"{shard:02x}.lock"), "a") as lf:
+				fcntl.flock(lf.fileno(), fcntl.LOCK_EX)
+				try:
+					yield
+				finally:
+					fcntl.flock(lf.fileno(), fcntl.LOCK_UN)
 
 	def _write_day(self, path: str, items: List[dict]) -> None:
-		with open(path, "w", encoding="utf-8") as f:
-			json.dump(items, f, ensure_ascii=False, indent=2)
+		# Пишем во временный файл рядом и атомарно подменяем: падение посреди записи не обрежет день
+		stamp = self._write_atomic(path, dumps(items))
+		self._fsync_dir()
+		self._remember_day(path, items, stamp)
+		try:
+			self.daily_stats.put(os.path.basename(path)[:10], day_aggregate(items))
+		except Exception:
+			# агрегаты вторичны: день уже записан, строку пересчитает следующая запись дня
+			logger.exception("store: daily stats update failed for %s", path)
+
+	def _write_atomic(self, path: str, data: bytes) -> Tuple[int, int, int]:
+		return write_atomic(path, data)
+
+	def _fsync_dir(self) -> None:
+		try:
+			dir_fd = os.open(self.base_dir, os.O_RDONLY)
+		except OSError:
+			return
+		try:
+			os.fsync(dir_fd)
+		except OSError:
+			pass
+		finally:
+			os.close(dir_fd)
+
+	@staticmethod
+	def _bump_version(order: dict) -> None:
+		order["version"] = int(order.get("version") or 0) + 1
+
+	def peek_version(self, order_id: str) -> Tuple[int, Optional[str]] | None:
+		"""Возвращает (version, anonUserId) из памяти, не читая заявку.
+
+		None — если версия неизвестна или дневной файл изменился с момента
+		последнего чтения (например, его переписал другой процесс).
+		"""
+		with self._versions_lock:
+			entry = self._versions.get(order_id)
+			if not entry:
+				return None
+			version, anon_user_id, path = entry
+			known_stamp = self._day_stamps.get(path)
+		stamp = self._day_stamp(path)
+		if stamp is None or stamp != known_stamp:
+			return None
+		return version, anon_user_id
+
+	def save(self, order: dict, check_version: bool = True) -> None:
+		"""Сохраняет заявку целиком.
 
-	def save(self, order: dict) -> None:
+		Если заявка уже есть в файле и её версия отличается от order["version"] (кто-то сохранил её
+		после нашего чтения), бросает OrderVersionConflict. check_version=False — безусловная запись.
+		"""
 		# Определяем дату по created_at или текущую (UTC)
 		created_at = order.get("created_at") or datetime.utcnow().isoformat()
 		order["created_at"] = created_at
 		date_str = created_at[:10]
 		path = self._date_file(date_str)
-		day_items = self._read_day(path)
-		# Удаляем старую запись с тем же order_id, если есть, и добавляем актуальную
-		order_id = order.get("order_id") or order.get("request_id")
-		day_items = [it for it in day_items if (it.get("order_id") or it.get("request_id")) != order_id]
-		day_items.append(order)
-		self._write_day(path, day_items)
+		order_id = self._order_id_of(order)
+		with self._day_lock(path):
+			self._restore_day(path)
+			day_items = self._read_day(path)
+			if check_version:
+				for it in day_items:
+					if self._order_id_of(it) == order_id:
+						stored = int(it.get("version") or 0)
+						expected = int(order.get("version") or 0)
+						if stored != expected:
+							raise OrderVersionConflict(order_id or "", expected, stored)
+						break
+			# Индекс — до записи дня: лишняя ссылка после сбоя безвредна, потерянная — нет
+			self.user_index.add(order.get("anonUserId"), created_at, order_id or "")
+			# Удаляем старую запись с тем же order_id, если есть, и добавляем актуальную
+			day_items = [it for it in day_items if self._order_id_of(it) != order_id]
+			self._bump_version(order)
+			day_items.append(order)
+			self._write_day(path, day_items)
 
-	def load(self, order_id: str) -> dict | None:
-		# Поиск по всем дневным файлам (от новых к старым)
+	def _candidate_paths(self, order_id: str) -> List[str]:
+		"""Дневные файлы для поиска заявки: сначала известный по карте версий, затем все от новых к старым."""
+		with self._versions_lock:
+			entry = self._versions.get(order_id)
 		files = self._list_day_files()[::-1]
-		for path in files:
+		if entry and entry[2] in files:
+			files.remove(entry[2])
+			files.insert(0, entry[2])
+		return files
+
+	def load(self, order_id: str) -> dict | None:
+		# Поиск по всем дневным файлам (от новых к старым), затем в архиве по индексам
+		for path in self._candidate_paths(order_id):
 			for it in self._read_day(path):
-				if (it.get("order_id") or it.get("request_id")) == order_id:
+				if self._order_id_of(it) == order_id:
+					return it
+		archive_path = self._find_archive(order_id)
+		if archive_path:
+			for it in self._read_archive(archive_path):
+				if self._order_id_of(it) == order_id:
 					return it
 		return None
 
-	def update_status(self, order_id: str, status: str) -> None:
-		files = self._list_day_files()[::-1]
-		for path in files:
+	def update(self, order_id: str, mutator: Callable[[dict], Optional[bool]]) -> dict | None:
+		"""Атомарно изменяет заявку: чтение, mutator(order) и запись идут под блокировкой дня.
+
+		mutator меняет заявку на месте; если он вернул False — запись не выполняется.
+		Возвращает актуальную заявку (или None, если её нет). mutator должен быть быстрым:
+		сетевые вызовы делаются до update, а внутрь передаётся только результат.
+		"""
+		for path in self._candidate_paths(order_id):
+			# Ищем файл без блокировки, блокируем только нужный день
+			if not any(self._order_id_of(it) == order_id for it in self._read_day(path)):
+				continue
+			with self._day_lock(path):
+				items = self._read_day(path)
+				for it in items:
+					if self._order_id_of(it) != order_id:
+						continue
+					if mutator(it) is False:
+						return it
+					it["updated_at"] = datetime.utcnow().isoformat()
+					self._bump_version(it)
+					self._write_day(path, items)
+					return it
+		archive_path = self._find_archive(order_id)
+		if archive_path:
+			# Поздние изменения архивной заявки: возвращаем день в горячий уровень и повторяем
+			path = self._date_file(self._archive_day(archive_path))
+			with self._day_lock(path):
+				self._restore_day(path)
+			return self.update(order_id, mutator)
+		return None
+
+	def delete(self, order_id: str) -> bool:
+		"""Удаляет заявку из хранилища (архивный день сначала возвращается в горячий уровень)."""
+		for path in self._candidate_paths(order_id):
+			if not any(self._order_id_of(it) == order_id for it in self._read_day(path)):
+				continue
+			with self._day_lock(path):
+				items = self._read_day(path)
+				kept = [it for it in items if self._order_id_of(it) != order_id]
+				if len(kept) == len(items):
+					continue
+				self._write_day(path, kept)
+				with self._versions_lock:
+					self._versions.pop(order_id, None)
+				self.user_index.remove(order_id)
+				return True
+		archive_path = self._find_archive(order_id)
+		if archive_path:
+			path = self._date_file(self._archive_day(archive_path))
+			with self._day_lock(path):
+				self._restore_day(path)
+			return self.delete(order_id)
+		return False
+
+	def iter_days(
+		self,
+		include_archive: bool = True,
+		skip: Collection[str] = (),
+		date_from: Optional[str] = None,
+		date_to: Optional[str] = None,
+	) -> Iterator[Tuple[str, bool, List[dict]]]:
+		"""Дни хранилища от старых к новым: (YYYY-MM-DD, в архиве ли, заявки дня).
+
+		Дни из skip и вне [date_from, date_to] не читаются.
+		"""
+		days: Dict[str, Tuple[bool, str]] = {}
+		if include_archive:
+			for archive_path in self._list_archives():
+				days.setdefault(self._archive_day(archive_path), (True, archive_path))
+		for path in self._list_day_files():
+			days[os.path.basename(path)[:10]] = (False, path)
+		for date_str in sorted(set(days) - set(skip)):
+			if (date_from and date_str < date_from) or (date_to and date_str > date_to):
+				continue
+			archived, path = days[date_str]
+			yield date_str, archived, (self._read_archive(path) if archived else self._read_day(path))
+
+	# --- Холодный уровень: сжатые архивы старых дней ---
+
+	def _archive_paths(self, date_str: str) -> List[str]:
+		return [os.path.join(self.archive_dir, f"{date_str}.json{ext}") for ext in (".zst", ".gz")]
+
+	@staticmethod
+	def _archive_day(archive_path: str) -> str:
+		return os.path.basename(archive_path)[:10]
+
+	def _list_archives(self) -> List[str]:
+		pattern = os.path.join(self.archive_dir, "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9].json.*")
+		return sorted(p for p in glob.glob(pattern) if p.endswith((".gz", ".zst")))
+
+	def _archive_ids(self, archive_path: str) -> frozenset:
+		"""order_id из индекса архива; индекс кэшируется до изменения файла."""
+		idx_path = os.path.join(self.archive_dir, f"{self._archive_day(archive_path)}.idx")
+		stamp = self._day_stamp(idx_path)
+		if stamp is None:
+			return frozenset()
+		cached = self._archive_index.get(idx_path)
+		if cached and cached[0] == stamp:
+			return cached[1]
+		with open(idx_path, "r", encoding="utf-8") as f:
+			ids = frozenset(line.strip() for line in f if line.strip())
+		self._archive_index[idx_path] = (stamp, ids)
+		return ids
+
+	def _find_archive(self, order_id: str) -> Optional[str]:
+		for archive_path in reversed(self._list_archives()):
+			if order_id in self._archive_ids(archive_path):
+				return archive_path
+		return None
+
+	@staticmethod
+	def _read_archive(archive_path: str) -> List[dict]:
+		with open(archive_path, "rb") as f:
+			raw = f.read()
+		if archive_path.endswith(".zst"):
+			if zstandard is None:
+				raise RuntimeError(f"{archive_path}: zstandard is not installed")
+			raw = zstandard.ZstdDecompressor().decompress(raw)
+		else:
+			raw = gzip.decompress(raw)
+		data = loads(raw)
+		return data if isinstance(data, list) else []
+
+	def _restore_day(self, path: str) -> bool:
+		"""Возвращает архивный день в горячий уровень. Вызывается под блокировкой дня."""
+		date_str = os.path.basename(path)[:10]
+		archives = [p for p in self._archive_paths(date_str) if os.path.exists(p)]
+		if not archives:
+			return False
+		items = self._read_archive(archives[0])
+		# Горячий файл мог появиться раньше (запись до архивации другим процессом) — сливаем
+		hot = self._read_day(path)
+		known = {self._order_id_of(it) for it in hot}
+		merged = hot + [it for it in items if self._order_id_of(it) not in known]
+		self._write_day(path, merged)
+		for p in archives + [os.path.join(self.archive_dir, f"{date_str}.idx")]:
+			try:
+				os.remove(p)
+			except OSError:
+				pass
+		return True
+
+	@staticmethod
+	def _is_terminal(order: dict) -> bool:
+		return ((order.get("generation") or {}).get("status")) == "completed"
+
+	@staticmethod
+	def _in_progress(order: dict) -> bool:
+		"""Генерация заявки идёт: её элементы ведут поллер и вебхуки, день должен оставаться горячим."""
+		return ((order.get("generation") or {}).get("status")) == "in_progress"
+
+	def archive_days(
+		self,
+		older_than_days: int = 30,
+		terminal_after_days: int = 2,
+		compression: str = "gzip",
+		dry_run: bool = False,
+	) -> Dict[str, object]:
+		"""Переносит дни в сжатый архив.
+
+		В архив уходит день старше older_than_days, а также день старше terminal_after_days,
+		если все его заявки завершены. День моложе terminal_after_days и день с заявками, генерация
+		которых ещё идёт, не архивируются никогда. compression: "gzip" или "zstd" (нужен zstandard).
+		Возвращает отчёт: какие дни перенесены и сколько байт сэкономлено.
+		"""
+		if older_than_days < 1:
+			raise ValueError("older_than_days must be >= 1")
+		use_zstd = compression == "zstd" and zstandard is not None
+		today = datetime.utcnow().date()
+		report: Dict[str, object] = {"archived": [], "hot_bytes": 0, "archive_bytes": 0, "dry_run": dry_run}
+		for path in self._list_day_files():
+			date_str = os.path.basename(path)[:10]
+			try:
+				age_days = (today - datetime.strptime(date_str, "%Y-%m-%d").date()).days
+			except ValueError:
+				continue
+			if age_days < max(1, min(older_than_days, terminal_after_days)):
+				continue
 			items = self._read_day(path)
-			updated = False
+			if any(self._in_progress(it) for it in items):
+				continue
+			if age_days < older_than_days and not all(self._is_terminal(it) for it in items):
+				continue
+			if dry_run:
+				report["archived"].append(date_str)
+				report["hot_bytes"] += os.path.getsize(path)
+				continue
+			with self._day_lock(path):
+				if not os.path.exists(path):
+					continue
+				items = self._read_day(path)
+				# заявка дня могла перейти в работу (оплата) после проверки без блокировки
+				if any(self._in_progress(it) for it in items):
+					continue
+				raw = dumps(items)
+				os.makedirs(self.archive_dir, exist_ok=True)
+				if use_zstd:
+					archive_path = os.path.join(self.archive_dir, f"{date_str}.json.zst")
+					data = zstandard.ZstdCompressor(level=10).compress(raw)
+				else:
+					archive_path = os.path.join(self.archive_dir, f"{date_str}.json.gz")
+					data = gzip.compress(raw, compresslevel=6)
+				# Сначала архив и индекс, затем удаление горячего файла: заявка всегда где-то видна
+				self._write_atomic(archive_path, data)
+				ids = "\n".join(sorted(filter(None, (self._order_id_of(it) for it in items))))
+				self._write_atomic(os.path.join(self.archive_dir, f"{date_str}.idx"), (ids + "\n").encode("utf-8"))
+				report["hot_bytes"] += os.path.getsize(path)
+				report["archive_bytes"] += len(data)
+				os.remove(path)
+				self._fsync_dir()
+				with self._versions_lock:
+					self._day_stamps.pop(path, None)
+					for it in items:
+						self._versions.pop(self._order_id_of(it) or "", None)
+				report["archived"].append(date_str)
+		return report
+
+	# --- Индекс заявок пользователя ---
+
+	@property
+	def user_index(self) -> UserOrderIndex:
+		"""Индекс anonUserId -> order_id; при первом обращении заполняется по всем дням (включая архив)."""
+		index = self._user_index
+		if index is None:
+			with self._indexes_lock:
+				index = self._user_index
+				if index is None:
+					index = UserOrderIndex(os.path.join(self.base_dir, "users.sqlite3"))
+					if not index.built:
+						index.rebuild(
+							(it.get("anonUserId"), it.get("created_at") or day, self._order_id_of(it) or "")
+							for day, _, items in self.iter_days()
+							for it in items
+						)
+					self._user_index = index
+		return index
+
+	@property
+	def daily_stats(self) -> DailyStats:
+		"""Дневные агрегаты; при первом обращении строки считаются по всем дням (включая архив)."""
+		stats = self._daily_stats
+		if stats is None:
+			with self._indexes_lock:
+				stats = self._daily_stats
+				if stats is None:
+					stats = DailyStats(os.path.join(self.base_dir, "stats.sqlite3"))
+					if not stats.built:
+						stats.rebuild((day, items) for day, _, items in self.iter_days())
+					self._daily_stats = stats
+		return stats
+
+	def iter_orders(self, date_from: Optional[str] = None, date_to: Optional[str] = None, include_archive: bool = True) -> Iterator[dict]:
+		"""Заявки диапазона дат по порядку дней; в памяти одновременно только один день."""
+		for _, _, items in self.iter_days(include_archive=include_archive, date_from=date_from, date_to=date_to):
+			yield from items
+
+	def load_many(self, order_ids: List[Tuple[str, str]]) -> Dict[str, dict]:
+		"""Заявки по парам (created_at, order_id): каждый нужный день читается один раз."""
+		wanted: Dict[str, set] = {}
+		for created_at, order_id in order_ids:
+			wanted.setdefault(created_at[:10], set()).add(order_id)
+		found: Dict[str, dict] = {}
+		for date_str, ids in wanted.items():
+			path = self._date_file(date_str)
+			if os.path.exists(path):
+				items = self._read_day(path)
+			else:
+				archives = [p for p in self._archive_paths(date_str) if os.path.exists(p)]
+				items = self._read_archive(archives[0]) if archives else []
 			for it in items:
-				if (it.get("order_id") or it.get("request_id")) == order_id:
-					it["status"] = status
-					it["updated_at"] = datetime.utcnow().isoformat()
-					updated = True
-					break
-			if updated:
-				self._write_day(path, items)
-				return
+				oid = self._order_id_of(it)
+				if oid in ids:
+					found[oid] = it
+		# created_at мог не совпасть с днём файла (ручная правка) — добираем обычным поиском
+		for _, order_id in order_ids:
+			if order_id not in found:
+				order = self.load(order_id)
+				if order is not None:
+					found[order_id] = order
+		return found
+
+	def orders_for_user(self, anon_user_id: str, limit: int = 20, after: Optional[Tuple[str, str]] = None) -> Tuple[List[dict], Optional[Tuple[str, str]]]:
+		"""Страница заявок пользователя от новых к старым и курсор следующей страницы (или None)."""
+		entries = self.user_index.page(anon_user_id, limit + 1, after)
+		page, more = entries[:limit], len(entries) > limit
+		found = self.load_many(page)
+		result = [found[oid] for _, oid in page if oid in found and found[oid].get("anonUserId") == anon_user_id]
+		return result, (page[-1] if more and page else None)
+
+	def update_status(self, order_id: str, status: str) -> None:
+		def _set_status(it: dict) -> None:
+			it["status"] = status
+
+		self.update(order_id, _set_status)
+
+	def iter_recent_orders(self, max_files: int = 7) -> Iterator[Order]:
+		"""Типизированные заявки последних max_files дней; в памяти одновременно только один день."""
+		for path in self._list_day_files()[::-1][:max_files]:
+			for it in self._read_day(path):
+				yield Order.from_dict(it)
 
 	def list_recent_orders(self, max_files: int = 7) -> List[dict]:
 		"""Возвращает список заявок из последних max_files дневных файлов (от новых к старым)."""
@@ -132,4 +670,3 @@ class JsonOrderStore:
 		for path in files:
 			result.extend(self._read_day(path))
 		return result
-
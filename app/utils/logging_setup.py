@@ -0,0 +1,236 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# Логгеры сервера, которые не пропагируют в root (uvicorn вешает на них свои handlers)
+_NON_PROPAGATING = ("uvicorn", "uvicorn.access")
+
+_lock = threading.Lock()
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional["_LazyQueueHandler"] = None
+
+
+class LazyJson:
+	"""Отложенная сериализация payload для логов: json строится только при форматировании.
+
+	Форматирование выполняется в потоке QueueListener, поэтому запросы и поллер не платят
+	за json.dumps больших ответов fal. Сериализация останавливается, как только набрано limit символов.
+	"""
+
+	__slots__ = ("obj", "limit")
+
+	def __init__(self, obj: Any, limit: int = 2000) -> None:
+		self.obj = obj
+		self.limit = limit
+
+	def __str__(self) -> str:
+		parts: List[str] = []
+		size = 0
+		try:
+			for chunk in json.JSONEncoder(ensure_ascii=False, default=str).iterencode(self.obj):
+				parts.append(chunk)
+				size += len(chunk)
+				if size >= self.limit:
+					break
+		except Exception:
+			return repr(self.obj)[: self.limit]
+		return "".join(parts)[: self.limit]
+
+	__repr__ = __str__
+
+
+class JsonFormatter(logging.Formatter):
+	"""Одна запись = одна строка JSON."""
+
+	def format(self, record: logging.LogRecord) -> str:
+		entry: Dict[str, Any] = {
+			"ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+			"level": record.levelname,
+			"logger": record.name,
+			"msg": record.getMessage(),
+			"thread": record.threadName,
+		}
+		if record.exc_info and not record.exc_text:
+			record.exc_text = self.formatException(record.exc_info)
+		if record.exc_text:
+			entry["exc"] = record.exc_text
+		return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+	"""Сэмплирование DEBUG/INFO по имени логгера (самый длинный совпавший префикс).
+
+	WARNING и выше проходят всегда.
+	"""
+
+	def __init__(self, rates: Dict[str, float]) -> None:
+		super().__init__()
+		self.rates = dict(rates)
+		self._cache: Dict[str, float] = {}
+
+	def _rate_for(self, name: str) -> float:
+		rate = self._cache.get(name)
+		if rate is None:
+			rate = 1.0
+			best = -1
+			for prefix, value in self.rates.items():
+				if (name == prefix or name.startswith(prefix + ".")) and len(prefix) > best:
+					rate, best = value, len(prefix)
+			self._cache[name] = rate
+		return rate
+
+	def filter(self, record: logging.LogRecord) -> bool:
+		if record.levelno >= logging.WARNING:
+			return True
+		rate = self._rate_for(record.name)
+		return rate >= 1.0 or (rate > 0.0 and random.random() < rate)
+
+
+class _ExcludeLoggers(logging.Filter):
+	def __init__(self, names: Tuple[str, ...]) -> None:
+		super().__init__()
+		self.names = names
+
+	def filter(self, record: logging.LogRecord) -> bool:
+		return not any(record.name == n or record.name.startswith(n + ".") for n in self.names)
+
+
+class _LazyQueueHandler(QueueHandler):
+	"""QueueHandler без форматирования в вызывающем потоке.
+
+	Стандартный prepare() склеивает сообщение (и сериализует LazyJson) прямо в потоке запроса;
+	здесь запись уходит в очередь как есть, а форматирование делают handlers слушателя.
+	При переполнении очереди запись отбрасывается (счётчик dropped), а не блокирует вызывающего.
+	"""
+
+	dropped = 0
+
+	def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+		if record.exc_info:
+			# traceback форматируем сразу, чтобы не держать кадры стека в очереди
+			record.exc_text = logging.Formatter().formatException(record.exc_info)
+			record.exc_info = None
+		return record
+
+	def enqueue(self, record: logging.LogRecord) -> None:
+		try:
+			self.queue.put_nowait(record)
+		except queue.Full:
+			type(self).dropped += 1
+
+
+def parse_sampling(spec: str | None) -> Dict[str, float]:
+	"""'livephoto.polling=0.1,livephoto.fal=0.5' -> {'livephoto.polling': 0.1, ...}"""
+	rates: Dict[str, float] = {}
+	for part in (spec or "").split(","):
+		name, sep, value = part.strip().partition("=")
+		if not sep or not name:
+			continue
+		try:
+			rates[name.strip()] = max(0.0, min(1.0, float(value)))
+		except ValueError:
+			continue
+	return rates
+
+
+def _daily_json_namer(default_name: str) -> str:
+	# default_name заканчивается на ".YYYY-MM-DD"
+	dir_name = os.path.dirname(default_name)
+	date_suffix = default_name.rsplit(".", 1)[-1]
+	return os.path.join(dir_name, f"{date_suffix}.json")
+
+
+def configure_logging(log_dir: str, sampling: str | None = None, queue_size: int = 10000) -> None:
+	"""Настраивает неблокирующий конвейер логов (идемпотентно).
+
+	Все записи уходят в одну очередь (QueueHandler на root и на непропагирующих логгерах uvicorn),
+	а запись в файл (JSON-строки, ротация в {YYYY-MM-DD}.json) и в консоль делает поток QueueListener.
+	Handler подключается к каждому логгеру не более одного раза, поэтому записи не дублируются.
+	"""
+	global _listener, _queue_handler
+	with _lock:
+		if _listener is not None:
+			return
+		handlers: List[logging.Handler] = []
+		try:
+			os.makedirs(log_dir, exist_ok=True)
+			file_handler = TimedRotatingFileHandler(
+				os.path.join(log_dir, "app.log"),
+				when="midnight",
+				interval=1,
+				backupCount=30,
+				encoding="utf-8",
+				utc=True,
+			)
+			# Имена файлов вида {YYYY-MM-DD}.json
+			file_handler.suffix = "%Y-%m-%d"
+			file_handler.namer = _daily_json_namer
+			file_handler.setFormatter(JsonFormatter())
+			handlers.append(file_handler)
+		except Exception:
+			# Не мешаем запуску приложения, если файловые логи недоступны
+			pass
+
+		# Консоль: у логгеров uvicorn свой вывод, дублировать его не нужно
+		console = logging.StreamHandler()
+		console.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+		own_output = tuple(n for n in _NON_PROPAGATING if logging.getLogger(n).handlers)
+		if own_output:
+			console.addFilter(_ExcludeLoggers(own_output))
+		handlers.append(console)
+
+		qh = _LazyQueueHandler(queue.Queue(maxsize=queue_size))
+		rates = parse_sampling(sampling)
+		if rates:
+			qh.addFilter(SamplingFilter(rates))
+
+		root = logging.getLogger()
+		root.setLevel(logging.INFO)
+		_attach_once(root, qh)
+		for name in _NON_PROPAGATING:
+			_attach_once(logging.getLogger(name), qh)
+		logging.getLogger("livephoto").setLevel(logging.INFO)
+
+		_listener = QueueListener(qh.queue, *handlers, respect_handler_level=True)
+		_listener.start()
+		_queue_handler = qh
+		atexit.register(shutdown_logging)
+
+
+def _attach_once(logger: logging.Logger, handler: logging.Handler) -> None:
+	"""Подключает handler, если он уже не получает записи этого логгера через propagate."""
+	current: Optional[logging.Logger] = logger
+	while current is not None:
+		if handler in current.handlers:
+			return
+		if not current.propagate:
+			break
+		current = current.parent
+	logger.addHandler(handler)
+
+
+def shutdown_logging() -> None:
+	"""Дописывает очередь и останавливает поток слушателя."""
+	global _listener, _queue_handler
+	with _lock:
+		listener, qh = _listener, _queue_handler
+		_listener, _queue_handler = None, None
+	if listener is not None:
+		listener.stop()
+		for h in listener.handlers:
+			try:
+				h.close()
+			except Exception:
+				pass
+	if qh is not None:
+		for lg in [logging.getLogger()] + [logging.getLogger(n) for n in _NON_PROPAGATING]:
+			if qh in lg.handlers:
+				lg.removeHandler(qh)
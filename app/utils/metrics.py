@@ -0,0 +1,157 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator, Tuple
+
+from prometheus_client import (
+	CONTENT_TYPE_LATEST,
+	REGISTRY,
+	CollectorRegistry,
+	Counter,
+	Gauge,
+	Histogram,
+	generate_latest,
+	multiprocess,
+)
+
+
+# Несколько воркеров uvicorn: если задан PROMETHEUS_MULTIPROC_DIR, каждый процесс пишет
+# значения в mmap-файлы этой директории, а /metrics агрегирует их (multiprocess mode
+# prometheus_client). Директорию нужно очищать перед запуском сервера.
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR") or None
+
+# Внешние вызовы: от быстрых presign до скачивания видео (таймаут до 180с)
+_CALL_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 180.0)
+
+EXTERNAL_CALL_SECONDS = Histogram(
+	"livephoto_external_call_seconds",
+	"Длительность исходящих вызовов (fal, S3, YooKassa, SMTP)",
+	["dependency", "operation", "outcome"],
+	buckets=_CALL_BUCKETS,
+)
+
+WEBHOOK_EVENTS = Counter(
+	"livephoto_webhook_events_total",
+	"Входящие вебхуки по источнику и исходу обработки",
+	["source", "outcome"],
+)
+
+GENERATION_ITEMS_INFLIGHT = Gauge(
+	"livephoto_generation_items_inflight",
+	"Элементы генерации в работе (по данным последнего тика поллера)",
+	multiprocess_mode="livemax",
+)
+
+POLL_TICK_SECONDS = Gauge(
+	"livephoto_poll_tick_seconds",
+	"Длительность последнего тика поллера fal",
+	multiprocess_mode="livemax",
+)
+
+VIDEO_FETCHES = Counter(
+	"livephoto_video_fetches_total",
+	"Получение видео результата у fal: hit (кэш на диске), shared (ждали чужую закачку), miss",
+	["outcome"],
+)
+
+CIRCUIT_STATE = Gauge(
+	"livephoto_circuit_state",
+	"Состояние circuit breaker зависимости: 0 — closed, 1 — half_open, 2 — open",
+	["dependency"],
+	multiprocess_mode="livemax",
+)
+
+EXECUTOR_INFLIGHT = Gauge(
+	"livephoto_executor_inflight",
+	"Блокирующие вызовы в пуле потоков зависимости (выполняются + ждут в очереди)",
+	["pool"],
+	multiprocess_mode="livesum",
+)
+
+EXECUTOR_WAIT_SECONDS = Histogram(
+	"livephoto_executor_wait_seconds",
+	"Ожидание свободного потока в пуле зависимости",
+	["pool"],
+	buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+ADMISSION_DECISIONS = Counter(
+	"livephoto_admission_decisions_total",
+	"Допуск к дорогим маршрутам: admitted, rate_limited_user/ip, shed_queue_full/timeout",
+	["route", "outcome"],
+)
+
+ADMISSION_QUEUE = Gauge(
+	"livephoto_admission_queue",
+	"Запросы дорогих маршрутов, ждущие свободного слота",
+	multiprocess_mode="livesum",
+)
+
+FAL_ROUTED = Counter(
+	"livephoto_fal_routed_total",
+	"Маршрутизация задач по эндпоинтам fal: submitted, failover, saturated (пропущен из-за предела)",
+	["endpoint", "outcome"],
+)
+
+SCHEDULER_QUEUE = Gauge(
+	"livephoto_scheduler_queue",
+	"Задачи генерации, ждущие потока планировщика, по полосам",
+	["lane"],
+	multiprocess_mode="livesum",
+)
+
+SCHEDULER_WAIT_SECONDS = Histogram(
+	"livephoto_scheduler_wait_seconds",
+	"Ожидание задачи в полосе планировщика до начала выполнения",
+	["lane"],
+	buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+)
+
+SCHEDULER_TASKS = Counter(
+	"livephoto_scheduler_tasks_total",
+	"Задачи планировщика по полосам: fair (по очереди WFQ), aged (защита от голодания)",
+	["lane", "pick"],
+)
+
+RECOVERED_WORK = Counter(
+	"livephoto_recovered_work_total",
+	"Подхваченная после остановки/падения процесса работа: submit (постановка в fal), notify (письмо)",
+	["kind"],
+)
+
+HTTP_REQUEST_SECONDS = Histogram(
+	"livephoto_http_request_duration_seconds",
+	"Длительность обработки HTTP-запросов по маршрутам FastAPI",
+	["method", "route", "status"],
+)
+
+
+@contextmanager
+def track_call(dependency: str, operation: str) -> Iterator[None]:
+	"""Замеряет исходящий вызов: with track_call("fal", "submit"): ..."""
+	start = time.perf_counter()
+	outcome = "error"
+	try:
+		yield
+		outcome = "ok"
+	finally:
+		EXTERNAL_CALL_SECONDS.labels(dependency, operation, outcome).observe(time.perf_counter() - start)
+
+
+def webhook_event(source: str, outcome: str) -> None:
+	WEBHOOK_EVENTS.labels(source, outcome).inc()
+
+
+def render_latest() -> Tuple[bytes, str]:
+	"""Текст метрик в формате Prometheus (с агрегацией по процессам, если включено)."""
+	if MULTIPROC_DIR:
+		registry = CollectorRegistry()
+		multiprocess.MultiProcessCollector(registry)
+		return generate_latest(registry), CONTENT_TYPE_LATEST
+	return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead() -> None:
+	"""Убирает live-gauge текущего процесса при остановке воркера."""
+	if MULTIPROC_DIR:
+		multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,127 @@
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.utils.sqlite_utils import ThreadLocalSqlite
+
+
+# Колонки дневного агрегата (все — суммы, поэтому дни складываются в итог диапазона)
+COUNTERS = (
+	"orders",
+	"paid",
+	"revenue_rub",
+	"items_succeeded",
+	"items_failed",
+	"generation_seconds_sum",
+	"generation_count",
+)
+_FRACTIONAL = ("revenue_rub", "generation_seconds_sum")
+
+
+def _parse_dt(value: Any) -> Optional[datetime]:
+	if not value:
+		return None
+	try:
+		return datetime.fromisoformat(str(value)).replace(tzinfo=None)
+	except ValueError:
+		return None
+
+
+def _generation_seconds(order: dict) -> Optional[float]:
+	"""От оплаты (конец отрезка payment, иначе created_at) до завершения генерации."""
+	completed = _parse_dt((order.get("generation") or {}).get("completed_at"))
+	if completed is None:
+		return None
+	start = None
+	for span in ((order.get("trace") or {}).get("spans") or []):
+		if span.get("name") == "payment":
+			start = _parse_dt(span.get("end"))
+			break
+	start = start or _parse_dt(order.get("created_at"))
+	if start is None or completed < start:
+		return None
+	return (completed - start).total_seconds()
+
+
+def day_aggregate(orders: Iterable[dict]) -> Dict[str, float]:
+	"""Агрегат по заявкам одного дня."""
+	agg: Dict[str, float] = dict.fromkeys(COUNTERS, 0)
+	for order in orders:
+		agg["orders"] += 1
+		if (order.get("payment") or {}).get("status") == "paid":
+			agg["paid"] += 1
+			try:
+				agg["revenue_rub"] += float(order.get("price_rub") or 0)
+			except (TypeError, ValueError):
+				pass
+		for item in ((order.get("generation") or {}).get("items") or []):
+			status = item.get("status")
+			if status == "succeeded":
+				agg["items_succeeded"] += 1
+			elif status == "failed":
+				agg["items_failed"] += 1
+		seconds = _generation_seconds(order)
+		if seconds is not None:
+			agg["generation_seconds_sum"] += seconds
+			agg["generation_count"] += 1
+	agg["revenue_rub"] = round(agg["revenue_rub"], 2)
+	return agg
+
+
+def with_averages(row: Dict[str, Any]) -> Dict[str, Any]:
+	count = row.get("generation_count") or 0
+	row["avg_generation_seconds"] = round(row["generation_seconds_sum"] / count, 1) if count else None
+	return row
+
+
+class DailyStats:
+	"""Дневные агрегаты заявок в sqlite; строка дня пересчитывается при каждой записи этого дня.
+
+	Хранилище и так держит весь день в памяти при записи, поэтому пересчёт строки не требует
+	чтения файлов, а отчёт за диапазон — это чтение готовых строк, без обхода дневных файлов.
+	"""
+
+	_SCHEMA_VERSION = 1
+
+	def __init__(self, path: str) -> None:
+		self.path = path
+		columns = ", ".join(f"{c} REAL NOT NULL DEFAULT 0" for c in COUNTERS)
+		self._db = ThreadLocalSqlite(path, (
+			f"CREATE TABLE IF NOT EXISTS daily_stats (day TEXT PRIMARY KEY, {columns}, updated_at TEXT)",
+		))
+
+	@property
+	def built(self) -> bool:
+		return self._db.conn().execute("PRAGMA user_version").fetchone()[0] >= self._SCHEMA_VERSION
+
+	def put(self, day: str, agg: Dict[str, float]) -> None:
+		names = ", ".join(COUNTERS)
+		marks = ", ".join("?" for _ in COUNTERS)
+		self._db.conn().execute(
+			f"INSERT OR REPLACE INTO daily_stats (day, {names}, updated_at) VALUES (?, {marks}, ?)",
+			(day, *(agg.get(c, 0) for c in COUNTERS), datetime.utcnow().isoformat()),
+		)
+
+	def rebuild(self, days: Iterable[Tuple[str, Iterable[dict]]]) -> int:
+		"""Пересчитывает строки по всем дням хранилища (однократно при первом запуске)."""
+		count = 0
+		for day, orders in days:
+			self.put(day, day_aggregate(orders))
+			count += 1
+		self._db.conn().execute(f"PRAGMA user_version = {self._SCHEMA_VERSION}")
+		return count
+
+	def range(self, date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict[str, Any]:
+		"""Строки дней в [date_from, date_to] и итог по диапазону."""
+		rows = self._db.conn().execute(
+			f"SELECT day, {', '.join(COUNTERS)} FROM daily_stats WHERE day >= ? AND day <= ? ORDER BY day",
+			(date_from or "0000-00-00", date_to or "9999-99-99"),
+		).fetchall()
+		days: List[Dict[str, Any]] = []
+		total: Dict[str, Any] = dict.fromkeys(COUNTERS, 0)
+		for row in rows:
+			entry = {"day": row[0], **{c: (row[i + 1] if c in _FRACTIONAL else int(row[i + 1])) for i, c in enumerate(COUNTERS)}}
+			for c in COUNTERS:
+				total[c] += entry[c]
+			days.append(with_averages(entry))
+		total["revenue_rub"] = round(total["revenue_rub"], 2)
+		return {"days": days, "total": with_averages(total)}
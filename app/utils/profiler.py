@@ -0,0 +1,89 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Optional
+
+
+class SamplingProfiler:
+	"""Сэмплирующий профайлер: периодически снимает стеки всех потоков (sys._current_frames).
+
+	Результат — collapsed stacks ("thread;outer;...;inner count"), совместимый с flamegraph.pl,
+	speedscope и inferno. Внешние зависимости не нужны, накладные расходы — один снимок стеков на интервал.
+	"""
+
+	def __init__(self, interval: float = 0.005, max_depth: int = 128) -> None:
+		self.interval = max(0.001, interval)
+		self.max_depth = max_depth
+		self.samples: Counter[str] = Counter()
+		self.sample_count = 0
+		self._stop = threading.Event()
+		self._thread: Optional[threading.Thread] = None
+
+	@staticmethod
+	def _frame_label(frame) -> str:
+		code = frame.f_code
+		return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+	def _sample_once(self) -> None:
+		own = threading.get_ident()
+		names: Dict[int, str] = {t.ident: t.name for t in threading.enumerate() if t.ident is not None}
+		for tid, frame in sys._current_frames().items():
+			if tid == own:
+				continue
+			stack = []
+			depth = 0
+			while frame is not None and depth < self.max_depth:
+				stack.append(self._frame_label(frame))
+				frame = frame.f_back
+				depth += 1
+			stack.append(names.get(tid, f"thread-{tid}"))
+			self.samples[";".join(reversed(stack))] += 1
+		self.sample_count += 1
+
+	def _run(self) -> None:
+		while not self._stop.is_set():
+			self._sample_once()
+			self._stop.wait(self.interval)
+
+	def start(self) -> "SamplingProfiler":
+		self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+		self._thread.start()
+		return self
+
+	def stop(self) -> "SamplingProfiler":
+		self._stop.set()
+		if self._thread is not None:
+			self._thread.join(timeout=5)
+		return self
+
+	def collapsed(self) -> str:
+		return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+# Одновременно — не более одной сессии профилирования по эндпоинту
+_session_lock = threading.Lock()
+
+
+def profile_for(seconds: float, interval: float = 0.005) -> Optional[str]:
+	"""Профилирует процесс seconds секунд и возвращает collapsed stacks; None — если уже идёт сессия."""
+	if not _session_lock.acquire(blocking=False):
+		return None
+	try:
+		profiler = SamplingProfiler(interval=interval).start()
+		time.sleep(seconds)
+		return profiler.stop().collapsed()
+	finally:
+		_session_lock.release()
+
+
+def save_profile(collapsed: str, profiles_dir: str, label: str = "request") -> str:
+	"""Сохраняет collapsed stacks в profiles_dir и возвращает имя файла."""
+	os.makedirs(profiles_dir, exist_ok=True)
+	safe_label = "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in label)[:64]
+	name = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{safe_label}.collapsed"
+	with open(os.path.join(profiles_dir, name), "w", encoding="utf-8") as f:
+		f.write(collapsed)
+	return name
@@ -0,0 +1,222 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from app.utils.metrics import CIRCUIT_STATE, track_call
+
+
+# --- Дедлайны: бюджет времени входящего запроса передаётся во все исходящие вызовы ---
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+	"""Бюджет времени запроса исчерпан до исходящего вызова."""
+
+
+@contextmanager
+def deadline(seconds: Optional[float]) -> Iterator[None]:
+	"""Ограничивает исходящие вызовы внутри блока; вложенный дедлайн не может быть позже внешнего."""
+	if seconds is None:
+		yield
+		return
+	new = time.monotonic() + seconds
+	current = _deadline.get()
+	token = _deadline.set(new if current is None else min(current, new))
+	try:
+		yield
+	finally:
+		_deadline.reset(token)
+
+
+def clear_deadline() -> None:
+	"""Снимает дедлайн в текущем контексте: фоновая работа не наследует бюджет запроса, поставившего её."""
+	_deadline.set(None)
+
+
+def remaining() -> Optional[float]:
+	current = _deadline.get()
+	return None if current is None else current - time.monotonic()
+
+
+def timeout_for(default: float) -> float:
+	"""Таймаут исходящего вызова: default, но не дольше остатка дедлайна."""
+	left = remaining()
+	if left is None:
+		return default
+	if left <= 0:
+		raise DeadlineExceeded("request deadline exceeded")
+	return max(0.05, min(default, left))
+
+
+# --- Circuit breaker ---
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(RuntimeError):
+	"""Зависимость признана недоступной: вызов отклонён без обращения к ней."""
+
+	def __init__(self, dependency: str, retry_after: float) -> None:
+		super().__init__(f"{dependency}: circuit open, retry in {retry_after:.0f}s")
+		self.dependency = dependency
+		self.retry_after = retry_after
+
+
+class CircuitBreaker:
+	"""closed -> (failure_threshold подряд неудач) -> open -> (reset_timeout) -> half_open.
+
+	В half_open пропускается не больше half_open_max пробных вызовов: успех закрывает цепь,
+	неудача снова открывает её на reset_timeout.
+	"""
+
+	def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0, half_open_max: int = 1) -> None:
+		self.name = name
+		self.failure_threshold = failure_threshold
+		self.reset_timeout = reset_timeout
+		self.half_open_max = half_open_max
+		self._lock = threading.Lock()
+		self._state = CLOSED
+		self._failures = 0
+		self._opened_at = 0.0
+		self._probes = 0
+		self._last_error: Optional[str] = None
+		CIRCUIT_STATE.labels(name).set(0)
+
+	def _set_state(self, state: str) -> None:
+		self._state = state
+		CIRCUIT_STATE.labels(self.name).set(_STATE_VALUE[state])
+
+	@property
+	def state(self) -> str:
+		with self._lock:
+			if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+				return HALF_OPEN
+			return self._state
+
+	def allow(self) -> None:
+		"""Бросает CircuitOpenError, если вызов сейчас делать нельзя."""
+		with self._lock:
+			if self._state == OPEN:
+				waited = time.monotonic() - self._opened_at
+				if waited < self.reset_timeout:
+					raise CircuitOpenError(self.name, self.reset_timeout - waited)
+				self._set_state(HALF_OPEN)
+				self._probes = 0
+			if self._state == HALF_OPEN:
+				if self._probes >= self.half_open_max:
+					raise CircuitOpenError(self.name, self.reset_timeout)
+				self._probes += 1
+
+	def release_probe(self) -> None:
+		"""Пробный вызов в half_open не состоялся — возвращаем слот."""
+		with self._lock:
+			if self._state == HALF_OPEN and self._probes > 0:
+				self._probes -= 1
+
+	def record_success(self) -> None:
+		with self._lock:
+			self._failures = 0
+			if self._state != CLOSED:
+				self._set_state(CLOSED)
+
+	def record_failure(self, error: Optional[BaseException] = None) -> None:
+		with self._lock:
+			self._failures += 1
+			self._last_error = repr(error) if error is not None else None
+			if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+				self._set_state(OPEN)
+				self._opened_at = time.monotonic()
+
+	def snapshot(self) -> Dict[str, object]:
+		state = self.state
+		with self._lock:
+			return {
+				"state": state,
+				"consecutive_failures": self._failures,
+				"open_for_seconds": round(time.monotonic() - self._opened_at, 1) if self._state == OPEN else None,
+				"last_error": self._last_error,
+			}
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+# Порог и время восстановления по зависимостям: fal и YooKassa медленные и дорогие при деградации
+_DEFAULTS = {
+	"fal": {"failure_threshold": 5, "reset_timeout": 60.0},
+	"s3": {"failure_threshold": 5, "reset_timeout": 15.0},
+	"yookassa": {"failure_threshold": 3, "reset_timeout": 30.0},
+	"smtp": {"failure_threshold": 3, "reset_timeout": 60.0},
+}
+
+
+def breaker(dependency: str) -> CircuitBreaker:
+	b = _breakers.get(dependency)
+	if b is None:
+		with _breakers_lock:
+			b = _breakers.get(dependency)
+			if b is None:
+				# "fal:{endpoint}" — эндпоинты пула fal с параметрами зависимости fal
+				defaults = _DEFAULTS.get(dependency) or _DEFAULTS.get(dependency.split(":", 1)[0], {})
+				b = _breakers[dependency] = CircuitBreaker(dependency, **defaults)
+	return b
+
+
+def breaker_states() -> Dict[str, Dict[str, object]]:
+	for dependency in _DEFAULTS:
+		breaker(dependency)
+	return {name: b.snapshot() for name, b in sorted(_breakers.items())}
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+	response = getattr(exc, "response", None)
+	code = getattr(response, "status_code", None)  # requests.HTTPError
+	if code is None and isinstance(response, dict):  # botocore ClientError
+		code = (response.get("ResponseMetadata") or {}).get("HTTPStatusCode")
+	if code is None:
+		code = getattr(exc, "smtp_code", None)  # smtplib.SMTPResponseException
+		if isinstance(code, int):
+			# 4xx SMTP — временная ошибка сервера, 5xx — постоянный отказ по письму
+			return 503 if 400 <= code < 500 else 400
+	return code if isinstance(code, int) else None
+
+
+def is_transient(exc: BaseException) -> bool:
+	"""Ошибка зависимости, которая может пройти сама: сеть, таймаут, 5xx/429, открытая цепь."""
+	if isinstance(exc, (CircuitOpenError, DeadlineExceeded, TimeoutError, ConnectionError)):
+		return True
+	code = _status_code(exc)
+	if code is not None:
+		return code >= 500 or code == 429
+	name = type(exc).__name__
+	# requests/urllib3/botocore: ConnectionError, ReadTimeout, EndpointConnectionError и т.п.
+	return any(part in name for part in ("Timeout", "Connection", "Endpoint"))
+
+
+@contextmanager
+def guarded(dependency: str, operation: str) -> Iterator[None]:
+	"""Исходящий вызов под circuit breaker зависимости (+ метрика track_call).
+
+	Цепь размыкают только ошибки самой зависимости (is_transient); ответы 4xx на наш запрос
+	считаются успешным обменом.
+	"""
+	b = breaker(dependency)
+	b.allow()
+	try:
+		with track_call(dependency, operation):
+			yield
+	except DeadlineExceeded:
+		# бюджет кончился у нас, а не у зависимости — на состояние цепи не влияет
+		b.release_probe()
+		raise
+	except Exception as e:
+		if is_transient(e):
+			b.record_failure(e)
+		else:
+			b.record_success()
+		raise
+	b.record_success()
@@ -1,19 +1,48 @@
 import os
 import mimetypes
+import threading
 from typing import BinaryIO, Optional
-import boto3
 
 from app.config import settings
+from app.utils.metrics import track_call
+from app.utils.resilience import guarded, timeout_for
+
+
+_client_lock = threading.Lock()
+_client = None
 
 
 def _s3_client():
-	return boto3.client(
-		"s3",
-		endpoint_url=settings.s3_endpoint_url,
-		aws_access_key_id=settings.s3_access_key_id,
-		aws_secret_access_key=settings.s3_secret_access_key,
-		region_name=settings.s3_region_name,
-	)
+	"""Общий клиент S3: boto3 импортируется и клиент создаётся при первом обращении.
+
+	Клиенты boto3 потокобезопасны, поэтому один экземпляр (и его пул соединений) делим между потоками.
+	Таймауты задаются на клиенте: boto3 не принимает таймаут на отдельный вызов, поэтому бюджет
+	запроса только проверяется перед вызовом (_check_deadline).
+	"""
+	global _client
+	if _client is None:
+		with _client_lock:
+			if _client is None:
+				import boto3
+				from botocore.config import Config
+				_client = boto3.client(
+					"s3",
+					endpoint_url=settings.s3_endpoint_url,
+					aws_access_key_id=settings.s3_access_key_id,
+					aws_secret_access_key=settings.s3_secret_access_key,
+					region_name=settings.s3_region_name,
+					config=Config(
+						connect_timeout=settings.s3_connect_timeout_seconds,
+						read_timeout=settings.s3_read_timeout_seconds,
+						retries={"total_max_attempts": max(1, settings.s3_max_attempts), "mode": "standard"},
+					),
+				)
+	return _client
+
+
+def _check_deadline() -> None:
+	"""DeadlineExceeded, если бюджет запроса уже исчерпан: вызов S3 не начинаем."""
+	timeout_for(settings.s3_read_timeout_seconds)
 
 
 def s3_key_for_upload(anon_user_id: str, request_id: str, filename: str) -> str:
@@ -27,17 +56,20 @@ def s3_key_for_video(anon_user_id: str, request_id: str, index: int, ext: str =
 def upload_bytes(bucket: str, key: str, data: bytes, content_type: Optional[str] = None) -> None:
 	client = _s3_client()
 	ct = content_type or mimetypes.guess_type(key)[0] or "application/octet-stream"
-	client.put_object(Bucket=bucket, Key=key, Body=data, ContentType=ct)
+	with guarded("s3", "put"):
+		_check_deadline()
+		client.put_object(Bucket=bucket, Key=key, Body=data, ContentType=ct)
 
 
 def presigned_get_url(bucket: str, key: str, expires: Optional[int] = None) -> str:
 	client = _s3_client()
 	exp = expires or settings.s3_presign_ttl_seconds
-	return client.generate_presigned_url(
-		"get_object",
-		Params={"Bucket": bucket, "Key": key},
-		ExpiresIn=exp,
-	)
+	with track_call("s3", "presign"):
+		return client.generate_presigned_url(
+			"get_object",
+			Params={"Bucket": bucket, "Key": key},
+			ExpiresIn=exp,
+		)
 
 
 def get_file_url(bucket: str, key: str, expires: Optional[int] = None) -> str:
@@ -70,3 +102,78 @@ def parse_s3_url(url: str) -> tuple[str, str]:
 	return bucket, key
 
 
+
+
+def list_keys(bucket: str, prefix: str) -> list[tuple[str, int]]:
+	"""Все объекты под префиксом: [(key, size)] (постранично через list_objects_v2)."""
+	client = _s3_client()
+	result: list[tuple[str, int]] = []
+	token: Optional[str] = None
+	while True:
+		params = {"Bucket": bucket, "Prefix": prefix}
+		if token:
+			params["ContinuationToken"] = token
+		with guarded("s3", "list"):
+			_check_deadline()
+			resp = client.list_objects_v2(**params)
+		result.extend((obj["Key"], int(obj.get("Size") or 0)) for obj in resp.get("Contents") or [])
+		if not resp.get("IsTruncated"):
+			return result
+		token = resp.get("NextContinuationToken")
+
+
+DELETE_BATCH_SIZE = 1000  # предел S3 DeleteObjects
+
+
+def delete_keys(bucket: str, keys: list[str]) -> tuple[list[str], list[dict]]:
+	"""Удаляет объекты пачками по 1000 ключей. Возвращает (удалённые ключи, ошибки S3)."""
+	client = _s3_client()
+	deleted: list[str] = []
+	errors: list[dict] = []
+	for start in range(0, len(keys), DELETE_BATCH_SIZE):
+		batch = keys[start:start + DELETE_BATCH_SIZE]
+		with guarded("s3", "delete"):
+			_check_deadline()
+			resp = client.delete_objects(
+				Bucket=bucket,
+				Delete={"Objects": [{"Key": k} for k in batch], "Quiet": False},
+			)
+		deleted.extend(d["Key"] for d in resp.get("Deleted") or [])
+		errors.extend({"key": e.get("Key"), "code": e.get("Code"), "message": e.get("Message")} for e in resp.get("Errors") or [])
+	return deleted, errors
+
+
+def is_not_found(exc: BaseException) -> bool:
+	"""Объекта нет в S3 (botocore ClientError с кодом 404/NoSuchKey/NotFound)."""
+	resp = getattr(exc, "response", None)
+	return isinstance(resp, dict) and str((resp.get("Error") or {}).get("Code")) in ("404", "NoSuchKey", "NotFound")
+
+
+def head_object(bucket: str, key: str) -> dict:
+	"""Метаданные объекта: size, etag, last_modified (datetime), content_type."""
+	client = _s3_client()
+	with guarded("s3", "head"):
+		_check_deadline()
+		resp = client.head_object(Bucket=bucket, Key=key)
+	return {
+		"size": int(resp.get("ContentLength") or 0),
+		"etag": resp.get("ETag"),
+		"last_modified": resp.get("LastModified"),
+		"content_type": resp.get("ContentType"),
+	}
+
+
+def iter_object(bucket: str, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = 64 * 1024):
+	"""Потоково читает объект (или диапазон байт [start, end]) кусками по chunk_size."""
+	client = _s3_client()
+	params = {"Bucket": bucket, "Key": key}
+	if start or end is not None:
+		params["Range"] = f"bytes={start}-{'' if end is None else end}"
+	with guarded("s3", "get"):
+		_check_deadline()
+		resp = client.get_object(**params)
+	body = resp["Body"]
+	try:
+		yield from body.iter_chunks(chunk_size)
+	finally:
+		body.close()
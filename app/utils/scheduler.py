@@ -0,0 +1,204 @@
+"""Приоритетный планировщик работы по генерации: постановка в fal, опрос статусов, перекладка видео.
+
+Полосы (lanes) задаются SCHEDULER_LANES — список через запятую, элемент `имя[@вес]`, например
+`first@4,standard@2,retry@1,bulk@1`. Свободный поток берёт задачу из полосы по взвешенной
+справедливой очереди (WFQ): у задачи метка окончания `max(V, последняя метка полосы) + 1/вес`,
+выполняется задача с наименьшей меткой, поэтому при загрузке полосы получают потоки пропорционально
+весам, а пустая полоса не копит «кредит». Защита от голодания: задача, ждущая дольше
+SCHEDULER_MAX_WAIT_SECONDS, выполняется раньше остальных независимо от метки.
+"""
+import asyncio
+import collections
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional, TypeVar
+
+from app.utils.metrics import SCHEDULER_QUEUE, SCHEDULER_TASKS, SCHEDULER_WAIT_SECONDS
+from app.utils.resilience import clear_deadline
+
+
+T = TypeVar("T")
+
+
+def parse_lanes(spec: Optional[str]) -> Dict[str, float]:
+	lanes: Dict[str, float] = {}
+	for part in (spec or "").split(","):
+		part = part.strip()
+		if not part:
+			continue
+		weight = 1.0
+		if "@" in part:
+			part, _, raw_weight = part.rpartition("@")
+			weight = float(raw_weight)
+		lanes[part.strip()] = max(0.001, weight)
+	return lanes or {"standard": 1.0}
+
+
+@dataclass(slots=True)
+class _Task:
+	fn: Callable[[], Any]
+	future: Future
+	lane: str
+	finish: float
+	enqueued: float = field(default_factory=time.monotonic)
+
+
+class WorkScheduler:
+	"""Пул потоков с очередями-полосами; submit() возвращает concurrent.futures.Future."""
+
+	def __init__(self, lanes: Dict[str, float], workers: int, max_wait_seconds: float, default_lane: Optional[str] = None) -> None:
+		self.lanes = dict(lanes)
+		self.workers = max(1, workers)
+		self.max_wait_seconds = max_wait_seconds
+		self.default_lane = default_lane if default_lane in self.lanes else next(iter(self.lanes))
+		self._queues: Dict[str, Deque[_Task]] = {name: collections.deque() for name in self.lanes}
+		self._last_finish: Dict[str, float] = dict.fromkeys(self.lanes, 0.0)
+		self._virtual = 0.0
+		self._cond = threading.Condition()
+		self._threads: List[threading.Thread] = []
+		self._busy = 0
+		self._stopped = False
+
+	def lane(self, name: Optional[str]) -> str:
+		"""Имя настроенной полосы; неизвестные уходят в полосу по умолчанию."""
+		return name if name in self._queues else self.default_lane
+
+	def submit(self, lane: Optional[str], fn: Callable[..., T], *args: Any, **kwargs: Any) -> "Future[T]":
+		"""Ставит fn в полосу; контекст вызова копируется в поток, кроме дедлайна запроса.
+
+		Задача может ждать в полосе дольше бюджета запроса (или пережить сам запрос), поэтому
+		исходящие вызовы в ней ограничены только собственными таймаутами.
+		"""
+		lane = self.lane(lane)
+		ctx = contextvars.copy_context()
+		ctx.run(clear_deadline)
+		future: Future = Future()
+		with self._cond:
+			if self._stopped:
+				raise RuntimeError("scheduler is stopped")
+			finish = max(self._virtual, self._last_finish[lane]) + 1.0 / self.lanes[lane]
+			self._last_finish[lane] = finish
+			self._queues[lane].append(_Task(lambda: ctx.run(functools.partial(fn, *args, **kwargs)), future, lane, finish))
+			SCHEDULER_QUEUE.labels(lane).inc()
+			self._ensure_threads()
+			self._cond.notify()
+		return future
+
+	async def run(self, lane: Optional[str], fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+		"""Как submit(), но ожидание — в event loop."""
+		return await asyncio.wrap_future(self.submit(lane, fn, *args, **kwargs))
+
+	def _ensure_threads(self) -> None:
+		# потоки создаются по мере надобности, но не больше workers (под self._cond)
+		queued = sum(len(q) for q in self._queues.values())
+		if self._busy + queued <= len(self._threads) or len(self._threads) >= self.workers:
+			return
+		t = threading.Thread(target=self._worker, name=f"sched-{len(self._threads)}", daemon=True)
+		self._threads.append(t)
+		t.start()
+
+	def _pending_heads(self) -> List[_Task]:
+		return [q[0] for q in self._queues.values() if q]
+
+	def _next(self) -> Optional[_Task]:
+		heads = self._pending_heads()
+		if not heads:
+			return None
+		oldest = min(heads, key=lambda t: t.enqueued)
+		if time.monotonic() - oldest.enqueued >= self.max_wait_seconds:
+			task = oldest
+		else:
+			task = min(heads, key=lambda t: t.finish)
+		self._queues[task.lane].popleft()
+		self._virtual = max(self._virtual, task.finish)
+		return task
+
+	def _worker(self) -> None:
+		while True:
+			with self._cond:
+				task = self._next()
+				while task is None:
+					if self._stopped:
+						return
+					self._cond.wait()
+					task = self._next()
+				self._busy += 1
+			SCHEDULER_QUEUE.labels(task.lane).dec()
+			waited = time.monotonic() - task.enqueued
+			SCHEDULER_WAIT_SECONDS.labels(task.lane).observe(waited)
+			SCHEDULER_TASKS.labels(task.lane, "aged" if waited >= self.max_wait_seconds else "fair").inc()
+			try:
+				if task.future.set_running_or_notify_cancel():
+					try:
+						task.future.set_result(task.fn())
+					except BaseException as e:
+						task.future.set_exception(e)
+			finally:
+				with self._cond:
+					self._busy -= 1
+					self._cond.notify_all()
+
+	def stats(self) -> Dict[str, Any]:
+		with self._cond:
+			return {
+				"workers": self.workers,
+				"busy": self._busy,
+				"lanes": {
+					name: {"weight": self.lanes[name], "queued": len(q)}
+					for name, q in self._queues.items()
+				},
+			}
+
+	def drain(self, timeout: float) -> int:
+		"""Перестаёт принимать задачи и до timeout секунд выполняет уже поставленные.
+
+		Не начатые к сроку задачи отменяются (их Future — CancelledError); возвращает их число.
+		"""
+		until = time.monotonic() + max(0.0, timeout)
+		with self._cond:
+			self._stopped = True
+			self._cond.notify_all()
+			while self._busy or any(self._queues.values()):
+				left = until - time.monotonic()
+				if left <= 0:
+					break
+				self._cond.wait(left)
+		return self.shutdown()
+
+	def shutdown(self, cancel_pending: bool = True) -> int:
+		"""Останавливает потоки после текущих задач; ожидающие задачи отменяются, возвращает их число."""
+		cancelled = 0
+		with self._cond:
+			self._stopped = True
+			if cancel_pending:
+				for name, q in self._queues.items():
+					while q:
+						q.popleft().future.cancel()
+						SCHEDULER_QUEUE.labels(name).dec()
+						cancelled += 1
+			self._cond.notify_all()
+		return cancelled
+
+
+_scheduler: Optional[WorkScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def scheduler() -> WorkScheduler:
+	global _scheduler
+	if _scheduler is None:
+		with _scheduler_lock:
+			if _scheduler is None:
+				from app.config import settings
+
+				_scheduler = WorkScheduler(
+					parse_lanes(settings.scheduler_lanes),
+					workers=settings.scheduler_workers,
+					max_wait_seconds=settings.scheduler_max_wait_seconds,
+					default_lane="standard",
+				)
+	return _scheduler
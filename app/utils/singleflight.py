@@ -0,0 +1,84 @@
+import hashlib
+import os
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+try:
+	import fcntl
+except ImportError:  # не-POSIX: схлопывание только внутри процесса
+	fcntl = None
+
+
+def lock_shard(key: Hashable, shards: int) -> int:
+	"""Номер файла блокировки для ключа: sha1(repr(key)) по модулю shards (одинаков во всех процессах)."""
+	return int.from_bytes(hashlib.sha1(repr(key).encode("utf-8")).digest()[:8], "big") % max(1, shards)
+
+
+class _Call:
+	__slots__ = ("done", "result", "error")
+
+	def __init__(self) -> None:
+		self.done = threading.Event()
+		self.result: Any = None
+		self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+	"""Схлопывание одновременных вызовов по ключу (как golang.org/x/sync/singleflight).
+
+	Первый вызов do(key, fn) выполняет fn, остальные с тем же ключом ждут и получают тот же
+	результат (или то же исключение). После завершения ключ освобождается: следующий вызов
+	снова выполнит fn — кэширование результата остаётся за вызывающей стороной.
+
+	lock_dir — расширение между процессами: ведущий вызов держит fcntl.flock на
+	{lock_dir}/{sha1(key) % lock_shards:02x}.lock, поэтому ведущие разных процессов выполняют fn
+	по очереди. Файлов блокировок не больше lock_shards (они не удаляются — удаление файла под
+	чужим flock ломает взаимное исключение); разные ключи одного файла тоже идут по очереди.
+	Результат между процессами не передаётся: fn должна сама проверить, не сделана ли уже
+	работа (например, перечитать заявку), и в этом случае просто вернуть готовое.
+	"""
+
+	def __init__(self, lock_dir: Optional[str] = None, lock_shards: int = 256) -> None:
+		self._lock = threading.Lock()
+		self._calls: Dict[Hashable, _Call] = {}
+		self.lock_dir = lock_dir if fcntl is not None else None
+		self.lock_shards = max(1, lock_shards)
+		if self.lock_dir:
+			os.makedirs(self.lock_dir, exist_ok=True)
+
+	def _run_locked(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+		if not self.lock_dir:
+			return fn()
+		with open(os.path.join(self.lock_dir, f"{lock_shard(key, self.lock_shards):02x}.lock"), "a") as lf:
+			fcntl.flock(lf.fileno(), fcntl.LOCK_EX)
+			try:
+				return fn()
+			finally:
+				fcntl.flock(lf.fileno(), fcntl.LOCK_UN)
+
+	def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+		"""(результат, shared): shared=True — fn выполнял другой вызывающий, этот только ждал."""
+		with self._lock:
+			call = self._calls.get(key)
+			leader = call is None
+			if leader:
+				call = self._calls[key] = _Call()
+		if not leader:
+			call.done.wait()
+			if call.error is not None:
+				raise call.error
+			return call.result, True
+		try:
+			call.result = self._run_locked(key, fn)
+		except BaseException as e:
+			call.error = e
+			raise
+		finally:
+			with self._lock:
+				self._calls.pop(key, None)
+			call.done.set()
+		return call.result, False
+
+	def inflight(self) -> int:
+		with self._lock:
+			return len(self._calls)
@@ -0,0 +1,30 @@
+import os
+import sqlite3
+import threading
+from typing import Sequence
+
+
+class ThreadLocalSqlite:
+	"""Соединение sqlite на поток (WAL, autocommit) с созданием схемы при первом подключении.
+
+	Файл общий для потоков и воркеров uvicorn на одной машине; явные транзакции — через
+	BEGIN/COMMIT у вызывающей стороны.
+	"""
+
+	def __init__(self, path: str, schema: Sequence[str] = (), timeout: float = 10.0) -> None:
+		self.path = path
+		self.schema = tuple(schema)
+		self.timeout = timeout
+		self._local = threading.local()
+
+	def conn(self) -> sqlite3.Connection:
+		conn = getattr(self._local, "conn", None)
+		if conn is None:
+			os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+			conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+			conn.execute("PRAGMA journal_mode=WAL")
+			conn.execute("PRAGMA synchronous=NORMAL")
+			for statement in self.schema:
+				conn.execute(statement)
+			self._local.conn = conn
+		return conn
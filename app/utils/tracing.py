@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+
+# Этапы жизненного цикла заявки (в порядке прохождения)
+STAGES = (
+	"create_order",    # загрузка входных файлов в S3 + создание платежа
+	"payment",         # от создания заявки до вебхука об успешной оплате
+	"fal_submit",      # постановка задачи в очередь fal.ai (по элементу)
+	"fal_generation",  # от постановки в очередь до обнаружения результата (по элементу)
+	"s3_rehost",       # скачивание видео у fal и загрузка в наш S3 (по элементу)
+	"email",           # отправка писем (квитанция, ссылки на результат)
+)
+
+_export_lock = threading.Lock()
+
+
+def now() -> datetime:
+	return datetime.utcnow()
+
+
+def _as_datetime(value: datetime | str | None) -> Optional[datetime]:
+	if value is None:
+		return None
+	if isinstance(value, datetime):
+		return value
+	try:
+		return datetime.fromisoformat(value)
+	except Exception:
+		return None
+
+
+def make_span(
+	name: str,
+	start: datetime | str | None,
+	end: datetime | str | None = None,
+	item_index: Optional[int] = None,
+	**attrs: Any,
+) -> Optional[dict]:
+	"""Отрезок этапа с временными метками (UTC, ISO); None — если начало неизвестно."""
+	start_dt = _as_datetime(start)
+	end_dt = _as_datetime(end) or now()
+	if start_dt is None:
+		return None
+	if start_dt.tzinfo is not None:
+		start_dt = start_dt.astimezone(timezone.utc).replace(tzinfo=None)
+	if end_dt.tzinfo is not None:
+		end_dt = end_dt.astimezone(timezone.utc).replace(tzinfo=None)
+	span: Dict[str, Any] = {
+		"name": name,
+		"start": start_dt.isoformat(),
+		"end": end_dt.isoformat(),
+		"duration_ms": round((end_dt - start_dt).total_seconds() * 1000, 1),
+	}
+	if item_index is not None:
+		span["item_index"] = item_index
+	if attrs:
+		span["attrs"] = {k: v for k, v in attrs.items() if v is not None}
+	return span
+
+
+def add_span(order: dict, span: Optional[dict]) -> None:
+	if span:
+		order.setdefault("trace", {}).setdefault("spans", []).append(span)
+
+
+def record_span(
+	order: dict,
+	name: str,
+	start: datetime | str | None,
+	end: datetime | str | None = None,
+	item_index: Optional[int] = None,
+	**attrs: Any,
+) -> Optional[dict]:
+	"""Добавляет в order["trace"]["spans"] отрезок этапа с временными метками (UTC, ISO)."""
+	span = make_span(name, start, end, item_index, **attrs)
+	add_span(order, span)
+	return span
+
+
+def timeline(order: dict) -> Dict[str, Any]:
+	"""Отрезки заявки по времени + суммарная длительность каждого этапа."""
+	spans = sorted(((order.get("trace") or {}).get("spans") or []), key=lambda s: s.get("start") or "")
+	by_stage: Dict[str, float] = {}
+	for sp in spans:
+		by_stage[sp["name"]] = by_stage.get(sp["name"], 0.0) + float(sp.get("duration_ms") or 0)
+	total_ms = None
+	if spans:
+		first = _as_datetime(spans[0].get("start"))
+		last = max((_as_datetime(sp.get("end")) for sp in spans if sp.get("end")), default=None)
+		if first and last:
+			total_ms = round((last - first).total_seconds() * 1000, 1)
+	return {
+		"orderId": order.get("order_id") or order.get("request_id"),
+		"spans": spans,
+		"stages_ms": by_stage,
+		"total_ms": total_ms,
+	}
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+	if not sorted_values:
+		return 0.0
+	idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+	return sorted_values[idx]
+
+
+def stage_report(orders: Iterable[dict]) -> Dict[str, Dict[str, float]]:
+	"""Агрегат p50/p95 (мс) по этапам по набору заявок."""
+	samples: Dict[str, List[float]] = {}
+	for order in orders:
+		for sp in ((order.get("trace") or {}).get("spans") or []):
+			samples.setdefault(sp.get("name") or "unknown", []).append(float(sp.get("duration_ms") or 0))
+	report: Dict[str, Dict[str, float]] = {}
+	for stage in list(STAGES) + sorted(set(samples) - set(STAGES)):
+		values = sorted(samples.get(stage) or [])
+		if not values:
+			continue
+		report[stage] = {
+			"count": len(values),
+			"p50_ms": _percentile(values, 0.50),
+			"p95_ms": _percentile(values, 0.95),
+			"max_ms": values[-1],
+		}
+	return report
+
+
+# --- Экспорт в OTLP/JSON (ExportTraceServiceRequest) ---
+
+def _trace_id(order_id: str) -> str:
+	return hashlib.sha256(order_id.encode()).hexdigest()[:32]
+
+
+def _span_id(*parts: Any) -> str:
+	return hashlib.sha256("|".join(str(p) for p in parts).encode()).hexdigest()[:16]
+
+
+def _unix_nano(value: str | None) -> str:
+	dt = _as_datetime(value)
+	if dt is None:
+		return "0"
+	if dt.tzinfo is None:
+		dt = dt.replace(tzinfo=timezone.utc)
+	return str(int(dt.timestamp() * 1_000_000_000))
+
+
+def _otlp_attr(key: str, value: Any) -> Dict[str, Any]:
+	if isinstance(value, bool):
+		return {"key": key, "value": {"boolValue": value}}
+	if isinstance(value, int):
+		return {"key": key, "value": {"intValue": str(value)}}
+	if isinstance(value, float):
+		return {"key": key, "value": {"doubleValue": value}}
+	return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def to_otlp(order: dict) -> Dict[str, Any]:
+	"""Преобразует отрезки заявки в OTLP/JSON: корневой span "order" + дочерние этапы."""
+	order_id = order.get("order_id") or order.get("request_id") or ""
+	trace_id = _trace_id(order_id)
+	root_id = _span_id(order_id, "order")
+	spans = (order.get("trace") or {}).get("spans") or []
+	tl = timeline(order)
+	otlp_spans: List[Dict[str, Any]] = []
+	if spans:
+		otlp_spans.append({
+			"traceId": trace_id,
+			"spanId": root_id,
+			"name": "order",
+			"kind": 1,
+			"startTimeUnixNano": _unix_nano(tl["spans"][0].get("start")),
+			"endTimeUnixNano": _unix_nano(max(sp.get("end") or "" for sp in spans)),
+			"attributes": [_otlp_attr("order.id", order_id)],
+		})
+	for n, sp in enumerate(spans):
+		attributes = [_otlp_attr("order.id", order_id)]
+		if sp.get("item_index") is not None:
+			attributes.append(_otlp_attr("item.index", int(sp["item_index"])))
+		for k, v in (sp.get("attrs") or {}).items():
+			attributes.append(_otlp_attr(k, v))
+		otlp_spans.append({
+			"traceId": trace_id,
+			"spanId": _span_id(order_id, sp.get("name"), sp.get("item_index"), n),
+			"parentSpanId": root_id,
+			"name": sp.get("name"),
+			"kind": 1,
+			"startTimeUnixNano": _unix_nano(sp.get("start")),
+			"endTimeUnixNano": _unix_nano(sp.get("end")),
+			"attributes": attributes,
+		})
+	return {
+		"resourceSpans": [{
+			"resource": {"attributes": [_otlp_attr("service.name", "livephoto-backend")]},
+			"scopeSpans": [{"scope": {"name": "app.utils.tracing"}, "spans": otlp_spans}],
+		}]
+	}
+
+
+def export_order(order: dict, traces_dir: str = "traces") -> Optional[str]:
+	"""Дописывает трассу заявки строкой OTLP/JSON в traces/{YYYY-MM-DD}.jsonl.
+
+	Формат совместим с file exporter OpenTelemetry Collector (по одному запросу на строку).
+	"""
+	if not ((order.get("trace") or {}).get("spans")):
+		return None
+	try:
+		os.makedirs(traces_dir, exist_ok=True)
+		path = os.path.join(traces_dir, f"{now().date().isoformat()}.jsonl")
+		line = json.dumps(to_otlp(order), ensure_ascii=False, separators=(",", ":"))
+		with _export_lock:
+			with open(path, "a", encoding="utf-8") as f:
+				f.write(line + "\n")
+		return path
+	except Exception:
+		return None
@@ -0,0 +1,79 @@
+import sqlite3
+from typing import Iterable, List, Optional, Tuple
+
+from app.utils.sqlite_utils import ThreadLocalSqlite
+
+
+class UserOrderIndex:
+	"""Вторичный индекс хранилища заявок: anonUserId -> order_id, упорядоченные по created_at.
+
+	Живёт в sqlite рядом с дневными файлами и общий для воркеров (WAL). Пары
+	(anonUserId, created_at) у заявки не меняются, поэтому индекс пополняется только при первом
+	сохранении заявки и чистится при удалении. Запись в индекс идёт раньше записи дня: после сбоя
+	в индексе может остаться лишняя ссылка (читатель её пропускает), но не может пропасть нужная.
+	"""
+
+	_SCHEMA_VERSION = 1
+
+	def __init__(self, path: str) -> None:
+		self.path = path
+		self._db = ThreadLocalSqlite(path, (
+			"CREATE TABLE IF NOT EXISTS user_orders ("
+			" order_id TEXT PRIMARY KEY, anon_user_id TEXT NOT NULL, created_at TEXT NOT NULL)",
+			"CREATE INDEX IF NOT EXISTS user_orders_by_user ON user_orders (anon_user_id, created_at, order_id)",
+		))
+
+	def _conn(self) -> sqlite3.Connection:
+		return self._db.conn()
+
+	@property
+	def built(self) -> bool:
+		"""Индекс заполнен по существующим заявкам (rebuild выполнялся)."""
+		return self._conn().execute("PRAGMA user_version").fetchone()[0] >= self._SCHEMA_VERSION
+
+	def add(self, anon_user_id: Optional[str], created_at: str, order_id: str) -> None:
+		if not anon_user_id or not order_id:
+			return
+		self._conn().execute(
+			"INSERT OR IGNORE INTO user_orders (order_id, anon_user_id, created_at) VALUES (?, ?, ?)",
+			(order_id, anon_user_id, created_at),
+		)
+
+	def remove(self, order_id: str) -> None:
+		self._conn().execute("DELETE FROM user_orders WHERE order_id = ?", (order_id,))
+
+	def page(self, anon_user_id: str, limit: int, after: Optional[Tuple[str, str]] = None) -> List[Tuple[str, str]]:
+		"""До limit пар (created_at, order_id) от новых к старым, строго после курсора after."""
+		if after is None:
+			rows = self._conn().execute(
+				"SELECT created_at, order_id FROM user_orders WHERE anon_user_id = ?"
+				" ORDER BY created_at DESC, order_id DESC LIMIT ?",
+				(anon_user_id, limit),
+			)
+		else:
+			rows = self._conn().execute(
+				"SELECT created_at, order_id FROM user_orders WHERE anon_user_id = ? AND (created_at, order_id) < (?, ?)"
+				" ORDER BY created_at DESC, order_id DESC LIMIT ?",
+				(anon_user_id, after[0], after[1], limit),
+			)
+		return [(r[0], r[1]) for r in rows.fetchall()]
+
+	def rebuild(self, entries: Iterable[Tuple[Optional[str], str, str]]) -> int:
+		"""Заполняет индекс из (anonUserId, created_at, order_id) всех заявок; повторный вызов безопасен."""
+		conn = self._conn()
+		added = 0
+		conn.execute("BEGIN")
+		try:
+			for anon_user_id, created_at, order_id in entries:
+				if anon_user_id and order_id:
+					conn.execute(
+						"INSERT OR IGNORE INTO user_orders (order_id, anon_user_id, created_at) VALUES (?, ?, ?)",
+						(order_id, anon_user_id, created_at),
+					)
+					added += 1
+			conn.execute(f"PRAGMA user_version = {self._SCHEMA_VERSION}")
+			conn.execute("COMMIT")
+		except BaseException:
+			conn.execute("ROLLBACK")
+			raise
+		return added
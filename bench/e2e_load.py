@@ -0,0 +1,315 @@
+"""Сквозной нагрузочный бенчмарк: create_order -> /yookassa/webhook -> fal (poll/webhook) -> /results.
+
+Поднимает заглушки fal/S3/YooKassa/SMTP (bench.stubs), запускает приложение через uvicorn
+в отдельном процессе во временной директории и подаёт поток заявок с заданной частотой.
+Отчёт: пропускная способность, перцентили латентности по шагам и до готового видео,
+RSS процесса приложения, размеры файлов хранилища.
+
+Пример:
+	python -m bench.e2e_load --rate 2 --duration 30 --fal-latency 5 --workers 1 --out bench_e2e.json
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import requests
+
+from bench.stubs import FalStub, SmtpSink, YooKassaStub, _free_port, start_s3
+
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+BUCKET = "livephoto-bench"
+
+# 1x1 PNG
+_PNG = bytes.fromhex(
+	"89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+	"1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082"
+)
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+	if not values:
+		return {"count": 0}
+	vs = sorted(values)
+
+	def q(p: float) -> float:
+		return round(vs[min(len(vs) - 1, int(round(p * (len(vs) - 1))))], 4)
+
+	return {"count": len(vs), "p50": q(0.5), "p90": q(0.9), "p95": q(0.95), "p99": q(0.99), "max": round(vs[-1], 4)}
+
+
+def rss_bytes(pid: int) -> Optional[int]:
+	"""RSS процесса и его дочерних воркеров (Linux /proc)."""
+	total = 0
+	pids = [pid]
+	try:
+		children = subprocess.run(["pgrep", "-P", str(pid)], capture_output=True, text=True).stdout.split()
+		pids.extend(int(c) for c in children)
+	except Exception:
+		pass
+	for p in pids:
+		try:
+			with open(f"/proc/{p}/status", "r") as f:
+				for line in f:
+					if line.startswith("VmRSS:"):
+						total += int(line.split()[1]) * 1024
+		except OSError:
+			continue
+	return total or None
+
+
+def dir_size(path: str) -> Dict[str, Any]:
+	files = 0
+	size = 0
+	for root, _, names in os.walk(path):
+		for n in names:
+			files += 1
+			try:
+				size += os.path.getsize(os.path.join(root, n))
+			except OSError:
+				pass
+	return {"files": files, "bytes": size}
+
+
+class AppProcess:
+	def __init__(self, env: Dict[str, str], workdir: str, port: int, workers: int) -> None:
+		self.env = env
+		self.workdir = workdir
+		self.port = port
+		self.workers = workers
+		self.proc: Optional[subprocess.Popen] = None
+
+	@property
+	def base_url(self) -> str:
+		return f"http://127.0.0.1:{self.port}"
+
+	def start(self, timeout: float = 60.0) -> float:
+		"""Запускает uvicorn и возвращает время до первого успешного ответа (cold start)."""
+		env = {**os.environ, **self.env, "PYTHONPATH": REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", "")}
+		started = time.perf_counter()
+		self.proc = subprocess.Popen(
+			[sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(self.port),
+			 "--workers", str(self.workers), "--log-level", "warning"],
+			cwd=self.workdir,
+			env=env,
+		)
+		deadline = time.monotonic() + timeout
+		while time.monotonic() < deadline:
+			try:
+				r = requests.get(f"{self.base_url}/healthz", timeout=1)
+				if r.status_code == 200:
+					return time.perf_counter() - started
+			except requests.RequestException:
+				time.sleep(0.05)
+		raise RuntimeError("application did not start in time")
+
+	def stop(self) -> None:
+		if self.proc and self.proc.poll() is None:
+			self.proc.terminate()
+			try:
+				self.proc.wait(timeout=15)
+			except subprocess.TimeoutExpired:
+				self.proc.kill()
+
+
+class Flow:
+	"""Один сквозной сценарий клиента."""
+
+	def __init__(self, base_url: str, items: int, results_interval: float, results_timeout: float) -> None:
+		self.base_url = base_url
+		self.items = items
+		self.results_interval = results_interval
+		self.results_timeout = results_timeout
+		self.session = requests.Session()
+
+	def run(self) -> Dict[str, Any]:
+		t: Dict[str, Any] = {"ok": False}
+		anon = f"anon_bench_{uuid.uuid4().hex[:8]}"
+		started = time.perf_counter()
+		files = [("files", (f"img{i}.png", _PNG, "image/png")) for i in range(self.items)]
+		r = self.session.post(
+			f"{self.base_url}/create_order",
+			data={"email": "bench@example.com", "price_rub": "99", "anonUserId": anon},
+			files=files,
+			timeout=120,
+		)
+		t["create_order"] = time.perf_counter() - started
+		if r.status_code != 200:
+			t["error"] = f"create_order {r.status_code}"
+			return t
+		order_id = r.json()["orderId"]
+
+		s = time.perf_counter()
+		r = self.session.post(
+			f"{self.base_url}/yookassa/webhook",
+			json={"event": "payment.succeeded", "object": {
+				"id": uuid.uuid4().hex, "status": "succeeded", "amount": {"value": "99.00", "currency": "RUB"},
+				"metadata": {"order_id": order_id},
+			}},
+			timeout=120,
+		)
+		t["yookassa_webhook"] = time.perf_counter() - s
+		if r.status_code != 200:
+			t["error"] = f"webhook {r.status_code}"
+			return t
+
+		polls: List[float] = []
+		deadline = time.monotonic() + self.results_timeout
+		etag = None
+		while time.monotonic() < deadline:
+			s = time.perf_counter()
+			headers = {"If-None-Match": etag} if etag else {}
+			r = self.session.get(f"{self.base_url}/results", params={"request_id": order_id}, headers=headers, timeout=120)
+			polls.append(time.perf_counter() - s)
+			if r.status_code == 200:
+				etag = r.headers.get("ETag")
+				if len(r.json().get("links") or []) >= self.items:
+					t["ok"] = True
+					break
+			time.sleep(self.results_interval)
+		t["results_polls"] = polls
+		t["time_to_video"] = time.perf_counter() - started
+		if not t["ok"]:
+			t["error"] = "results timeout"
+		return t
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+	workdir = tempfile.mkdtemp(prefix="livephoto-bench-")
+	fal = FalStub(latency=args.fal_latency, video_size=args.video_kb * 1024, send_webhooks=not args.no_fal_webhooks).start()
+	yk = YooKassaStub(latency=args.yookassa_latency).start()
+	s3_url, s3_handle = start_s3()
+	smtp = SmtpSink().start()
+	port = _free_port()
+	env = {
+		"FAL_KEY": "bench",
+		"FAL_ENDPOINT": "fal-ai/bench/image-to-video",
+		"FAL_QUEUE_BASE": fal.base_url,
+		"YOOKASSA_SHOP_ID": "bench",
+		"YOOKASSA_API_KEY": "bench",
+		"YOOKASSA_API_BASE": yk.base_url,
+		"S3_ENDPOINT_URL": s3_url,
+		"S3_ACCESS_KEY_ID": "bench",
+		"S3_SECRET_ACCESS_KEY": "bench",
+		"S3_BUCKET_NAME": BUCKET,
+		"S3_REGION_NAME": "us-east-1",
+		"SMTP_HOST": smtp.host,
+		"SMTP_PORT": str(smtp.port),
+		"SMTP_USE_SSL": "false",
+		"PUBLIC_API_BASE_URL": f"http://127.0.0.1:{port}",
+		"POLL_INTERVAL_SECONDS": str(args.poll_interval),
+		"LOG_DIR": os.path.join(workdir, "all_logs"),
+		"TRACES_DIR": os.path.join(workdir, "traces"),
+	}
+	try:
+		import boto3
+
+		boto3.client(
+			"s3", endpoint_url=s3_url, aws_access_key_id="bench", aws_secret_access_key="bench", region_name="us-east-1",
+		).create_bucket(Bucket=BUCKET)
+	except Exception:
+		pass
+
+	app = AppProcess(env, workdir, port, args.workers)
+	report: Dict[str, Any] = {"config": vars(args)}
+	try:
+		report["cold_start_seconds"] = round(app.start(), 3)
+		rss_samples: List[int] = []
+		stop_sampling = threading.Event()
+
+		def _sample_rss() -> None:
+			while not stop_sampling.wait(0.5):
+				v = rss_bytes(app.proc.pid) if app.proc else None
+				if v:
+					rss_samples.append(v)
+
+		threading.Thread(target=_sample_rss, daemon=True).start()
+
+		flows: List[Dict[str, Any]] = []
+		total = max(1, int(args.rate * args.duration))
+		started = time.perf_counter()
+		with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+			futures = []
+			for i in range(total):
+				# открытая модель нагрузки: заявки поступают с фиксированной частотой
+				target = started + i / args.rate
+				delay = target - time.perf_counter()
+				if delay > 0:
+					time.sleep(delay)
+				flow = Flow(app.base_url, args.items, args.results_interval, args.results_timeout)
+				futures.append(pool.submit(flow.run))
+			for f in futures:
+				try:
+					flows.append(f.result())
+				except Exception as exc:
+					flows.append({"ok": False, "error": repr(exc)})
+		wall = time.perf_counter() - started
+		stop_sampling.set()
+
+		ok = [f for f in flows if f.get("ok")]
+		report["flows"] = {"total": len(flows), "ok": len(ok), "failed": len(flows) - len(ok)}
+		report["errors"] = sorted({f.get("error") for f in flows if f.get("error")})
+		report["wall_seconds"] = round(wall, 3)
+		report["throughput_orders_per_s"] = round(len(ok) / wall, 3) if wall else 0.0
+		report["latency_seconds"] = {
+			"create_order": percentiles([f["create_order"] for f in flows if "create_order" in f]),
+			"yookassa_webhook": percentiles([f["yookassa_webhook"] for f in flows if "yookassa_webhook" in f]),
+			"results_poll": percentiles([p for f in flows for p in f.get("results_polls") or []]),
+			"time_to_video": percentiles([f["time_to_video"] for f in ok]),
+		}
+		report["rss_bytes"] = {"max": max(rss_samples) if rss_samples else None, "last": rss_samples[-1] if rss_samples else None}
+		report["store"] = dir_size(os.path.join(workdir, "logs"))
+		report["logs"] = dir_size(os.path.join(workdir, "all_logs"))
+		report["emails_sent"] = smtp.messages
+	finally:
+		app.stop()
+		fal.stop()
+		yk.stop()
+		smtp.stop()
+		try:
+			s3_handle.stop()
+		except Exception:
+			pass
+		if not args.keep_workdir:
+			shutil.rmtree(workdir, ignore_errors=True)
+		else:
+			report["workdir"] = workdir
+	return report
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--rate", type=float, default=1.0, help="заявок в секунду")
+	parser.add_argument("--duration", type=float, default=20.0, help="длительность подачи нагрузки, с")
+	parser.add_argument("--items", type=int, default=1, help="фото в заявке")
+	parser.add_argument("--concurrency", type=int, default=64, help="максимум одновременных клиентов")
+	parser.add_argument("--workers", type=int, default=1, help="воркеров uvicorn")
+	parser.add_argument("--fal-latency", type=float, default=5.0, help="время генерации в заглушке fal, с")
+	parser.add_argument("--no-fal-webhooks", action="store_true", help="не звать /fal/webhook (только поллер)")
+	parser.add_argument("--video-kb", type=int, default=512, help="размер видео из заглушки fal, КБ")
+	parser.add_argument("--yookassa-latency", type=float, default=0.05)
+	parser.add_argument("--poll-interval", type=float, default=2.0, help="POLL_INTERVAL_SECONDS приложения")
+	parser.add_argument("--results-interval", type=float, default=1.0, help="пауза между опросами /results")
+	parser.add_argument("--results-timeout", type=float, default=120.0)
+	parser.add_argument("--keep-workdir", action="store_true")
+	parser.add_argument("--out", help="куда записать JSON-отчёт")
+	args = parser.parse_args(argv)
+	report = run(args)
+	text = json.dumps(report, ensure_ascii=False, indent=2)
+	if args.out:
+		with open(args.out, "w", encoding="utf-8") as f:
+			f.write(text)
+	print(text)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,110 @@
+"""Отчёт о времени импорта и холодного старта API-процесса.
+
+Запускает `python -X importtime -c "import app.main"` в чистом интерпретаторе несколько раз
+(берётся лучший прогон), суммирует время по пакетам верхнего уровня и проверяет, что тяжёлые
+клиенты (boto3, fal_client, requests, smtplib) не загружаются при импорте. С --serve дополнительно
+меряет время от запуска uvicorn до первого ответа /healthz.
+
+Пример:
+	python -m bench.import_time --runs 5 --serve --out bench_import.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+
+from bench.e2e_load import REPO_ROOT, AppProcess
+from bench.stubs import _free_port
+
+
+HEAVY_MODULES = ("boto3", "botocore", "fal_client", "requests", "smtplib", "httpx")
+
+_PROBE = (
+	"import sys, time, json; t = time.perf_counter(); import app.main; "
+	"print(json.dumps({'wall_ms': (time.perf_counter() - t) * 1000, "
+	"'heavy': [m for m in %r if m in sys.modules]}))" % (HEAVY_MODULES,)
+)
+
+
+def _parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+	"""Строки 'import time: self | cumulative | name' -> [(name, self_us, cumulative_us)]."""
+	rows: List[Tuple[str, int, int]] = []
+	for line in stderr.splitlines():
+		if not line.startswith("import time:") or "self [us]" in line:
+			continue
+		try:
+			_, rest = line.split(":", 1)
+			self_us, cum_us, name = (part.strip() for part in rest.split("|", 2))
+			rows.append((name, int(self_us), int(cum_us)))
+		except ValueError:
+			continue
+	return rows
+
+
+def run_once(env: Dict[str, str]) -> Dict[str, Any]:
+	proc = subprocess.run(
+		[sys.executable, "-X", "importtime", "-c", _PROBE],
+		cwd=tempfile.gettempdir(),
+		env=env,
+		capture_output=True,
+		text=True,
+		check=True,
+	)
+	probe = json.loads(proc.stdout.strip().splitlines()[-1])
+	rows = _parse_importtime(proc.stderr)
+	by_package: Dict[str, int] = {}
+	for name, self_us, _ in rows:
+		top = name.split(".")[0]
+		by_package[top] = by_package.get(top, 0) + self_us
+	return {
+		"wall_ms": round(probe["wall_ms"], 1),
+		"heavy_modules_loaded": probe["heavy"],
+		"modules": len(rows),
+		"top_packages_ms": {k: round(v / 1000, 1) for k, v in sorted(by_package.items(), key=lambda kv: -kv[1])[:15]},
+		"top_cumulative_ms": [
+			{"module": name, "ms": round(cum / 1000, 1)}
+			for name, _, cum in sorted(rows, key=lambda r: -r[2])[:15]
+		],
+	}
+
+
+def measure_serve(env: Dict[str, str]) -> float:
+	workdir = tempfile.mkdtemp(prefix="livephoto-import-")
+	app = AppProcess({**env, "LOG_DIR": os.path.join(workdir, "all_logs")}, workdir, _free_port(), 1)
+	try:
+		return round(app.start(), 3)
+	finally:
+		app.stop()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--runs", type=int, default=5)
+	parser.add_argument("--serve", action="store_true", help="также замерить время до первого /healthz под uvicorn")
+	parser.add_argument("--out", help="куда записать JSON-отчёт")
+	args = parser.parse_args(argv)
+
+	env = {**os.environ, "PYTHONPATH": REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""), "FAL_KEY": os.environ.get("FAL_KEY", "bench")}
+	runs = [run_once(env) for _ in range(max(1, args.runs))]
+	best = min(runs, key=lambda r: r["wall_ms"])
+	report: Dict[str, Any] = {
+		"import_app_main_ms": {"best": best["wall_ms"], "all": [r["wall_ms"] for r in runs]},
+		"heavy_modules_loaded": best["heavy_modules_loaded"],
+		"modules": best["modules"],
+		"top_packages_ms": best["top_packages_ms"],
+		"top_cumulative_ms": best["top_cumulative_ms"],
+	}
+	if args.serve:
+		report["uvicorn_time_to_healthz_seconds"] = measure_serve(env)
+	text = json.dumps(report, ensure_ascii=False, indent=2)
+	if args.out:
+		with open(args.out, "w", encoding="utf-8") as f:
+			f.write(text)
+	print(text)
+
+
+if __name__ == "__main__":
+	main()
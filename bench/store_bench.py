@@ -0,0 +1,177 @@
+"""Микробенчмарки JsonOrderStore на реалистичной истории заявок.
+
+Генерирует синтетические директории logs/ с историей в 30/180/365 дней и замеряет
+save, load, update_status, list_recent_orders и стоимость хранилища за один тик поллера.
+Результат пишется в JSON для сравнения между ревизиями.
+
+Пример:
+	python -m bench.store_bench --days 30 180 365 --orders-per-day 150 --out bench_store.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from app.utils.file_utils import JsonOrderStore
+
+
+def synthetic_order(created_at: datetime, items: int, status: str) -> Dict[str, Any]:
+	"""Заявка в форме, которую пишет приложение (после оплаты и генерации)."""
+	order_id = f"order-{uuid.uuid4().hex[:8]}"
+	anon = f"anon_{uuid.uuid4()}"
+	gen_items = []
+	for i in range(items):
+		it: Dict[str, Any] = {
+			"image_url": f"s3://livephoto/uploads/{anon}/{order_id}/{uuid.uuid4()}.png",
+			"public_image_url": f"https://storage.example.net/livephoto/uploads/{anon}/{order_id}/img{i}.png?X-Amz-Algorithm=AWS4-HMAC-SHA256&X-Amz-Expires=259200&X-Amz-Signature={uuid.uuid4().hex * 2}",
+			"expires_in": 259200,
+			"prompt": "Animate this image",
+			"input_s3_url": f"s3://livephoto/uploads/{anon}/{order_id}/{uuid.uuid4()}.png",
+			"status": status,
+		}
+		if status in ("running", "succeeded"):
+			it["request_id"] = str(uuid.uuid4())
+			it["model_id"] = "fal-ai/kling-video"
+			it["submitted_at"] = (created_at + timedelta(minutes=2)).isoformat()
+		if status == "succeeded":
+			it["result_s3_url"] = f"s3://livephoto/video/{anon}/{order_id}/{i}.mp4"
+			it["video_url"] = it["result_s3_url"]
+			it["public_video_url"] = f"https://storage.example.net/livephoto/video/{anon}/{order_id}/{i}.mp4?X-Amz-Signature={uuid.uuid4().hex * 2}"
+			it["public_url_created_at"] = (created_at + timedelta(minutes=5)).isoformat()
+			it["fal_response_url"] = f"https://v3.fal.media/files/{uuid.uuid4().hex}.mp4"
+		gen_items.append(it)
+	return {
+		"order_id": order_id,
+		"request_id": order_id,
+		"anonUserId": anon,
+		"email": "user@example.com",
+		"price_rub": 89.0 * items,
+		"created_at": created_at.isoformat(),
+		"payment": {"provider": "yookassa", "status": "paid" if status != "pending" else "gateway_pending", "payment_id": str(uuid.uuid4())},
+		"generation": {
+			"status": {"pending": "waiting_payment", "running": "in_progress"}.get(status, "completed"),
+			"items": gen_items,
+		},
+	}
+
+
+def generate_history(base_dir: str, days: int, orders_per_day: int, seed: int = 42) -> List[str]:
+	"""Пишет days дневных файлов напрямую (минуя save) и возвращает order_id всех заявок."""
+	rnd = random.Random(seed)
+	os.makedirs(base_dir, exist_ok=True)
+	today = datetime.utcnow().replace(hour=12, minute=0, second=0, microsecond=0)
+	ids: List[str] = []
+	for d in range(days, 0, -1):
+		day = today - timedelta(days=d)
+		day_orders = []
+		for n in range(orders_per_day):
+			created = day + timedelta(seconds=n * (86400 // max(1, orders_per_day)) - 43200)
+			created = max(created, day.replace(hour=0))
+			# недавние дни содержат незавершённые элементы, которые видит поллер
+			status = rnd.choices(["succeeded", "failed", "pending", "running"], weights=[80, 5, 13, 2 if d <= 2 else 0])[0]
+			order = synthetic_order(created, rnd.choice([1, 1, 1, 2, 3, 5]), status)
+			day_orders.append(order)
+			ids.append(order["order_id"])
+		with open(os.path.join(base_dir, f"{day.date().isoformat()}.json"), "w", encoding="utf-8") as f:
+			json.dump(day_orders, f, ensure_ascii=False, indent=2)
+	return ids
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> Dict[str, float]:
+	samples: List[float] = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		fn()
+		samples.append((time.perf_counter() - start) * 1000)
+	samples.sort()
+	return {
+		"n": repeat,
+		"mean_ms": round(statistics.fmean(samples), 3),
+		"p50_ms": round(samples[len(samples) // 2], 3),
+		"p95_ms": round(samples[min(len(samples) - 1, int(0.95 * (len(samples) - 1)))], 3),
+		"max_ms": round(samples[-1], 3),
+	}
+
+
+def poll_tick(store: JsonOrderStore, change_ratio: float, rnd: random.Random) -> int:
+	"""Стоимость хранилища за тик поллера: чтение последних 7 дней + сохранение изменённых заявок."""
+	saved = 0
+	for order in store.list_recent_orders(max_files=7):
+		items = (order.get("generation") or {}).get("items") or []
+		pending = [it for it in items if it.get("request_id") and it.get("status") not in ("succeeded", "failed")]
+		if pending and rnd.random() < change_ratio:
+			store.save(order)
+			saved += 1
+	return saved
+
+
+def bench_history(days: int, orders_per_day: int, repeat: int, seed: int) -> Dict[str, Any]:
+	workdir = tempfile.mkdtemp(prefix=f"store-bench-{days}d-")
+	try:
+		base_dir = os.path.join(workdir, "logs")
+		gen_started = time.perf_counter()
+		ids = generate_history(base_dir, days, orders_per_day, seed)
+		result: Dict[str, Any] = {
+			"days": days,
+			"orders": len(ids),
+			"generate_seconds": round(time.perf_counter() - gen_started, 3),
+		}
+		store = JsonOrderStore(base_dir)
+		rnd = random.Random(seed)
+		now = datetime.utcnow()
+
+		result["save_new"] = measure(lambda: store.save(synthetic_order(now, 1, "pending")), repeat)
+		recent_ids = ids[-orders_per_day:]
+		old_ids = ids[:orders_per_day]
+		result["load_recent"] = measure(lambda: store.load(rnd.choice(recent_ids)), repeat)
+		result["load_oldest"] = measure(lambda: store.load(rnd.choice(old_ids)), max(1, repeat // 4))
+		result["load_missing"] = measure(lambda: store.load("order-missing"), max(1, repeat // 4))
+		result["update_status_recent"] = measure(lambda: store.update_status(rnd.choice(recent_ids), "PAID"), repeat)
+		result["list_recent_orders_7"] = measure(lambda: store.list_recent_orders(max_files=7), max(1, repeat // 4))
+		result["poll_tick"] = measure(lambda: poll_tick(store, 0.5, rnd), max(1, repeat // 10))
+		result["store_bytes"] = sum(os.path.getsize(os.path.join(base_dir, n)) for n in os.listdir(base_dir) if os.path.isfile(os.path.join(base_dir, n)))
+		return result
+	finally:
+		shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _git_rev() -> Optional[str]:
+	try:
+		return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+	except Exception:
+		return None
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--days", type=int, nargs="+", default=[30, 180, 365])
+	parser.add_argument("--orders-per-day", type=int, default=100)
+	parser.add_argument("--repeat", type=int, default=40)
+	parser.add_argument("--seed", type=int, default=42)
+	parser.add_argument("--out", help="куда записать JSON с результатами")
+	args = parser.parse_args(argv)
+	report = {
+		"timestamp": datetime.utcnow().isoformat(),
+		"git_rev": _git_rev(),
+		"python": platform.python_version(),
+		"config": vars(args),
+		"results": [bench_history(d, args.orders_per_day, args.repeat, args.seed) for d in args.days],
+	}
+	text = json.dumps(report, ensure_ascii=False, indent=2)
+	if args.out:
+		with open(args.out, "w", encoding="utf-8") as f:
+			f.write(text)
+	print(text)
+
+
+if __name__ == "__main__":
+	main()
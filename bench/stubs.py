@@ -0,0 +1,340 @@
+"""Локальные заглушки внешних зависимостей для бенчмарков: fal queue, S3, YooKassa, SMTP.
+
+Все серверы — stdlib ThreadingHTTPServer на 127.0.0.1 со случайным портом. Если установлены
+moto (S3) и aiosmtpd (SMTP), используются они; иначе — встроенные минимальные реализации.
+"""
+import json
+import os
+import socketserver
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+
+	def log_message(self, fmt: str, *args: Any) -> None:
+		pass
+
+	def _read_body(self) -> bytes:
+		length = int(self.headers.get("Content-Length") or 0)
+		return self.rfile.read(length) if length else b""
+
+	def _send(self, status: int, body: bytes = b"", content_type: str = "application/json", headers: Optional[Dict[str, str]] = None) -> None:
+		self.send_response(status)
+		self.send_header("Content-Type", content_type)
+		self.send_header("Content-Length", str(len(body)))
+		for k, v in (headers or {}).items():
+			self.send_header(k, v)
+		self.end_headers()
+		if body and self.command != "HEAD":
+			self.wfile.write(body)
+
+	def _send_json(self, status: int, payload: Any) -> None:
+		self._send(status, json.dumps(payload).encode())
+
+
+class _StubServer:
+	"""Запуск ThreadingHTTPServer в фоновом потоке."""
+
+	def __init__(self, handler_cls: type) -> None:
+		self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler_cls)
+		self.httpd.daemon_threads = True
+		self.httpd.stub = self  # доступ к состоянию из handler
+		self._thread = threading.Thread(target=self.httpd.serve_forever, name=f"stub-{handler_cls.__name__}", daemon=True)
+
+	@property
+	def base_url(self) -> str:
+		host, port = self.httpd.server_address[:2]
+		return f"http://{host}:{port}"
+
+	def start(self) -> "_StubServer":
+		self._thread.start()
+		return self
+
+	def stop(self) -> None:
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+
+# --- fal queue ---
+
+class _FalHandler(_QuietHandler):
+	def do_POST(self) -> None:
+		stub: FalStub = self.server.stub
+		payload = json.loads(self._read_body() or b"{}")
+		model = self.path.strip("/")
+		request_id = stub.submit(model, payload)
+		self._send_json(200, {"request_id": request_id, "status": "IN_QUEUE"})
+
+	def do_GET(self) -> None:
+		stub: FalStub = self.server.stub
+		path = urlparse(self.path).path
+		if path.startswith("/files/"):
+			self._send(200, stub.video_bytes, content_type="video/mp4")
+			return
+		parts = path.strip("/").split("/")
+		# {namespace}/{model}/requests/{id}[/status]
+		if "requests" not in parts:
+			self._send_json(404, {"detail": "not found"})
+			return
+		idx = parts.index("requests")
+		model = "/".join(parts[:idx])
+		request_id = parts[idx + 1] if len(parts) > idx + 1 else ""
+		job = stub.jobs.get(request_id)
+		if not job:
+			self._send_json(404, {"detail": "unknown request"})
+			return
+		done = time.monotonic() >= job["ready_at"]
+		response_url = f"{stub.base_url}/{model}/requests/{request_id}"
+		if parts[-1] == "status":
+			self._send_json(200, {"status": "COMPLETED" if done else "IN_PROGRESS", "response_url": response_url})
+			return
+		if not done:
+			self._send_json(400, {"detail": "still in progress"})
+			return
+		self._send_json(200, {"video": {"url": f"{stub.base_url}/files/{request_id}.mp4"}})
+
+
+class FalStub(_StubServer):
+	"""Очередь fal: задача завершается через latency секунд; при наличии webhook_url — зовёт его."""
+
+	def __init__(self, latency: float = 5.0, video_size: int = 512 * 1024, send_webhooks: bool = True) -> None:
+		super().__init__(_FalHandler)
+		self.latency = latency
+		self.video_bytes = os.urandom(video_size)
+		self.send_webhooks = send_webhooks
+		self.jobs: Dict[str, Dict[str, Any]] = {}
+		self._session = requests.Session()
+
+	def submit(self, model: str, payload: Dict[str, Any]) -> str:
+		request_id = uuid.uuid4().hex
+		self.jobs[request_id] = {"model": model, "ready_at": time.monotonic() + self.latency}
+		webhook_url = payload.get("webhook_url")
+		if self.send_webhooks and webhook_url:
+			timer = threading.Timer(self.latency, self._fire_webhook, args=(webhook_url, request_id))
+			timer.daemon = True
+			timer.start()
+		return request_id
+
+	def _fire_webhook(self, webhook_url: str, request_id: str) -> None:
+		try:
+			self._session.post(
+				webhook_url,
+				json={"request_id": request_id, "status": "COMPLETED", "video_url": f"{self.base_url}/files/{request_id}.mp4"},
+				timeout=300,
+			)
+		except Exception:
+			pass
+
+
+# --- YooKassa ---
+
+class _YooKassaHandler(_QuietHandler):
+	def do_POST(self) -> None:
+		stub: YooKassaStub = self.server.stub
+		payload = json.loads(self._read_body() or b"{}")
+		if stub.latency:
+			time.sleep(stub.latency)
+		payment_id = uuid.uuid4().hex
+		stub.payments[payment_id] = payload
+		self._send_json(200, {
+			"id": payment_id,
+			"status": "pending",
+			"amount": payload.get("amount"),
+			"metadata": payload.get("metadata"),
+			"confirmation": {"type": "redirect", "confirmation_url": f"{stub.base_url}/checkout/{payment_id}"},
+		})
+
+	def do_GET(self) -> None:
+		stub: YooKassaStub = self.server.stub
+		payment_id = urlparse(self.path).path.rstrip("/").rsplit("/", 1)[-1]
+		payload = stub.payments.get(payment_id)
+		if payload is None:
+			self._send_json(404, {"type": "error", "code": "not_found"})
+			return
+		self._send_json(200, {"id": payment_id, "status": "succeeded", "amount": payload.get("amount"), "metadata": payload.get("metadata")})
+
+
+class YooKassaStub(_StubServer):
+	def __init__(self, latency: float = 0.05) -> None:
+		super().__init__(_YooKassaHandler)
+		self.latency = latency
+		self.payments: Dict[str, Dict[str, Any]] = {}
+
+
+# --- S3 ---
+
+class _S3Handler(_QuietHandler):
+	"""Минимальный S3 (path-style): PUT/GET/HEAD/DELETE объекта, ListObjectsV2 и POST ?delete."""
+
+	def _bucket_key(self) -> Tuple[str, str]:
+		path = urlparse(self.path).path.lstrip("/")
+		bucket, _, key = path.partition("/")
+		return bucket, key
+
+	def do_PUT(self) -> None:
+		body = self._read_body()
+		bucket, key = self._bucket_key()
+		self.server.stub.objects[(bucket, key)] = (body, self.headers.get("Content-Type") or "application/octet-stream")
+		self._send(200, b"", headers={"ETag": f'"{uuid.uuid4().hex}"'})
+
+	def do_GET(self) -> None:
+		bucket, key = self._bucket_key()
+		if not key:
+			self._list(bucket)
+			return
+		obj = self.server.stub.objects.get((bucket, key))
+		if obj is None:
+			self._send(404, b"<Error><Code>NoSuchKey</Code></Error>", content_type="application/xml")
+			return
+		body, ctype = obj
+		rng = self.headers.get("Range")
+		if rng and rng.startswith("bytes="):
+			start_s, _, end_s = rng[6:].partition("-")
+			start = int(start_s or 0)
+			end = min(int(end_s) if end_s else len(body) - 1, len(body) - 1)
+			self._send(206, body[start:end + 1], content_type=ctype, headers={"Content-Range": f"bytes {start}-{end}/{len(body)}"})
+			return
+		self._send(200, body, content_type=ctype)
+
+	do_HEAD = do_GET
+
+	def _list(self, bucket: str) -> None:
+		"""ListObjectsV2 без пагинации (для заглушки достаточно)."""
+		from xml.sax.saxutils import escape
+
+		prefix = (parse_qs(urlparse(self.path).query).get("prefix") or [""])[0]
+		contents = "".join(
+			f"<Contents><Key>{escape(k)}</Key><Size>{len(body)}</Size></Contents>"
+			for (b, k), (body, _) in sorted(self.server.stub.objects.items())
+			if b == bucket and k.startswith(prefix)
+		)
+		body = f"<ListBucketResult><Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix><IsTruncated>false</IsTruncated>{contents}</ListBucketResult>"
+		self._send(200, body.encode(), content_type="application/xml")
+
+	def do_DELETE(self) -> None:
+		self.server.stub.objects.pop(self._bucket_key(), None)
+		self._send(204)
+
+	def do_POST(self) -> None:
+		body = self._read_body()
+		bucket, _ = self._bucket_key()
+		if "delete" in parse_qs(urlparse(self.path).query, keep_blank_values=True):
+			import xml.etree.ElementTree as ET
+			root = ET.fromstring(body)
+			deleted = []
+			for el in root.iter():
+				if el.tag.endswith("Key") and el.text:
+					self.server.stub.objects.pop((bucket, el.text), None)
+					deleted.append(f"<Deleted><Key>{el.text}</Key></Deleted>")
+			self._send(200, f"<DeleteResult>{''.join(deleted)}</DeleteResult>".encode(), content_type="application/xml")
+			return
+		self._send(400)
+
+
+class LocalS3(_StubServer):
+	def __init__(self) -> None:
+		super().__init__(_S3Handler)
+		self.objects: Dict[Tuple[str, str], Tuple[bytes, str]] = {}
+
+
+def start_s3() -> Tuple[str, Any]:
+	"""Поднимает moto server (если установлен) или встроенный LocalS3; возвращает (endpoint_url, handle)."""
+	try:
+		from moto.server import ThreadedMotoServer  # type: ignore
+
+		server = ThreadedMotoServer(ip_address="127.0.0.1", port=0)
+		server.start()
+		host, port = server.get_host_and_port()
+		return f"http://{host}:{port}", server
+	except Exception:
+		s3 = LocalS3().start()
+		return s3.base_url, s3
+
+
+# --- SMTP ---
+
+class _SmtpSinkHandler(socketserver.StreamRequestHandler):
+	"""Минимальный SMTP-приёмник: принимает письма и только считает их."""
+
+	def _reply(self, line: str) -> None:
+		self.wfile.write((line + "\r\n").encode())
+
+	def handle(self) -> None:
+		self._reply("220 sink ready")
+		in_data = False
+		while True:
+			raw = self.rfile.readline()
+			if not raw:
+				return
+			line = raw.decode(errors="replace").rstrip("\r\n")
+			if in_data:
+				if line == ".":
+					in_data = False
+					self.server.sink.messages += 1
+					self._reply("250 OK")
+				continue
+			cmd = line[:4].upper()
+			if cmd in ("EHLO", "HELO"):
+				self._reply("250 sink")
+			elif cmd == "DATA":
+				in_data = True
+				self._reply("354 End data with <CR><LF>.<CR><LF>")
+			elif cmd == "QUIT":
+				self._reply("221 Bye")
+				return
+			else:
+				self._reply("250 OK")
+
+
+class SmtpSink:
+	def __init__(self) -> None:
+		self.messages = 0
+		self._controller: Any = None
+		self._server: Optional[socketserver.ThreadingTCPServer] = None
+		self.host = "127.0.0.1"
+		self.port = 0
+
+	def start(self) -> "SmtpSink":
+		try:
+			from aiosmtpd.controller import Controller  # type: ignore
+
+			sink = self
+
+			class _Handler:
+				async def handle_DATA(self, server, session, envelope):  # noqa: N802
+					sink.messages += 1
+					return "250 OK"
+
+			self._controller = Controller(_Handler(), hostname=self.host, port=_free_port())
+			self._controller.start()
+			self.port = self._controller.port
+		except ImportError:
+			self._server = socketserver.ThreadingTCPServer((self.host, 0), _SmtpSinkHandler)
+			self._server.daemon_threads = True
+			self._server.sink = self
+			self.port = self._server.server_address[1]
+			threading.Thread(target=self._server.serve_forever, name="stub-smtp", daemon=True).start()
+		return self
+
+	def stop(self) -> None:
+		if self._controller is not None:
+			self._controller.stop()
+		if self._server is not None:
+			self._server.shutdown()
+			self._server.server_close()
+
+
+def _free_port() -> int:
+	import socket
+
+	with socket.socket() as s:
+		s.bind(("127.0.0.1", 0))
+		return s.getsockname()[1]